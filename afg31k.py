@@ -2,7 +2,7 @@
 import datetime
 import re
 import numpy as np
-from daemon import SimpleFactory, SimpleProtocol, catch
+from daemon import SimpleFactory, SimpleProtocol, CommandQueue, catch
 
 
 class DaemonProtocol(SimpleProtocol):
@@ -107,9 +107,14 @@ class afg31k_Protocol(SimpleProtocol):
     _debug = False  # Display all traffic for debug purposes
     _refresh = 0.01
 
+    # Command queue settings
+    _depth = 1  # Number of queries sent without waiting for replies
+    _timeout = 2.0  # Seconds to wait for the reply
+    _retries = 1  # Number of re-sends for the queries without reply
+
     def __init__(self):
         SimpleProtocol.__init__(self)
-        self.commands = []  # Queue of command sent to the device which will provide replies, each entry is a dict with keys "cmd","source","timeStamp"
+        self.commands = CommandQueue(self, depth=self._depth, timeout=self._timeout, retries=self._retries)  # Queue of commands sent to the device
         self.status_commands = ['OUTP1?', 'OUTP2?',
                                 'SOUR1:FUNC?', 'SOUR2:FUNC?',
                                 'SOUR1:FREQ?', 'SOUR2:FREQ?',
@@ -126,13 +131,13 @@ class afg31k_Protocol(SimpleProtocol):
     @catch
     def connectionMade(self):
         SimpleProtocol.connectionMade(self)
-        self.commands = []
+        self.commands.clear()
         # We will set this flag when we receive any reply from the device
         self.object['hw_connected'] = 1
 
     @catch
     def connectionLost(self, reason):
-        self.commands = []
+        self.commands.clear()
         SimpleProtocol.connectionLost(self, reason)
         resetObjStatus(self.object)
 
@@ -144,74 +149,48 @@ class afg31k_Protocol(SimpleProtocol):
         # Update the last reply timestamp
         obj['hw_last_reply_time'] = datetime.datetime.utcnow()
         obj['hw_connected'] = 1
+        # Match the reply to the oldest command sent, forwarding it to the client who sent the command
+        entry = self.commands.reply(string)
+        if entry is None:
+            return
+        ccmd = entry['cmd'].decode()
         # Process the device reply
-        while len(self.commands):
-            ccmd = self.commands[0]['cmd'].decode()
-            # We have some sent commands in the queue - let's check what was the oldest one
-            br = False
-            for ch in ['1', '2']:
-                if ccmd == 'OUTP'+ch+'?':
-                    obj['CH'+ch+'_Stat'] = 'OFF' if string[0] == '0' else 'ON'
-                    br = True
-                    break
-                if ccmd == 'SOUR'+ch+':FUNC?':
-                    obj['CH'+ch+'_Func'] = string
-                    br = True
-                    break
-                if ccmd == 'SOUR'+ch+':FREQ?':
-                    obj['CH'+ch+'_Freq'] = float(string)
-                    br = True
-                    break
-                if ccmd == 'SOUR'+ch+':VOLT:UNIT?':
-                    obj['CH'+ch+'_Unit'] = string
-                    br = True
-                    break
-                if ccmd == 'SOUR'+ch+':VOLT:AMPL?':
-                    obj['CH'+ch+'_Ampl'] = float(string)
-                    br = True
-                    break
-                if ccmd == 'SOUR'+ch+':VOLT:OFFS?':
-                    obj['CH'+ch+'_Offs'] = float(string)
-                    br = True
-                    break
-                if ccmd == 'SOUR'+ch+':FUNC:RAMP:SYMM?':
-                    obj['CH'+ch+'_RSym'] = float(string)
-                    br = True
-                    break
-
-            if br:
+        for ch in ['1', '2']:
+            if ccmd == 'OUTP'+ch+'?':
+                obj['CH'+ch+'_Stat'] = 'OFF' if string[0] == '0' else 'ON'
+                break
+            if ccmd == 'SOUR'+ch+':FUNC?':
+                obj['CH'+ch+'_Func'] = string
+                break
+            if ccmd == 'SOUR'+ch+':FREQ?':
+                obj['CH'+ch+'_Freq'] = float(string)
+                break
+            if ccmd == 'SOUR'+ch+':VOLT:UNIT?':
+                obj['CH'+ch+'_Unit'] = string
+                break
+            if ccmd == 'SOUR'+ch+':VOLT:AMPL?':
+                obj['CH'+ch+'_Ampl'] = float(string)
+                break
+            if ccmd == 'SOUR'+ch+':VOLT:OFFS?':
+                obj['CH'+ch+'_Offs'] = float(string)
+                break
+            if ccmd == 'SOUR'+ch+':FUNC:RAMP:SYMM?':
+                obj['CH'+ch+'_RSym'] = float(string)
                 break
-
-            # some more commans
-            break
-        else:
-            return
-        if not self.commands[0]['source'] == 'itself':
-            # in case the origin of the query was not itself, forward the answer to the origin
-            obj['daemon'].messageAll(string, self.commands[0]['source'])
-        self.commands.pop(0)
 
     @catch
     def update(self):
-        if self._debug and len(self.commands):
-            print('--------self.commands--------------')
-            for cc in self.commands:
-                print(cc)
-            print('----------------------')
+        if self._debug:
+            print('commands:', self.commands.stats())
         # first check if device is hw_connected
         if self.object['hw_connected'] == 0:
             # if not connected do not send any commands
             return
 
-        if len(self.commands) and not self.commands[0]['sent']:
-            SimpleProtocol.message(self, self.commands[0]['cmd'])
-            if not self.commands[0]['keep']:
-                self.commands.pop(0)
-            else:
-                self.commands[0]['sent'] = True
-        elif not len(self.commands):
+        # Commands are sent by the queue itself, we just need to poll the status when it is empty
+        if not len(self.commands):
             for k in self.status_commands:
-                self.commands.append({'cmd': k.encode('ascii'), 'source': 'itself', 'keep': True, 'sent': False})
+                self.commands.add(k.encode('ascii'))
 
     @catch
     def message(self, string, keep=False, source='itself'):
@@ -219,20 +198,13 @@ class afg31k_Protocol(SimpleProtocol):
         Send the message to the controller. If keep=True, expect reply
         """
         if string == b'reset_q':
-            self.commands = []
+            self.commands.clear()
             return
 
-        if string == b'SYST:ERR?':
-            self.commands.insert(0, {'cmd': string, 'source': source, 'keep': keep, 'sent': False})
-            return
-        n = 0
-        for cc in self.commands:
-            if not cc['sent']:
-                break
-            n += 1
+        # Error queries go first, other commands from clients go before the status polling ones
         if self._debug:
-            print('cmd', string, 'from', source, 'will be inserted at', n)
-        self.commands.insert(n, {'cmd': string, 'source': source, 'keep': keep, 'sent': False})
+            print('cmd', string, 'from', source)
+        self.commands.add(string, source=source, keep=keep, priority=string in [b'SYST:ERR?'])
 
 
 def resetObjStatus(obj):
@@ -253,7 +225,8 @@ def resetObjStatus(obj):
     obj['CH2_RSym'] = np.nan
 
 
-if __name__ == '__main__':
+def getOptionParser():
+    """Command-line options of the daemon, also used by host.py"""
     from optparse import OptionParser
     parser = OptionParser(usage="usage: %prog [options] arg")
     parser.add_option('-H', '--hw-host', help='Hardware host to connect', action='store', dest='hw_host', default='192.168.1.15')
@@ -261,7 +234,12 @@ if __name__ == '__main__':
     parser.add_option('-p', '--port', help='Daemon port', action='store', dest='port', type='int', default=7035)
     parser.add_option('-n', '--name', help='Daemon name', action='store', dest='name', default='afg31k')
     parser.add_option("-D", '--debug', help='Debug mode', action="store_true", dest="debug")
-    (options, args) = parser.parse_args()
+
+    return parser
+
+
+def buildDaemon(options, reactor=None):
+    """Create and start the daemon and hardware factories, and return the daemon one"""
     # Object holding actual state and work logic.
     # May be anything that will be passed by reference - list, dict, object etc
     obj = {}
@@ -269,8 +247,8 @@ if __name__ == '__main__':
 
     # Factories for daemon and hardware connections
     # We need two different factories as the protocols are different
-    daemon = SimpleFactory(DaemonProtocol, obj)
-    hw = SimpleFactory(afg31k_Protocol, obj)
+    daemon = SimpleFactory(DaemonProtocol, obj, reactor=reactor)
+    hw = SimpleFactory(afg31k_Protocol, obj, reactor=reactor)
     if options.debug:
         daemon._protocol._debug = True
         hw._protocol._debug = True
@@ -282,4 +260,13 @@ if __name__ == '__main__':
     daemon.listen(options.port)
     # Outgoing connection
     hw.connect(options.hw_host, options.hw_port)
+
+    return daemon
+
+
+if __name__ == '__main__':
+    (options, args) = getOptionParser().parse_args()
+
+    daemon = buildDaemon(options)
+
     daemon._reactor.run()
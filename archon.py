@@ -11,6 +11,13 @@ def dictToString(kwargs, prefix=''):
 
 class DaemonProtocol(SimpleProtocol):
     _debug = False # Display all traffic for debug purposes
+    _status_delta = True  # Status is sent with sendStatus(), so it may be delta-encoded
+
+    def getStatus(self):
+        status = {'hw_connected': self.object['hw_connected']}
+        status.update(self.object['status'])
+
+        return status
 
     @catch
     def processMessage(self, string):
@@ -24,7 +31,7 @@ class DaemonProtocol(SimpleProtocol):
         hw = obj['hw'] # HW factory
 
         if cmd.name == 'get_status':
-            self.message('status hw_connected=%s %s' % (self.object['hw_connected'], dictToString(obj['status'])))
+            self.sendStatus(self.getStatus())
         elif cmd.name == 'status':
             # Global status message from MONITOR
             obj['global'] = cmd.kwargs
@@ -99,19 +106,19 @@ class ArchonProtocol(SimpleProtocol):
 
         # Process the device reply
         if string[0] == '?':
-            print "Error reply for command: %s" % (self.commands.get(id, ''))
+            print("Error reply for command: %s" % (self.commands.get(id, '')))
             daemon.log('Error reply: ' + self.commands.get(id, ''), 'error')
             self.commands.pop(id, '')
             return
         elif string[0] != '<':
-            print "Wrong reply from controller: %s" % string
+            print("Wrong reply from controller: %s" % string)
             return
 
         body = string[3:]
         cmd = Command(body)
 
         # Process and transform specific fields to be more understandable
-        for key in cmd.kwargs:
+        for key in list(cmd.kwargs.keys()):
             newkey = key.replace('/', '_')
             if newkey != key:
                 # Rename the argument key
@@ -123,7 +130,7 @@ class ArchonProtocol(SimpleProtocol):
             cmd.kwargs['BACKPLANE_TYPE'] = {'0':'None', '1':'X12', '2':'X16'}.get(cmd.kwargs['BACKPLANE_TYPE'], 'unknown')
             self.object['Nmods'] = 12 if cmd.kwargs['BACKPLANE_TYPE'] == 'X12' else 16
 
-            for _ in xrange(1, self.object['Nmods']+1):
+            for _ in range(1, self.object['Nmods']+1):
                 cmd.kwargs['MOD%d_TYPE' % _] = {'0':'None',
                                                 '1':'Driver',
                                                 '2':'AD',
@@ -142,20 +149,20 @@ class ArchonProtocol(SimpleProtocol):
         elif self.commands.get(id, '') == 'STATUS':
             cmd.kwargs['POWER'] = {'0':'Unknown', '1':'NotConfigured', '2':'Off', '3':'Intermediate', '4':'On', '5':'Standby'}.get(cmd.kwargs['POWER'], 'unknown')
 
-            if cmd.kwargs.has_key('LOG') and int(cmd.kwargs['LOG']) > 0:
+            if 'LOG' in cmd.kwargs and int(cmd.kwargs['LOG']) > 0:
                 # We have some unread LOG messages
-                for _ in xrange(int(cmd.kwargs['LOG'])):
+                for _ in range(int(cmd.kwargs['LOG'])):
                     self.message('FETCHLOG')
 
             should_update_status = True
         elif self.commands.get(id, '') == 'FETCHLOG':
             # We just fetched some log message, let's send it outwards
             daemon.log(body, 'message')
-            print "Log:", body
+            print("Log:", body)
         elif self.commands.get(id, '') == 'FRAME':
             should_update_status = True
         else:
-            print "ARCHON >> %s" % body
+            print("ARCHON >> %s" % body)
 
         self.commands.pop(id, '')
 
@@ -174,7 +181,7 @@ class ArchonProtocol(SimpleProtocol):
         self.command_id = (self.command_id + 1) % 0x100
 
         if string not in ['STATUS', 'FRAME', 'SYSTEM']:
-            print 'ARCHON << %s' % string
+            print('ARCHON << %s' % string)
 
     @catch
     def update(self):
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Parsing speed of Command for typical messages, comparing the current tokenizer
+with the shlex.split() based one used before. Payloads are the actual Archon
+controller replies recorded in archon_fake.py, daemon status lines, monitor
+set_keywords broadcasts with quoted values, and short repeated commands.
+
+Usage: python3 benchmarks/bench_command.py [-r repeats]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+import shlex
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import wire
+from command import Command
+
+import payloads
+
+
+class LegacyCommand(Command):
+    """Command parsed with shlex.split(), as it was before"""
+    def parse(self, string):
+        self.string = string
+        self.body = string
+        self.chunks = shlex.split(string)
+
+        for i, chunk in enumerate(self.chunks):
+            if '=' not in chunk:
+                if i == 0:
+                    self.name = chunk
+                    self.body = self.string.strip()[len(chunk):].strip()
+                else:
+                    self.args.append(chunk)
+            else:
+                pos = chunk.find('=')
+                self.kwargs[chunk[:pos]] = chunk[pos+1:]
+
+
+def messages():
+    replies = payloads.archon_replies()
+    archon = payloads.archon_status()
+    cryocon = payloads.cryocon_status()
+
+    return [('get_status', 'get_status'),
+            ('get_id', 'get_id'),
+            ('archon STATUS', ' '.join(['<01STATUS'] + replies['STATUS'][0].split())),
+            ('archon SYSTEM', ' '.join(['<01SYSTEM'] + replies['SYSTEM'][0].split())),
+            ('archon status', wire.toString('status', archon)),
+            ('cryocon status', wire.toString('status', cryocon)),
+            ('set_keywords', 'set_keywords ' + ' '.join(['cryocon.%s="%s"' % (_, wire.valueToString(cryocon[_])) for _ in cryocon]))]
+
+
+def measure(cls, string, repeats):
+    t0 = time.perf_counter()
+    for i in range(repeats):
+        cls(string)
+
+    return (time.perf_counter() - t0)/repeats
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-r', '--repeats', help='Number of repeats', action='store', dest='repeats', type='int', default=2000)
+
+    (options, args) = parser.parse_args()
+
+    print("%-16s %8s %8s %12s %12s %8s" % ('message', 'bytes', 'tokens', 'shlex us', 'current us', 'speedup'))
+
+    for title, string in messages():
+        legacy, current = LegacyCommand(string), Command(string)
+        assert legacy.chunks == current.chunks, title
+
+        t_legacy = measure(LegacyCommand, string, options.repeats)
+        t_current = measure(Command, string, options.repeats)
+
+        print("%-16s %8d %8d %12.1f %12.1f %8.1f" % (title, len(string), len(current.chunks),
+                                                     1e6*t_legacy, 1e6*t_current, t_legacy/t_current))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of splitting the incoming stream into messages,
+comparing the old bytes-concatenation approach with framing.LineFramer.
+
+Usage: python3 benchmarks/bench_framing.py [-n nlines] [-c max_chunk]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import re
+import random
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from framing import LineFramer
+
+
+class LegacySplitter(object):
+    """Stream splitting as it was done in SimpleProtocol.dataReceived before LineFramer"""
+    def __init__(self):
+        self._buffer = b''
+        self.count = 0
+
+    def dataReceived(self, data):
+        self._buffer = self._buffer + data
+        while len(self._buffer):
+            try:
+                token, self._buffer = re.split(b'\0|\n', self._buffer, 1)
+                self.processMessage(token.decode('ascii'))
+            except ValueError:
+                break
+
+    def processMessage(self, string):
+        self.count += 1
+
+
+class FramerSplitter(object):
+    def __init__(self):
+        self._framer = LineFramer(b'\0\n')
+        self.count = 0
+
+    def dataReceived(self, data):
+        self._framer.feed(data)
+        for is_binary, view in self._framer.frames():
+            self.processMessage(str(view, 'ascii'))
+
+    def processMessage(self, string):
+        self.count += 1
+
+
+def make_stream(line_size, nlines, seed=1):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(nlines):
+        body = ' '.join('KEY%d=%.3f' % (_, rnd.uniform(-100, 100)) for _ in range(line_size // 12))
+        lines.append(('status ' + body)[:line_size - 1].encode('ascii') + b'\n')
+
+    return b''.join(lines)
+
+
+def make_chunks(stream, max_chunk, seed=2):
+    """Split the stream at random boundaries, like TCP segments would"""
+    rnd = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        size = rnd.randint(1, max_chunk)
+        chunks.append(stream[pos:pos + size])
+        pos += size
+
+    return chunks
+
+
+def run(cls, chunks, nlines):
+    splitter = cls()
+    t0 = time.perf_counter()
+    for chunk in chunks:
+        splitter.dataReceived(chunk)
+    dt = time.perf_counter() - t0
+
+    assert splitter.count == nlines, (cls.__name__, splitter.count, nlines)
+
+    return dt
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-n', '--nlines', help='Number of lines per test', action='store', dest='nlines', type='int', default=2000)
+    parser.add_option('-c', '--chunk', help='Maximal chunk size', action='store', dest='chunk', type='int', default=65536)
+
+    (options, args) = parser.parse_args()
+
+    print("%8s %10s %12s %12s %8s" % ('line', 'bytes', 'legacy MB/s', 'framer MB/s', 'speedup'))
+
+    for line_size in [1024, 10240]:
+        stream = make_stream(line_size, options.nlines)
+        # Small chunks model interactive traffic, large ones - a burst of queued replies
+        for max_chunk in [1460, options.chunk]:
+            chunks = make_chunks(stream, max_chunk)
+
+            t_legacy = run(LegacySplitter, chunks, options.nlines)
+            t_framer = run(FramerSplitter, chunks, options.nlines)
+
+            print("%8d %10d %12.1f %12.1f %8.1f" % (line_size, max_chunk,
+                                                     len(stream)/t_legacy/1e6, len(stream)/t_framer/1e6,
+                                                     t_legacy/t_framer))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Idle CPU usage and reply latency of FTDIProtocol in polling and reader thread modes,
+using a fake device that behaves like libftdi: read() waits for the chip latency
+timer if there is no data, and replies arrive shortly after the request is written.
+
+Usage: python3 benchmarks/bench_ftdi_reader.py [-i idle_seconds] [-n nrequests]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+import random
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from twisted.internet import reactor
+
+import hotplug
+from daemon_usb import FTDIProtocol
+
+FRAME_SIZE = 20
+
+
+class FakeDevice(object):
+    """Just enough of pylibftdi.Device for FTDIProtocol to read and write"""
+    closed = False
+    latency_timer = 0.016  # FTDI default
+    reply_delay = 0.001
+
+    def __init__(self):
+        self._data = bytearray()
+        self._cond = threading.Condition()
+
+    def read(self, length):
+        with self._cond:
+            if not self._data:
+                self._cond.wait(self.latency_timer)
+            data = bytes(self._data[:length])
+            del self._data[:length]
+
+        return data
+
+    def write(self, data):
+        # Reply is the request padded to full frame length
+        reply = data.ljust(FRAME_SIZE, b'\0')
+        threading.Timer(self.reply_delay, self._reply, [reply]).start()
+
+    def _reply(self, data):
+        with self._cond:
+            self._data += data
+            self._cond.notify()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHotplug(object):
+    def find(self, **kwargs):
+        return []
+
+    def register(self, *args, **kwargs):
+        return None
+
+
+class BenchProtocol(FTDIProtocol):
+    def __init__(self, *args, **kwargs):
+        self.latencies = []
+        super().__init__(*args, **kwargs)
+
+    def update(self):
+        pass
+
+    def read(self):
+        # What the drivers do in polling mode
+        data = self.device.read(self._read_chunk)
+        if data:
+            self.dataReceived(data)
+
+    def extractFrame(self, buffer):
+        if len(buffer) < FRAME_SIZE:
+            return None
+
+        return bytes(buffer[:FRAME_SIZE]), FRAME_SIZE
+
+    def ProcessMessage(self, msg):
+        sent = float(msg.rstrip(b'\0').decode('ascii'))
+        self.latencies.append(time.time() - sent)
+
+
+def run(mode, idle, nrequests):
+    hotplug.HotplugService.forReactor = classmethod(lambda cls, reactor=None: FakeHotplug())
+
+    proto = BenchProtocol('bench', {}, refresh=1.0, reader=mode)
+    proto.device = FakeDevice()
+    if mode == 'thread':
+        proto.startReading()
+
+    result = {}
+
+    def measure_idle():
+        t0, c0 = time.time(), time.process_time()
+
+        def done():
+            result['cpu'] = 100.0*(time.process_time() - c0)/(time.time() - t0)
+            send(nrequests)
+
+        reactor.callLater(idle, done)
+
+    def send(n):
+        if n == 0:
+            reactor.callLater(0.5, reactor.stop)
+            return
+
+        proto.send_message(('%.6f' % time.time()).encode('ascii'))
+        reactor.callLater(random.uniform(0.05, 0.15), send, n - 1)
+
+    # Let the startup settle first
+    reactor.callLater(0.5, measure_idle)
+    reactor.run()
+
+    proto.stopReading()
+
+    lat = sorted(proto.latencies)
+    print("%-8s %10.2f %10d %12.2f %12.2f" % (mode, result.get('cpu', 0), len(lat),
+                                              1e3*lat[len(lat)//2] if lat else 0, 1e3*lat[-1] if lat else 0))
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-i', '--idle', help='Seconds to measure idle CPU usage', action='store', dest='idle', type='float', default=5.0)
+    parser.add_option('-n', '--nrequests', help='Number of requests for latency measurement', action='store', dest='nrequests', type='int', default=100)
+    parser.add_option('-m', '--mode', help='Run single mode in this process', action='store', dest='mode', default=None)
+
+    (options, args) = parser.parse_args()
+
+    if options.mode:
+        run(options.mode, options.idle, options.nrequests)
+    else:
+        print("%-8s %10s %10s %12s %12s" % ('reader', 'idle CPU %', 'replies', 'median ms', 'max ms'))
+        sys.stdout.flush()
+
+        # Reactor can't be restarted, so every mode runs in its own process
+        for mode in ['poll', 'thread']:
+            subprocess.call([sys.executable, os.path.abspath(__file__), '-m', mode,
+                             '-i', str(options.idle), '-n', str(options.nrequests)])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Cost of keeping the plot history of status values and preparing it for plotting:
+Python lists trimmed by slicing and converted with np.array() on every render,
+as the monitor did before, versus History ring buffers.
+
+Usage: python3 benchmarks/bench_history.py [-d depth] [-n nvalues] [-r renders]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from history import History
+
+import payloads
+
+
+def legacy(statuses, names, depth, renders):
+    values = {_: [] for _ in ['time'] + names}
+    t_append, t_render = 0, 0
+
+    for i, status in enumerate(statuses):
+        t0 = time.perf_counter()
+        for name in values:
+            if name == 'time':
+                value = datetime.datetime.utcnow()
+            else:
+                value = status.get(name, None)
+                try:
+                    value = float(value)
+                except:
+                    pass
+
+            values[name].append(value)
+            if len(values[name]) > depth:
+                values[name] = values[name][depth//10:]
+        t_append += time.perf_counter() - t0
+
+        if i % (len(statuses)//renders) == 0:
+            t0 = time.perf_counter()
+            x = np.array(values['time'])
+            for name in names:
+                y = np.array(values[name])
+                np.any(y != None)
+            t_render += time.perf_counter() - t0
+
+    return t_append/len(statuses), t_render/renders
+
+
+def ring(statuses, names, depth, renders):
+    history = History(names, depth=depth)
+    t_append, t_render = 0, 0
+
+    for i, status in enumerate(statuses):
+        t0 = time.perf_counter()
+        history.append(datetime.datetime.utcnow(), status)
+        t_append += time.perf_counter() - t0
+
+        if i % (len(statuses)//renders) == 0:
+            t0 = time.perf_counter()
+            x = history.times()
+            for name in names:
+                y = history.view(name)
+                np.any(np.isfinite(y))
+            t_render += time.perf_counter() - t0
+
+    return t_append/len(statuses), t_render/renders
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-d', '--depth', help='History depth', action='store', dest='depth', type='int', default=1000)
+    parser.add_option('-n', '--nvalues', help='Number of plotted values', action='store', dest='nvalues', type='int', default=11)
+    parser.add_option('-r', '--renders', help='Number of renders', action='store', dest='renders', type='int', default=100)
+
+    (options, args) = parser.parse_args()
+
+    status = payloads.archon_status()
+    names = sorted(status.keys())[:options.nvalues]
+    statuses = [status]*(5*options.depth)
+
+    print("%-10s %12s %12s" % ('', 'append us', 'render us'))
+    for title, func in [('lists', legacy), ('History', ring)]:
+        t_append, t_render = func(statuses, names, options.depth, options.renders)
+        print("%-10s %12.1f %12.1f" % (title, 1e6*t_append, 1e6*t_render))
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Import time of the daemon entry points, as reported by 'python -X importtime'.
+Every script is loaded in a fresh interpreter under a non-main name, so that only
+its imports are executed, and the total time along with the heaviest modules are printed.
+
+Usage: python3 benchmarks/bench_importtime.py [-t top] [script.py ...]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import subprocess
+
+_root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Pure TCP daemons first, then the ones talking to USB devices directly
+_default_scripts = ['monitor.py', 'gpib.py', 'keithley6485.py', 'mx100qp.py', 'archon.py', 'cryo-con.py',
+                    'thorlabs_l_stage.py', 'standa_r_stage.py']
+
+# Modules only needed for the hardware protocols
+_hardware_modules = ['pylibftdi', 'pyudev', 'serial', 'twisted.internet.serialport']
+
+_loader = '''
+import sys, importlib.util
+sys.path.insert(0, %r)
+spec = importlib.util.spec_from_file_location('entry_point', %r)
+module = importlib.util.module_from_spec(spec)
+sys.stderr.write(%r + '\\n')
+spec.loader.exec_module(module)
+'''
+
+# Marks the start of the script own imports in the output
+_marker = '--- entry point ---'
+
+
+def importtime(script):
+    """Run the script imports under -X importtime, returning ({module: (self_us, cumulative_us)}, error)"""
+    path = os.path.join(_root, script)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', _loader % (_root, path, _marker)],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, cwd=_root)
+
+    modules = {}
+    error = None
+    started = False
+
+    for line in proc.stderr.splitlines():
+        if line == _marker:
+            started = True
+        elif not started:
+            continue
+        elif line.startswith('import time:'):
+            fields = line[len('import time:'):].split('|')
+            if len(fields) != 3 or not fields[0].strip().isdigit():
+                continue
+            name = fields[2].strip()
+            modules[name] = (int(fields[0]), int(fields[1]))
+        elif line.strip():
+            error = line.strip()
+
+    if proc.returncode == 0:
+        error = None
+
+    return modules, error
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options] [script.py ...]")
+    parser.add_option('-t', '--top', help='Number of heaviest modules to show per script', action='store', dest='top', type='int', default=5)
+
+    (options, args) = parser.parse_args()
+
+    scripts = args or _default_scripts
+
+    for script in scripts:
+        modules, error = importtime(script)
+
+        # Everything is imported from within the loader, so the total is the sum over top-level entries
+        total = sum(_[0] for _ in modules.values())
+        hardware = [_ for _ in _hardware_modules if _ in modules]
+
+        print("%-22s %8.1f ms %4d modules  hardware: %s" % (script, 1e-3*total, len(modules), ', '.join(hardware) or '-'))
+
+        if error:
+            print("    failed:", error)
+
+        for name, (self_us, cumulative) in sorted(modules.items(), key=lambda _: -_[1][1])[:options.top]:
+            print("    %-40s %8.1f ms" % (name, 1e-3*cumulative))
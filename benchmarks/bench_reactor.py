@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Round-trip latency of get_status requests and CPU usage of a monitor-like client,
+for default Twisted reactor versus asyncio and uvloop based ones.
+
+A set of fake daemons replying with Archon-sized status is started in a separate
+process (always on the default reactor), and then, for every reactor, a client
+process connects to all of them and polls them at a given rate.
+
+Usage: python3 benchmarks/bench_reactor.py [-n ndaemons] [-r rate] [-t seconds]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import payloads
+
+
+def serve(port, ndaemons):
+    from daemon import SimpleFactory, SimpleProtocol
+
+    status = payloads.archon_status()
+
+    class FakeDaemonProtocol(SimpleProtocol):
+        def processMessage(self, string):
+            cmd = SimpleProtocol.processMessage(self, string)
+            if cmd is None:
+                return
+
+            if cmd.name == 'get_status':
+                # Echo the request timestamp back so the client may measure the round trip
+                self.sendStatus(dict(status, t=cmd.get('t', 0)))
+
+    for i in range(ndaemons):
+        daemon = SimpleFactory(FakeDaemonProtocol, {})
+        daemon.name = 'fake%03d' % i
+        daemon.listen(port + i)
+
+    print('ready')
+    sys.stdout.flush()
+
+    daemon._reactor.run()
+
+
+def client(port, ndaemons, rate, duration):
+    from daemon import SimpleFactory, SimpleProtocol
+    from command import Command
+    import reactors
+
+    latencies = []
+
+    class ClientProtocol(SimpleProtocol):
+        def processMessage(self, string):
+            cmd = Command(string)
+
+            if cmd.name == 'status':
+                # What the monitor does with every status
+                values = {}
+                for key, value in cmd.kwargs.items():
+                    try:
+                        values[key] = float(value)
+                    except ValueError:
+                        values[key] = value
+
+                latencies.append(time.time() - values['t'])
+
+        def update(self):
+            self.message('get_status t=%.6f' % time.time())
+
+    clients = SimpleFactory(ClientProtocol, {})
+    clients._protocol._refresh = 1.0/rate
+    for i in range(ndaemons):
+        clients.connect('localhost', port + i)
+
+    reactor = clients._reactor
+    result = {}
+
+    def start():
+        del latencies[:]
+        result['t0'], result['c0'] = time.time(), time.process_time()
+        reactor.callLater(duration, stop)
+
+    def stop():
+        result['cpu'] = 100.0*(time.process_time() - result['c0'])/(time.time() - result['t0'])
+        reactor.stop()
+
+    # Let all the connections settle first
+    reactor.callLater(1.0, start)
+    reactor.run()
+
+    lat = sorted(latencies)
+    if not lat:
+        print("%-8s no replies" % reactors.current())
+        return
+
+    print("%-8s %10.1f %10d %10.2f %10.2f %10.2f" % (reactors.current(), result['cpu'], len(lat), 1e3*lat[len(lat)//2],
+                                                     1e3*lat[int(0.99*(len(lat) - 1))], 1e3*lat[-1]))
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-n', '--ndaemons', help='Number of fake daemons', action='store', dest='ndaemons', type='int', default=20)
+    parser.add_option('-r', '--rate', help='Requests per second to every daemon', action='store', dest='rate', type='float', default=10)
+    parser.add_option('-t', '--time', help='Measurement duration, seconds', action='store', dest='duration', type='float', default=10)
+    parser.add_option('-p', '--port', help='First port for fake daemons', action='store', dest='port', type='int', default=17000)
+    parser.add_option('--serve', help='Only run fake daemons', action='store_true', dest='serve')
+    parser.add_option('--client', help='Only run the client', action='store_true', dest='client')
+
+    (options, args) = parser.parse_args()
+
+    if options.serve:
+        serve(options.port, options.ndaemons)
+    elif options.client:
+        client(options.port, options.ndaemons, options.rate, options.duration)
+    else:
+        common = ['-n', str(options.ndaemons), '-r', str(options.rate), '-t', str(options.duration), '-p', str(options.port)]
+        env = dict(os.environ, CCDLAB_REACTOR='default')
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve'] + common,
+                                  stdout=subprocess.PIPE, universal_newlines=True, env=env)
+
+        try:
+            server.stdout.readline()
+
+            print("%-8s %10s %10s %10s %10s %10s" % ('reactor', 'CPU %', 'replies', 'median ms', 'p99 ms', 'max ms'))
+            sys.stdout.flush()
+
+            for name in ['default', 'asyncio', 'uvloop']:
+                env = dict(os.environ, CCDLAB_REACTOR=name)
+                subprocess.call([sys.executable, os.path.abspath(__file__), '--client'] + common, env=env)
+        finally:
+            server.terminate()
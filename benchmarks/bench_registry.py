@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark of SimpleFactory connection lookups and filtered broadcasts with many
+active connections, comparing the indexed registry with the linear scan used before.
+
+Usage: python3 benchmarks/bench_registry.py [-n nconnections] [-r repeats]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from daemon import SimpleFactory, SimpleProtocol
+
+
+class FakeReactor(object):
+    """Just enough of the reactor interface for the factory to be constructed"""
+    def seconds(self):
+        return time.time()
+
+    def callLater(self, delay, func, *args, **kwargs):
+        pass
+
+
+class CountingProtocol(SimpleProtocol):
+    count = 0
+
+    def message(self, string, **kwargs):
+        CountingProtocol.count += 1
+
+
+def legacy_findConnection(factory, name=None, type=None):
+    for c in factory.connections:
+        isMatched = True
+
+        if name and c.name != name:
+            isMatched = False
+
+        if type and c.type != type:
+            isMatched = False
+
+        if isMatched:
+            return c
+
+    return None
+
+
+def legacy_messageAll(factory, string, name=None, type=None):
+    for c in factory.connections:
+        if name and c.name != name:
+            continue
+        if type and c.type != type:
+            continue
+        c.message(string)
+
+
+def timeit(func, repeats):
+    t0 = time.perf_counter()
+    for i in range(repeats):
+        func(i)
+
+    return (time.perf_counter() - t0)/repeats
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-n', '--nconnections', help='Number of connections', action='store', dest='nconn', type='int', default=500)
+    parser.add_option('-r', '--repeats', help='Number of repeats', action='store', dest='repeats', type='int', default=2000)
+
+    (options, args) = parser.parse_args()
+
+    factory = SimpleFactory(CountingProtocol, reactor=FakeReactor())
+
+    # Mostly clients of a few types, and a handful of CCDs, like on a busy monitor host
+    for i in range(options.nconn):
+        p = factory.buildProtocol(None)
+        p.setName('client%03d' % i, 'ccd' if i % 50 == 0 else 'device')
+        factory.addConnection(p)
+
+    names = ['client%03d' % _ for _ in range(options.nconn)]
+
+    tests = [
+        ('findConnection(name)',
+         lambda i: legacy_findConnection(factory, name=names[i % len(names)]),
+         lambda i: factory.findConnection(name=names[i % len(names)])),
+        ('findConnection(missing)',
+         lambda i: legacy_findConnection(factory, name='missing'),
+         lambda i: factory.findConnection(name='missing')),
+        ('messageAll(type=ccd)',
+         lambda i: legacy_messageAll(factory, 'set_keywords a=1', type='ccd'),
+         lambda i: factory.messageAll('set_keywords a=1', type='ccd')),
+    ]
+
+    print("%d connections" % options.nconn)
+    print("%-25s %12s %12s %8s" % ('operation', 'legacy us', 'indexed us', 'speedup'))
+
+    for title, legacy, indexed in tests:
+        t_legacy = timeit(legacy, options.repeats)
+        t_indexed = timeit(indexed, options.repeats)
+
+        print("%-25s %12.2f %12.2f %8.1f" % (title, 1e6*t_legacy, 1e6*t_indexed, t_legacy/t_indexed))
+
+    # Renaming the connections keeps the index consistent
+    for i, c in enumerate(list(factory.connections)):
+        c.name = 'renamed%03d' % i
+    assert factory.findConnection(name='renamed007') is factory.connections[7]
+    assert factory.findConnection(name='client007') is None
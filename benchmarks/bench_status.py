@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Size and monitor-side parsing time of status replies, full versus delta-encoded,
+for Archon and Cryo-con status sets with a given fraction of values changing
+between the requests.
+
+Usage: python3 benchmarks/bench_status.py [-f fraction] [-r repeats]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import wire
+from command import Command
+from status import StatusTracker
+
+import payloads
+
+
+def sequence(status, fraction, repeats, seed=0):
+    """Series of statuses with the given fraction of values changed every time"""
+    rnd = random.Random(seed)
+    keys = sorted(status.keys())
+    result = []
+
+    for i in range(repeats):
+        status = dict(status)
+        for key in rnd.sample(keys, max(1, int(fraction*len(keys)))):
+            status[key] = rnd.uniform(0, 100)
+        result.append(status)
+
+    return result
+
+
+def measure(statuses, delta):
+    """Total bytes sent and time spent parsing and merging them, per reply"""
+    tracker = StatusTracker()
+    merged = {}
+    version = 0
+    nbytes = 0
+    elapsed = 0
+
+    for status in statuses:
+        # Daemon side
+        if delta:
+            tracker.update(status)
+            values, full = tracker.delta(version)
+            values['_version'] = tracker.version
+            values['_full'] = int(full)
+        else:
+            values = status
+        string = wire.toString('status', values)
+        nbytes += len(string)
+
+        # Monitor side
+        t0 = time.perf_counter()
+        kwargs = Command(string).kwargs
+        if delta:
+            version = int(kwargs.pop('_version'))
+            if int(kwargs.pop('_full')):
+                merged = kwargs
+            else:
+                merged.update(kwargs)
+        else:
+            merged = kwargs
+        elapsed += time.perf_counter() - t0
+
+    return nbytes/len(statuses), elapsed/len(statuses)
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-f', '--fraction', help='Fraction of values changed between requests', action='store', dest='fraction', type='float', default=0.05)
+    parser.add_option('-r', '--repeats', help='Number of status replies', action='store', dest='repeats', type='int', default=1000)
+
+    (options, args) = parser.parse_args()
+
+    print("%-10s %6s %12s %12s %12s %12s" % ('status', 'keys', 'full bytes', 'delta bytes', 'full us', 'delta us'))
+
+    for title, status in [('archon', payloads.archon_status()), ('cryocon', payloads.cryocon_status())]:
+        statuses = sequence(status, options.fraction, options.repeats)
+
+        full_bytes, full_time = measure(statuses, False)
+        delta_bytes, delta_time = measure(statuses, True)
+
+        print("%-10s %6d %12.0f %12.0f %12.1f %12.1f" % (title, len(status), full_bytes, delta_bytes, 1e6*full_time, 1e6*delta_time))
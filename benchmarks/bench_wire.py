@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Bytes on the wire and CPU time per status message for the text and msgpack
+wire formats, using Archon, Cryo-con and MX100QP status payloads.
+
+Usage: python3 benchmarks/bench_wire.py [-r repeats]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import wire
+from command import Command
+
+import payloads
+
+
+def text_encode(status):
+    return wire.toString('status', status).encode('ascii') + b'\n'
+
+
+def text_decode(data):
+    # What monitor does: parse the line and try to get numbers back
+    cmd = Command(data[:-1].decode('ascii'))
+    result = {}
+    for key, value in cmd.kwargs.items():
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+        result[key] = value
+
+    return result
+
+
+def msgpack_encode(status):
+    data = wire.pack('status', status)
+
+    return ('msgpack %d' % len(data)).encode('ascii') + b'\n' + data
+
+
+def msgpack_decode(data):
+    pos = data.index(b'\n') + 1
+
+    return wire.unpack(data[pos:])[1]
+
+
+def measure(encode, decode, status, repeats):
+    data = encode(status)
+
+    t0 = time.process_time()
+    for i in range(repeats):
+        encode(status)
+    t_encode = (time.process_time() - t0)/repeats
+
+    t0 = time.process_time()
+    for i in range(repeats):
+        decode(data)
+    t_decode = (time.process_time() - t0)/repeats
+
+    return len(data), t_encode, t_decode
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-r', '--repeats', help='Number of repeats', action='store', dest='repeats', type='int', default=1000)
+
+    (options, args) = parser.parse_args()
+
+    formats = [('text', text_encode, text_decode)]
+    if 'msgpack' in wire.formats():
+        formats.append(('msgpack', msgpack_encode, msgpack_decode))
+    else:
+        print("msgpack is not installed, only text format is measured")
+
+    print("%-10s %-8s %6s %8s %12s %12s" % ('payload', 'format', 'keys', 'bytes', 'encode us', 'decode us'))
+
+    for title, status in [('archon', payloads.archon_status()),
+                          ('cryocon', payloads.cryocon_status()),
+                          ('mx100qp', payloads.mx100qp_status())]:
+        for fmt, encode, decode in formats:
+            size, t_encode, t_decode = measure(encode, decode, status, options.repeats)
+            print("%-10s %-8s %6d %8d %12.1f %12.1f" % (title, fmt, len(status), size, 1e6*t_encode, 1e6*t_decode))
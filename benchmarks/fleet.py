@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Load generator for the monitor: a fleet of fake daemons running inside one process,
+with status sets and update rates modelled on Archon, Cryo-con and MX100QP daemons.
+
+For every fleet size, the fake daemons are started in a separate process along with
+the real monitor.py connected to all of them, and then the monitor CPU usage, memory,
+status-to-web latency (from the change of the value in the daemon until it is seen
+in /monitor/status JSON) and DB write rate are measured.
+
+Note that monitor.py also connects to the clients listed in its monitor.ini, and
+needs the database to measure DB writes (-d option), running without it otherwise.
+
+Usage: python3 benchmarks/fleet.py [-n 10,20,50] [-k archon,cryocon,mx100qp] [-m push|delta|plain] [-t seconds]
+       python3 benchmarks/fleet.py --serve -n 20 - only run the fleet
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import time
+import json
+import random
+import socket
+import threading
+import subprocess
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, _root)
+
+import payloads
+
+# Status set and update rate (Hz) of every kind of fake daemon
+kinds = {'archon': (payloads.archon_status, 1.0),
+         'cryocon': (payloads.cryocon_status, 1.0),
+         'mx100qp': (payloads.mx100qp_status, 2.0)}
+
+
+def serve(port, ndaemons, kindnames, mode, fraction, speed):
+    from daemon import SimpleFactory, SimpleProtocol, commandHandler
+
+    class FakeDaemonProtocol(SimpleProtocol):
+        _status_delta = mode != 'plain'
+
+        def currentStatus(self):
+            return dict(self.object['status'])
+
+        @commandHandler('get_status')
+        def commandGetStatus(self, cmd):
+            self.sendStatus(self.currentStatus())
+
+    class PushingFakeDaemonProtocol(FakeDaemonProtocol):
+        def getStatus(self):
+            return self.currentStatus()
+
+    def change(obj, rnd, keys):
+        # Random walk of some numerical values, and the timestamp for latency measurement
+        status = obj['status']
+        for key in rnd.sample(keys, max(1, int(fraction*len(keys)))):
+            status[key] = round(status[key] + rnd.gauss(0, 1), 3)
+        status['fleet_t'] = time.time()
+
+    protocol = PushingFakeDaemonProtocol if mode == 'push' else FakeDaemonProtocol
+
+    for i in range(ndaemons):
+        kind = kindnames[i % len(kindnames)]
+        func, rate = kinds[kind]
+
+        status = {}
+        for key, value in (func() if kind == 'archon' else func(seed=i)).items():
+            try:
+                status[key] = float(value)
+            except ValueError:
+                status[key] = value
+        keys = [_ for _ in status if isinstance(status[_], float)]
+
+        obj = {'status': status}
+        daemon = SimpleFactory(protocol, obj, name='fleet%03d' % i, type=kind)
+        daemon.listen(port + i)
+
+        rnd = random.Random(i)
+        daemon.scheduler.add(lambda obj=obj, rnd=rnd, keys=keys: change(obj, rnd, keys), 1.0/(rate*speed))
+
+    print('ready')
+    sys.stdout.flush()
+
+    daemon._reactor.run()
+
+
+class ProcessStats(object):
+    """CPU time and memory of a process, from /proc"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.ticks = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+
+    def cpu(self):
+        with open('/proc/%d/stat' % self.pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+
+        return (int(fields[11]) + int(fields[12]))/self.ticks
+
+    def rss(self):
+        with open('/proc/%d/status' % self.pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])*1024
+
+        return 0
+
+
+class WebWatcher(threading.Thread):
+    """Polls /monitor/status and records the delay of every new fleet_t value"""
+
+    def __init__(self, url, interval=0.05):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.url = url
+        self.interval = interval
+        self.running = True
+        self.latencies = []
+        self.errors = 0
+        self._seen = {}
+
+    def run(self):
+        while self.running:
+            try:
+                data = json.loads(urlopen(self.url, timeout=5).read().decode('utf-8'))
+                now = time.time()
+
+                for name, status in data['status'].items():
+                    if isinstance(status, dict) and 'fleet_t' in status:
+                        t = float(status['fleet_t'])
+                        if self._seen.get(name) != t:
+                            if name in self._seen:
+                                self.latencies.append(now - t)
+                            self._seen[name] = t
+            except Exception:
+                self.errors += 1
+
+            time.sleep(self.interval)
+
+
+def monitorMetrics(port):
+    """Metrics snapshot of the monitor, requested over its TCP interface"""
+    from command import Command
+
+    s = socket.create_connection(('localhost', port), timeout=5)
+    try:
+        s.sendall(b'get_metrics\n')
+        data = b''
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+
+            for line in data.split(b'\n'):
+                if line.startswith(b'metrics '):
+                    metrics = {}
+                    for key, value in Command(line.decode('ascii')).kwargs.items():
+                        try:
+                            metrics[key] = float(value)
+                        except ValueError:
+                            metrics[key] = value
+                    return metrics
+    finally:
+        s.close()
+
+    return {}
+
+
+def measure(options, ndaemons):
+    common = ['-n', str(ndaemons), '-p', str(options.port), '-k', options.kinds, '-m', options.mode,
+              '-f', str(options.fraction), '-s', str(options.speed)]
+    fleet = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve'] + common,
+                             stdout=subprocess.PIPE, universal_newlines=True)
+    monitor = None
+
+    try:
+        fleet.stdout.readline()
+
+        clients = ['fleet%03d=localhost:%d' % (i, options.port + i) for i in range(ndaemons)]
+        args = [sys.executable, 'monitor.py', '-s', '-p', str(options.monitor_port), '-H', str(options.http_port),
+                '-i', str(options.db_interval)]
+        if options.db_host:
+            args += ['-d', options.db_host]
+        monitor = subprocess.Popen(args + clients, cwd=_root, stdin=subprocess.PIPE,
+                                   stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+
+        # Let all the connections settle first
+        time.sleep(options.warmup)
+
+        stats = ProcessStats(monitor.pid)
+        watcher = WebWatcher('http://localhost:%d/monitor/status' % options.http_port)
+        metrics0 = monitorMetrics(options.monitor_port)
+        t0, c0 = time.time(), stats.cpu()
+        watcher.start()
+
+        rss = 0
+        while time.time() < t0 + options.duration:
+            time.sleep(0.5)
+            rss = max(rss, stats.rss())
+
+        watcher.running = False
+        t1, c1 = time.time(), stats.cpu()
+        metrics1 = monitorMetrics(options.monitor_port)
+
+        writes = sum(metrics1.get(_, 0) - metrics0.get(_, 0) for _ in ['db_status_writes', 'db_log_writes'])
+        lat = sorted(watcher.latencies)
+
+        print("%6d %10.1f %10.1f %10d %10.1f %10.1f %10.2f" % (ndaemons, 100.0*(c1 - c0)/(t1 - t0), rss/1024/1024, len(lat),
+                                                               1e3*lat[len(lat)//2] if lat else 0, 1e3*lat[int(0.99*(len(lat) - 1))] if lat else 0,
+                                                               writes/(t1 - t0)))
+        sys.stdout.flush()
+    finally:
+        if monitor is not None:
+            monitor.terminate()
+            monitor.wait()
+        fleet.terminate()
+        fleet.wait()
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-n', '--ndaemons', help='Comma-separated list of fleet sizes', action='store', dest='ndaemons', default='10,20,50')
+    parser.add_option('-k', '--kinds', help='Comma-separated kinds of fake daemons, used in turn', action='store', dest='kinds', default='archon,cryocon,mx100qp')
+    parser.add_option('-m', '--mode', help='Status mode: push, delta or plain', action='store', dest='mode', default='push')
+    parser.add_option('-f', '--fraction', help='Fraction of values changed on every update', action='store', dest='fraction', type='float', default=0.1)
+    parser.add_option('-s', '--speed', help='Multiplier for the update rates', action='store', dest='speed', type='float', default=1.0)
+    parser.add_option('-t', '--time', help='Measurement duration, seconds', action='store', dest='duration', type='float', default=20)
+    parser.add_option('-w', '--warmup', help='Delay before the measurement, seconds', action='store', dest='warmup', type='float', default=5)
+    parser.add_option('-p', '--port', help='First port for fake daemons', action='store', dest='port', type='int', default=17100)
+    parser.add_option('-P', '--monitor-port', help='Monitor TCP port', action='store', dest='monitor_port', type='int', default=17099)
+    parser.add_option('-H', '--http-port', help='Monitor HTTP port', action='store', dest='http_port', type='int', default=18888)
+    parser.add_option('-d', '--db-host', help='Database host for the monitor', action='store', dest='db_host', default=None)
+    parser.add_option('-i', '--db-interval', help='Monitor DB status logging interval, seconds', action='store', dest='db_interval', type='float', default=1.0)
+    parser.add_option('--serve', help='Only run the fleet', action='store_true', dest='serve')
+
+    (options, args) = parser.parse_args()
+
+    if options.mode not in ['push', 'delta', 'plain']:
+        parser.error('Unknown mode: %s' % options.mode)
+
+    for kind in options.kinds.split(','):
+        if kind not in kinds:
+            parser.error('Unknown daemon kind: %s' % kind)
+
+    if options.serve:
+        serve(options.port, int(options.ndaemons), options.kinds.split(','), options.mode, options.fraction, options.speed)
+    else:
+        print("%6s %10s %10s %10s %10s %10s %10s" % ('N', 'CPU %', 'RSS MB', 'updates', 'median ms', 'p99 ms', 'DB/s'))
+        sys.stdout.flush()
+
+        for ndaemons in [int(_) for _ in options.ndaemons.split(',')]:
+            measure(options, ndaemons)
@@ -0,0 +1,75 @@
+"""
+Realistic status payloads for benchmarks.
+Archon ones are the actual controller replies recorded in archon_fake.py,
+Cryo-con and MX100QP ones follow the status sets reported by their daemons.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import ast
+import random
+
+_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def archon_replies():
+    """All the literal controller replies from archon_fake.py, keyed by command"""
+    with open(os.path.join(_root, 'archon_fake.py')) as f:
+        tree = ast.parse(f.read())
+
+    replies = {'STATUS': [], 'SYSTEM': [], 'FRAME': []}
+
+    # Every 'if command == X' block assigns one or more literal replies
+    for node in ast.walk(tree):
+        if isinstance(node, ast.If) and isinstance(node.test, ast.Compare):
+            test = node.test
+            if isinstance(test.left, ast.Name) and test.left.id == 'command' and isinstance(test.comparators[0], ast.Constant):
+                key = test.comparators[0].value
+                for sub in ast.walk(ast.Module(body=node.body, type_ignores=[])):
+                    if isinstance(sub, ast.Assign) and isinstance(sub.value, ast.Constant) and isinstance(sub.value.value, str):
+                        if key in replies and '=' in sub.value.value:
+                            replies[key].append(sub.value.value)
+
+    return replies
+
+
+def archon_status():
+    """Archon status as a dict of strings, as kept by archon.py"""
+    status = {'hw_connected': '1'}
+    for chunk in archon_replies()['STATUS'][0].split():
+        key, value = chunk.split('=', 1)
+        status[key.replace('/', '_')] = value
+
+    return status
+
+
+def cryocon_status(seed=0):
+    """Cryo-con status as a dict of typed values, as reported by cryo-con.py"""
+    rnd = random.Random(seed)
+    status = {'hw_connected': 1, 'status': 'OK'}
+    for _ in 'ABCD':
+        status['temperature' + _] = rnd.uniform(-150, 25)
+    status['control'] = 'ON'
+
+    for i in range(1, 5):
+        status.update({'htr_status%d' % i: 'OK', 'range%d' % i: 'HI', 'ctrl_type%d' % i: 'PID',
+                       'pwr_set%d' % i: rnd.uniform(0, 100), 'pwr_actual%d' % i: rnd.uniform(0, 100),
+                       'load%d' % i: 50.0, 'source%d' % i: 'ABCD'[i - 1], 'set_point%d' % i: rnd.uniform(-150, 25),
+                       'ramp%d' % i: 'OFF', 'rate%d' % i: 1.0, 'pwr_man%d' % i: 0.0})
+
+    return status
+
+
+def mx100qp_status(seed=0):
+    """MX100QP power supply status as a dict of typed values"""
+    rnd = random.Random(seed)
+    status = {'hw_connected': 1}
+    for key, func in [('VSet', lambda: rnd.uniform(0, 35)), ('V', lambda: rnd.uniform(0, 35)),
+                      ('ILim', lambda: rnd.uniform(0, 3)), ('I', lambda: rnd.uniform(0, 3)),
+                      ('VOut', lambda: rnd.randint(0, 1)), ('OVP', lambda: rnd.uniform(0, 40)),
+                      ('OCP', lambda: 'OFF')]:
+        for i in range(1, 5):
+            status['%s%d' % (key, i)] = func()
+
+    return status
@@ -12,8 +12,17 @@ from daemon import catch
 
 class DaemonProtocol(SimpleProtocol):
     _debug = False  # Display all traffic for debug purposes
+    _status_delta = True  # Status is sent with sendStatus(), so it may be delta-encoded
     _simulator = False
 
+    # Variables reported in status reply, in order
+    _status_keys = ['hw_connected', 'status', 'temperatureA', 'temperatureB', 'temperatureC', 'temperatureD', 'control'] + \
+                   [_ + str(i) for i in range(1, 5) for _ in ['htr_status', 'range', 'ctrl_type', 'pwr_set', 'pwr_actual', 'load',
+                                                             'source', 'set_point', 'ramp', 'rate', 'pwr_man']]
+
+    def getStatus(self):
+        return {_: self.object[_] for _ in self._status_keys}
+
     @catch
     def processMessage(self, string):
         # It will handle some generic messages and return pre-parsed Command object
@@ -27,25 +36,7 @@ class DaemonProtocol(SimpleProtocol):
         STRING = string.upper()
         while True:
             if cmd.name == 'get_status':
-                self.message('status hw_connected=%s status=%s temperatureA=%g temperatureB=%g temperatureC=%g temperatureD=%g control=%s\
-                            htr_status1=%s range1=%s ctrl_type1=%s pwr_set1=%g pwr_actual1=%g load1=%g source1=%s set_point1=%g ramp1=%s rate1=%g pwr_man1=%s\
-                            htr_status2=%s range2=%s ctrl_type2=%s pwr_set2=%g pwr_actual2=%g load2=%g source2=%s set_point2=%g ramp2=%s rate2=%g pwr_man2=%s\
-                            htr_status3=%s range3=%s ctrl_type3=%s pwr_set3=%s pwr_actual3=%s load3=%s source3=%s set_point3=%g ramp3=%s rate3=%g pwr_man3=%s\
-                            htr_status4=%s range4=%s ctrl_type4=%s pwr_set4=%s pwr_actual4=%s load4=%s source4=%s set_point4=%g ramp4=%s rate4=%g pwr_man4=%s'
-                             % (self.object['hw_connected'], self.object['status'],
-                                self.object['temperatureA'], self.object['temperatureB'], self.object['temperatureC'], self.object['temperatureD'], self.object['control'],
-                                self.object['htr_status1'], self.object['range1'], self.object['ctrl_type1'], self.object[
-                                    'pwr_set1'], self.object['pwr_actual1'], self.object['load1'],
-                                self.object['source1'], self.object['set_point1'], self.object['ramp1'], self.object['rate1'], self.object['pwr_man1'],
-                                self.object['htr_status2'], self.object['range2'], self.object['ctrl_type2'], self.object[
-                                    'pwr_set2'], self.object['pwr_actual2'], self.object['load2'],
-                                self.object['source2'], self.object['set_point2'], self.object['ramp2'], self.object['rate2'], self.object['pwr_man2'],
-                                self.object['htr_status3'], self.object['range3'], self.object['ctrl_type3'], self.object[
-                                    'pwr_set3'], self.object['pwr_actual3'], self.object['load3'],
-                                self.object['source3'], self.object['set_point3'], self.object['ramp3'], self.object['rate3'], self.object['pwr_man3'],
-                                self.object['htr_status4'], self.object['range4'], self.object['ctrl_type4'], self.object[
-                                    'pwr_set4'], self.object['pwr_actual4'], self.object['load4'],
-                                self.object['source4'], self.object['set_point4'], self.object['ramp4'], self.object['rate4'], self.object['pwr_man4'],))
+                self.sendStatus(self.getStatus())
                 break
             regex = re.compile(r'(CONT|CONTR|CONTRO|CONTROL)\?')
             if re.match(regex, STRING):
@@ -325,7 +316,8 @@ class CryoConProtocol(SimpleProtocol):
         self.commands.append({'cmd': string, 'source': source, 'keep': keep})
 
 
-if __name__ == '__main__':
+def getOptionParser():
+    """Command-line options of the daemon, also used by host.py"""
     from optparse import OptionParser
 
     parser = OptionParser(usage="usage: %prog [options] arg")
@@ -342,8 +334,11 @@ if __name__ == '__main__':
     parser.add_option("-S", '--simulator', help='Simulator mode',
                       action="store_true", dest="simulator")
 
-    (options, args) = parser.parse_args()
+    return parser
 
+
+def buildDaemon(options, reactor=None):
+    """Create and start the daemon and hardware factories, and return the daemon one"""
     # Object holding actual state and work logic.
     # May be anything that will be passed by reference - list, dict, object etc
     obj = {'hw_connected': 0,
@@ -355,8 +350,8 @@ if __name__ == '__main__':
 
     # Factories for daemon and hardware connections
     # We need two different factories as the protocols are different
-    daemon = SimpleFactory(DaemonProtocol, obj)
-    hw = SimpleFactory(CryoConProtocol, obj)
+    daemon = SimpleFactory(DaemonProtocol, obj, reactor=reactor)
+    hw = SimpleFactory(CryoConProtocol, obj, reactor=reactor)
 
     daemon.name = options.name
 
@@ -375,4 +370,12 @@ if __name__ == '__main__':
     # Outgoing connection
     hw.connect(options.hw_host, options.hw_port)
 
+    return daemon
+
+
+if __name__ == '__main__':
+    (options, args) = getOptionParser().parse_args()
+
+    daemon = buildDaemon(options)
+
     daemon._reactor.run()
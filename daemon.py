@@ -1,218 +1,122 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+# Should go before anything importing the reactor
+import reactors
+reactors.install()
+
 from twisted.internet.protocol import Protocol, Factory, ServerFactory
 from twisted.application.internet import ClientService
 from twisted.application.service import Service
 from twisted.internet.endpoints import TCP4ServerEndpoint, TCP4ClientEndpoint, connectProtocol
 from twisted.protocols.basic import LineReceiver
-from twisted.internet.task import LoopingCall
-from twisted.internet.serialport import SerialPort
-
-import pylibftdi
-from pyudev import Context, Monitor, MonitorObserver
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.defer import Deferred
+from zope.interface import implementer
 
 import os
 import sys
 import re
 import socket
 import time
+from collections import deque
 
 from command import Command
+from framing import LineFramer
+from scheduler import PollScheduler
+from status import StatusTracker, StatusSubscription
+from metrics import Metrics, Timing, functionStats
+import profiler
+import wire
+from reactors import asyncHandler
 
 
 def catch(func):
-    '''Decorator to catch errors inside functions and print tracebacks'''
+    '''Decorator to catch errors inside functions and print tracebacks, also collecting call counts and timings'''
+    stats = functionStats(func)
+
     def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
         try:
             return func(*args, **kwargs)
         except:
+            stats.errors += 1
             import traceback
             traceback.print_exc()
+        finally:
+            stats.add(time.perf_counter() - t0)
 
-    return wrapper
-
-
-class FTDIProtocol(Protocol):
-    """ Class for outgoing connection to a FTDI device """
-    _debug = False
-    _refresh = 1.0
-    pylibftdi.USB_PID_LIST.append(0xFAF0)
-
-    def __init__(self, serial_num, obj, refresh=0, baudrate=115200):
-        # Name and type of the connection peer
-        self.name = ''
-        self.type = ''
-
-        self.object = obj
-        self.baudrate = baudrate
-        self.serial_num = serial_num
-        self.devpath = ''
-
-        if refresh > 0:
-            self._refresh = refresh
-
-        self.device = pylibftdi.Device(mode='b', device_id=self.serial_num, lazy_open=True)
-        self.device._baudrate = self.baudrate
-
-        self._updateTimer = LoopingCall(self.update)
-        self._updateTimer.start(self._refresh)
-        self._readTimer = LoopingCall(self.read)
-        self._readTimer.start(self._refresh/10)
-
-        # the following will start a small daemon to monitor the connection and call ConnectionMade and ConnectionLost
-        # pyftdi doesn't seem to support this so this pyudev daemon is necessary
-
-        context = Context()
-        # find out whether device is already connected and if that is the case open ftdi connection
-        for device in context.list_devices(subsystem='usb'):
-            if device.get('ID_SERIAL_SHORT') == self.serial_num:
-                for ch in device.children:
-                    if 'tty' not in ch.get('DEVPATH'):
-                        self.devpath = ch.get('DEVPATH')
-                        self.ConnectionMade()
-
-        cm = Monitor.from_netlink(context)
-        cm.filter_by(subsystem='usb')
-        observer = MonitorObserver(cm, callback=self.ConnectionMCallBack, name='monitor-observer')
-        observer.start()
-
-    def ConnectionMCallBack(self, dd):
-        if self.devpath == '':
-            if dd.get('ID_SERIAL_SHORT') == self.serial_num:
-                for ch in dd.children:
-                    if 'tty' not in ch.get('DEVPATH'):
-                        self.devpath = ch.get('DEVPATH')
-                        self.ConnectionMade()
-        elif dd.get('DEVPATH') == self.devpath:
-            if dd.action == 'remove':
-                self.ConnectionLost()
-            if dd.action == 'add' and self.device.closed:
-                self.ConnectionMade()
-
-    def ConnectionMade(self):
-        self.device.open()
-        self.device.baudrate = self.baudrate
-        self.device.ftdi_fn.ftdi_set_line_property(8, 1, 0)  # number of bits, number of stop bits, no parity
-
-        time.sleep(50.0/1000)
-        self.device.flush(pylibftdi.FLUSH_BOTH)
-        time.sleep(50.0/1000)
-
-        # this is pulled from ftdi.h
-        SIO_RTS_CTS_HS = (0x1 << 8)
-        self.device.ftdi_fn.ftdi_setflowctrl(SIO_RTS_CTS_HS)
-        self.device.ftdi_fn.ftdi_setrts(1)
-
-        print('Connected to', self.devpath)
-
-    def ConnectionLost(self):
-        self.device.close()
-        print('Disconnected from', self.devpath)
-
-    def send_message(self, packed_msg):
-        if self._debug:
-            print(">>", self.devpath, '>>', packed_msg, '(', packed_msg.hex(':'), ')')
-        self.device.write(packed_msg)
+    wrapper.__name__ = func.__name__
+    wrapper.__qualname__ = getattr(func, '__qualname__', func.__name__)
+    wrapper.__doc__ = func.__doc__
+    wrapper.__dict__.update(func.__dict__)
 
-    def ProcessMessage(self, msg):
-        pass
+    return wrapper
 
-    def update(self):
-        print('dummy updater')
-        pass
 
-    def read(self):
-        print('dummy read')
-        pass
+def commandHandler(*names):
+    '''Decorator registering the method as a handler for the commands with given names'''
+    def decorator(func):
+        func._command_names = getattr(func, '_command_names', ()) + names
+        return func
 
+    return decorator
 
-class SerialUSBProtocol(Protocol):
-    """ Class for outgoing connection to a USB serial device """
-    _comand_end_character = b''
-    _buffer = b''
-    _devname = None
-    _refresh = 1.0
-    _binary_length = None
 
-    def __init__(self, serial_num, obj, refresh=0, baudrate=115200, bytesize=8, parity='N', stopbits=2, timeout=400, debug=False):
-        # Name and type of the connection peer
-        self.name = ''
-        self.type = ''
+class CommandDispatcher(object):
+    """
+    Mixin dispatching commands to the methods marked with @commandHandler.
+    The table of command names is built once per class, and includes the handlers of
+    base classes. Overriding the handler method in a subclass overrides the command too.
+    """
+    _commands = {}  # Command name -> handler method name
 
-        self.serial_num = serial_num
-        self.object = obj
-        self.baudrate = baudrate
-        self.bytesize = bytesize
-        self.parity = parity
-        self.stopbits = stopbits
-        self.timeout = timeout
+    def __init_subclass__(cls, **kwargs):
+        super(CommandDispatcher, cls).__init_subclass__(**kwargs)
 
-        self._debug = debug
+        commands = {}
+        for klass in reversed(cls.__mro__):
+            for attr, value in vars(klass).items():
+                for name in getattr(value, '_command_names', ()):
+                    commands[name] = attr
 
-        if refresh > 0:
-            self._refresh = refresh
+        cls._commands = commands
 
-        self._updateTimer = LoopingCall(self.update)
+    unknown_commands = 0
 
-        context = Context()
-        for device in context.list_devices(subsystem='tty'):
-            if device.get('ID_SERIAL_SHORT') == self.serial_num:
-                self._devname = device['DEVNAME']
-                self.Connect()
+    def dispatchCommand(self, cmd, *args):
+        """Call the handler registered for the command, return False if there is none"""
+        attr = self._commands.get(cmd.name)
+        if attr is None:
+            return False
 
-        cm = Monitor.from_netlink(context)
-        cm.filter_by(subsystem='tty')
-        observer = MonitorObserver(cm, callback=self.ConnectionMCallBack, name='monitor-observer')
-        observer.start()
+        getattr(self, attr)(cmd, *args)
 
-    def Connect(self):
-        self.object['hw'] = SerialPort(self, self._devname, self.object['daemon']._reactor,
-                                       baudrate=self.baudrate, bytesize=self.bytesize, parity=self.parity, stopbits=self.stopbits, timeout=self.timeout)
+        return True
 
-    def ConnectionMCallBack(self, dd):
-        if self._devname == '':
-            if dd.get('ID_SERIAL_SHORT') == self.serial_num:
-                self._devname = device['DEVNAME']
-                self.Connect()
-        elif dd.get('DEVNAME') == self._devname:
-            if dd.action == 'add':
-                self.Connect()
+    def unknownCommand(self, cmd):
+        """Account for the command nobody knows how to handle"""
+        self.unknown_commands += 1
 
-    def connectionMade(self):
-        print('Connected to', self._devname, 'serial number', self.serial_num)
-        self._updateTimer.start(self._refresh)
+        if getattr(self, '_debug', False):
+            print("Unknown command: %s" % cmd.string)
 
-    def connectionLost(self, reason):
-        print('Disconnected from', self._devname, 'serial number', self.serial_num, reason)
-        self._updateTimer.stop(self._refresh)
 
-    def update(self):
-        pass
+# Hardware protocols living in daemon_usb.py, imported only when first accessed
+_lazy_attributes = {'FTDIProtocol': 'daemon_usb', 'SerialUSBProtocol': 'daemon_usb'}
 
-    def dataReceived(self, data):
-        """Parse incoming data and split it into messages"""
-        # NOTE: user is responsible for not switching between binary ans string modes while in the process of receiving data
-        self._buffer = self._buffer + data
-        while len(self._buffer):
-            if len(self._buffer) >= self._binary_length:
-                bdata = self._buffer[:self._binary_length]
-                self._buffer = self._buffer[self._binary_length:]
-                self.processBinary(bdata)
 
-    def message(self, string):
-        """Sending outgoing message"""
-        if type(string) == str:
-            string = string.encode('ascii')+self._comand_end_character
-        else:
-            string = string+self._comand_end_character
-
-        if self._debug:
-            print(">>", self._devname, '>>', string)
+def __getattr__(name):
+    if name in _lazy_attributes:
+        import importlib
+        value = getattr(importlib.import_module(_lazy_attributes[name]), name)
+        globals()[name] = value
+        return value
 
-        self.transport.write(string)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
-class SimpleProtocol(Protocol):
+@implementer(IPushProducer)
+class SimpleProtocol(CommandDispatcher, Protocol):
     """Class corresponding to a single connection, either incoming or outgoing"""
     _debug = False
 
@@ -221,25 +125,81 @@ class SimpleProtocol(Protocol):
     _tcp_keepintvl = 1  # Interval between packets
     _tcp_keepcnt = 3  # Number of retries
     _tcp_user_timeout = 10000  # Number of milliseconds to wait before closing the connection on retransmission
+    _tcp_nodelay = None  # Explicit TCP_NODELAY setting, None to keep system default
+    _tcp_cork = None  # Explicit TCP_CORK setting (Linux only), None to keep system default
     _refresh = 1.0
     _comand_end_character = b'\n'
 
+    # Output coalescing: messages sent during one reactor iteration, or within _coalesce_delay
+    # seconds from the first one, are collected and written to the transport at once
+    _coalesce = False
+    _coalesce_delay = 0
+
+    # Flow control: when the transport can't keep up, outgoing messages are queued up to
+    # _output_high_water bytes. Above it, depending on _output_policy, either the oldest
+    # queued messages are dropped ('drop-oldest'), older queued messages of the same kind
+    # (_coalesce_kinds) are replaced by the latest one before dropping the oldest ('coalesce'),
+    # or the connection is closed ('disconnect')
+    _output_high_water = 1024*1024
+    _output_policy = 'drop-oldest'
+    _coalesce_kinds = (b'status',)
+
+    # Commands without registered handler are returned by processMessage() for the subclass to handle.
+    # If all the commands are registered, the rest may be counted as unknown instead
+    _registered_only = False
+
+    # Whether to offer delta-encoded status replies to the peers, see sendStatus().
+    # Only for the daemons replying to get_status with sendStatus() and not matching the whole command string
+    _status_delta = False
+
     def __init__(self, refresh=0):
-        self._buffer = b''
-        self._is_binary = False
-        self._binary_length = 0
+        self._framer = LineFramer(b'\0\n')
         self._peer = None
+        self._binary_handler = None  # Callback for the next binary block instead of processBinary()
+        self._wire = 'text'  # Wire format for typed messages, negotiated with the peer
+        self._status_since = None  # Status version the peer asked the delta from, None for plain status replies
+        self._subscription = None  # Status push settings, if the peer subscribed to it
+        self._subscriptionTimer = None
+
+        self._outbox = []  # Coalesced outgoing frames
+        self._outbox_messages = 0
+        self._flushTimer = None
+        self.writes_saved = 0  # Number of transport writes saved by coalescing
+
+        self._paused = False  # Whether the transport asked us to stop writing
+        self._queue = deque()  # Messages waiting for the transport, as (kind, data) tuples
+        self._queued_bytes = 0
+        self.dropped_messages = 0
+        self.dropped_bytes = 0
+
+        # Traffic and processing statistics, reported by get_metrics
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.process_time = Timing()
 
         if refresh > 0:
             self._refresh = refresh
 
+        # These will be set in Factory::buildProtocol
+        self.factory = None
+        self.object = None
+
         # Name and type of the connection peer
         self.name = ''
         self.type = ''
 
-        # These will be set in Factory::buildProtocol
-        self.factory = None
-        self.object = None
+    def _setIndexed(self, key, value):
+        """Set the attribute which is indexed in factory connection registry, and update the index"""
+        old = self.__dict__.get('_' + key)
+        self.__dict__['_' + key] = value
+
+        if self.__dict__.get('factory') is not None and old != value:
+            self.factory.reindex(self, key, old, value)
+
+    name = property(lambda self: self.__dict__.get('_name'), lambda self, value: self._setIndexed('name', value))
+    type = property(lambda self: self.__dict__.get('_type'), lambda self, value: self._setIndexed('type', value))
 
     def setName(self, name, type=None):
         """Set the name (and type) used to identify the connection"""
@@ -249,12 +209,17 @@ class SimpleProtocol(Protocol):
     def connectionMade(self):
         """Method called when connection is established"""
         self._peer = self.transport.getPeer()
-        self.factory.connections.append(self)
+        self.factory.addConnection(self)
 
         print("Connected to %s:%d" % (self._peer.host, self._peer.port))
 
-        self._updateTimer = LoopingCall(self.update)
-        self._updateTimer.start(self._refresh)
+        self._updateTimer = self.factory.scheduler.add(self.update, self._refresh)
+
+        # Let the transport tell us when its write buffer is full
+        try:
+            self.transport.registerProducer(self, True)
+        except Exception as e:
+            print("Flow control unavailable for %s:%d: %s" % (self._peer.host, self._peer.port, e))
 
         # Set up TCP keepalive for the connection
         self.transport.getHandle().setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
@@ -276,53 +241,177 @@ class SimpleProtocol(Protocol):
             # FIXME: works since 2.6.37 only
             self.transport.getHandle().setsockopt(socket.SOL_TCP, TCP_USER_TIMEOUT, self._tcp_user_timeout)
 
+        # Segment coalescing control
+        if self._tcp_nodelay is not None:
+            self.transport.getHandle().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(self._tcp_nodelay))
+        if self._tcp_cork is not None and hasattr(socket, 'TCP_CORK'):
+            self.transport.getHandle().setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(self._tcp_cork))
+
     def connectionLost(self, reason):
         """Method called when connection is finished"""
-        self.factory.connections.remove(self)
+        self.factory.removeConnection(self)
+
+        # Drop the messages we have not managed to send
+        if self._flushTimer is not None and self._flushTimer.active():
+            self._flushTimer.cancel()
+        self._flushTimer = None
+        self._outbox = []
+        self._outbox_messages = 0
+        self._queue.clear()
+        self._queued_bytes = 0
 
         self._updateTimer.stop()
+        self.unsubscribeStatus()
 
         print("Disconnected from %s:%d" % (self._peer.host, self._peer.port))
 
+    def closeConnection(self, abort=False):
+        """Close the connection, or abort it without sending the data left in the transport buffer"""
+        # Otherwise the transport keeps the connection open while waiting for paused producer to resume
+        try:
+            self.transport.unregisterProducer()
+        except Exception:
+            pass
+
+        if abort and hasattr(self.transport, 'abortConnection'):
+            self.transport.abortConnection()
+        else:
+            self.transport.loseConnection()
+
     def message(self, string):
         """Sending outgoing message"""
         if type(string) == str:
-            string = string.encode('ascii')+self._comand_end_character
-        else:
-            string = string+self._comand_end_character
+            string = string.encode('ascii')
 
         if self._debug:
             print(">>", self._peer.host, self._peer.port, '>>', string)
 
-        self.transport.write(string)
+        if self._comand_end_character:
+            self.writeFrames((string, self._comand_end_character))
+        else:
+            self.writeFrames((string,))
+
+    def writeFrames(self, frames, kind=None):
+        """
+        Send the sequence of already encoded byte strings, forming a single message, to the transport.
+        Optional _kind_ is used to coalesce queued messages, by default it is the first word of the message
+        """
+        self.messages_out += 1
+        for frame in frames:
+            self.bytes_out += len(frame)
+
+        if self._paused:
+            self._enqueue(b''.join(frames), kind)
+        elif self._coalesce:
+            self._outbox.extend(frames)
+            self._outbox_messages += 1
+            if self._flushTimer is None:
+                self._flushTimer = self.factory._reactor.callLater(self._coalesce_delay, self.flush)
+        elif len(frames) == 1:
+            self.transport.write(frames[0])
+        else:
+            self.transport.writeSequence(frames)
+
+    def flush(self):
+        """Write all coalesced outgoing messages to the transport at once"""
+        if self._flushTimer is not None and self._flushTimer.active():
+            self._flushTimer.cancel()
+        self._flushTimer = None
+
+        if self._outbox:
+            data = b''.join(self._outbox)
+            self.writes_saved += self._outbox_messages - 1
+            self._outbox = []
+            self._outbox_messages = 0
+
+            if self._paused:
+                self._enqueue(data)
+            else:
+                self.transport.write(data)
+
+    def _enqueue(self, data, kind=None):
+        """Queue the message while the transport is paused, applying the overflow policy"""
+        if kind is None:
+            kind = data.split(b' ', 1)[0]
+
+        if self._output_policy == 'coalesce' and kind in self._coalesce_kinds:
+            # Only the latest message of this kind matters
+            for item in [_ for _ in self._queue if _[0] == kind]:
+                self._queue.remove(item)
+                self._drop(item[1])
+
+        self._queue.append((kind, data))
+        self._queued_bytes += len(data)
+
+        if self._queued_bytes > self._output_high_water:
+            if self._output_policy == 'disconnect':
+                print("Output queue overflow for %s:%d, disconnecting" % (self._peer.host, self._peer.port))
+                for item in self._queue:
+                    self._drop(item[1])
+                self._queue.clear()
+                self._queued_bytes = 0
+                self.closeConnection(abort=True)
+            else:
+                while self._queued_bytes > self._output_high_water and len(self._queue) > 1:
+                    self._drop(self._queue.popleft()[1])
+
+    def _drop(self, data):
+        self._queued_bytes -= len(data)
+        self.dropped_messages += 1
+        self.dropped_bytes += len(data)
+
+    def pauseProducing(self):
+        """Called by the transport when its write buffer is full"""
+        self._paused = True
+
+        # Coalesced messages should go out before anything sent later
+        if self._flushTimer is not None and self._flushTimer.active():
+            self._flushTimer.cancel()
+        self._flushTimer = None
+        if self._outbox:
+            self._enqueue(b''.join(self._outbox), kind=b'')
+            self._outbox = []
+            self._outbox_messages = 0
+
+    def resumeProducing(self):
+        """Called by the transport when it is ready to accept more data"""
+        self._paused = False
+
+        # Writing may pause us again, then the rest stays queued
+        while self._queue and not self._paused:
+            kind, data = self._queue.popleft()
+            self._queued_bytes -= len(data)
+            self.transport.write(data)
+
+    def stopProducing(self):
+        """Called by the transport when the connection is going away"""
+        self._queue.clear()
+        self._queued_bytes = 0
 
     def dataReceived(self, data):
         """Parse incoming data and split it into messages"""
         # NOTE: user is responsible for not switching between binary ans string modes while in the process of receiving data
-        self._buffer = self._buffer + data
-        while len(self._buffer):
-            if self._is_binary:
-                if len(self._buffer) >= self._binary_length:
-                    bdata = self._buffer[:self._binary_length]
-                    self._buffer = self._buffer[self._binary_length:]
-                    self.processBinary(bdata)
-                    self._is_binary = False
+        self.bytes_in += len(data)
+        self._framer.feed(data)
+        for is_binary, view in self._framer.frames():
+            self.messages_in += 1
+            t0 = time.perf_counter()
+            if is_binary:
+                if self._binary_handler is not None:
+                    handler, self._binary_handler = self._binary_handler, None
+                    handler(view.tobytes())
                 else:
-                    break
+                    self.processBinary(view.tobytes())
             else:
-                try:
-                    token, self._buffer = re.split(b'\0|\n', self._buffer, 1)
-                    self.processMessage(token.decode('ascii'))
-                except ValueError:
-                    break
+                self.processMessage(str(view, 'ascii'))
+            self.process_time.add(time.perf_counter() - t0)
 
     def switchToBinary(self, length=0):
         """
         Switches the connection to binary mode to receive _length_ bytes.
         Will call processBinary() callback when completed
         """
-        self._is_binary = True
-        self._binary_length = length
+        self._framer.switchToBinary(length)
         if self._debug:
             print("%s:%d = binary mode waiting for %d bytes" % (self._peer.host, self._peer.port, length))
 
@@ -333,31 +422,399 @@ class SimpleProtocol(Protocol):
 
         cmd = Command(string)
 
-        # Some generic commands every connection should understand
-        if cmd.name == 'get_id':
-            # Identification of the daemon
-            self.message(('id name=%s type=%s' % (self.factory.name, self.factory.type)).encode('ascii'))
-        elif cmd.name == 'id':
-            # Set peer identification
-            self.name = cmd.get('name', '')
-            self.type = cmd.get('type', '')
-        elif cmd.name == 'exit':
-            # Stops the daemon
-            self.factory._reactor.stop()
+        if cmd.name == 'get_status':
+            # Remember whether the peer wants delta-encoded reply, for sendStatus()
+            if 'delta' in cmd.kwargs:
+                try:
+                    self._status_since = int(cmd.kwargs['delta'])
+                except (TypeError, ValueError):
+                    # Malformed version, just send the full snapshot
+                    self._status_since = 0
+            else:
+                self._status_since = None
+
+        if self.dispatchCommand(cmd):
+            return None
+
+        if self._registered_only:
+            self.unknownCommand(cmd)
+            return None
+
+        return cmd
+
+    # Some generic commands every connection should understand
+
+    @commandHandler('get_id')
+    def commandGetId(self, cmd):
+        """Identification of the daemon, along with the list of supported wire formats"""
+        string = 'id name=%s type=%s wire=%s' % (self.factory.name, self.factory.type, ','.join(wire.formats()))
+        features = []
+        if self._status_delta:
+            features.append('delta')
+        if type(self).getStatus is not SimpleProtocol.getStatus:
+            # Status may be pushed to subscribers only if we can get it without a request
+            features.append('push')
+        if features:
+            string += ' status=' + ','.join(features)
+        self.message(string.encode('ascii'))
+
+    @commandHandler('id')
+    def commandId(self, cmd):
+        """Set peer identification"""
+        self.name = cmd.get('name', '')
+        self.type = cmd.get('type', '')
+
+    @commandHandler('get_metrics')
+    def commandGetMetrics(self, cmd):
+        """Runtime statistics of the whole process"""
+        self.sendObject('metrics', self.factory.metrics.snapshot())
+
+    @commandHandler('profile')
+    def commandProfile(self, cmd):
+        """Runtime profiling control"""
+        # Reply under a different name, so that the peer does not take it for a new command
+        self.sendObject('profile_state', profiler.command(cmd, name=self.factory.name))
+
+    @commandHandler('set_wire')
+    def commandSetWire(self, cmd):
+        """Peer asks us to send typed messages in given format, if we support it"""
+        self._wire = wire.negotiate(cmd.get('format', 'text'))
+
+    @commandHandler('msgpack')
+    def commandMsgpack(self, cmd):
+        """Header of the binary typed message"""
+        if cmd.args:
+            self.receiveObject(int(cmd.args[0]))
+
+    @commandHandler('subscribe_status')
+    def commandSubscribeStatus(self, cmd):
+        """Peer asks to push the status to it when it changes"""
+        self.unsubscribeStatus()
+
+        if type(self).getStatus is SimpleProtocol.getStatus:
+            return
+
+        deadbands = {key[9:]: float(value) for key, value in cmd.kwargs.items() if key.startswith('deadband.')}
+        self._subscription = StatusSubscription(min_interval=float(cmd.get('min_interval', 0.1)),
+                                                heartbeat=float(cmd.get('heartbeat', 10.0)),
+                                                deadband=float(cmd.get('deadband', 0)),
+                                                deadbands=deadbands)
+        self._subscriptionTimer = self.factory.scheduler.add(self.publishStatus, self._subscription.min_interval)
+
+    @commandHandler('unsubscribe_status')
+    def commandUnsubscribeStatus(self, cmd):
+        self.unsubscribeStatus()
+
+    @commandHandler('exit')
+    def commandExit(self, cmd):
+        """Stops the daemon"""
+        if self.factory.hosted:
+            # Other daemons share the reactor, so stop only this one, along with its hardware connections
+            factories = [self.factory]
+            if isinstance(self.object, dict):
+                factories += [_ for _ in self.object.values() if isinstance(_, SimpleFactory) and _ is not self.factory]
+
+            for factory in factories:
+                factory.stop()
         else:
-            return cmd
-
-        return None
+            self.factory._reactor.stop()
 
     def processBinary(self, data):
         """Process binary data when completely read out"""
         if self._debug:
             print("%s:%d binary > %d bytes" % (self._peer.host, self._peer.port, len(data)))
 
+    def receiveObject(self, length):
+        """Receive the binary typed message of given length and pass it to processObject()"""
+        self._binary_handler = self._processObjectData
+        self.switchToBinary(length)
+
+    def _processObjectData(self, data):
+        name, kwargs = wire.unpack(data)
+
+        if self._debug:
+            print("%s:%d > %s %r" % (self._peer.host, self._peer.port, name, kwargs))
+
+        self.processObject(name, kwargs)
+
+    def processObject(self, name, kwargs):
+        """
+        Process typed message received in binary wire format.
+        By default it is converted back to text and passed to processMessage()
+        """
+        self.processMessage(wire.toString(name, kwargs))
+
+    def sendObject(self, name, kwargs):
+        """Send typed message, in binary form if negotiated with the peer, or as a text otherwise"""
+        if self._wire == 'msgpack':
+            data = wire.pack(name, kwargs)
+
+            if self._debug:
+                print(">>", self._peer.host, self._peer.port, '>>', name, '(%d bytes)' % len(data))
+
+            self.writeFrames((('msgpack %d' % len(data)).encode('ascii') + self._comand_end_character, data), kind=name.encode('ascii'))
+        else:
+            self.message(wire.toString(name, kwargs))
+
+    def sendStatus(self, status):
+        """
+        Send status reply with the values from a given dict.
+        If the peer asked for delta-encoded status, only the values changed since its version are sent
+        """
+        if self._status_since is None:
+            self.sendObject('status', status)
+        else:
+            tracker = self.factory.status
+            tracker.update(status)
+
+            values, full = tracker.delta(self._status_since)
+            values['_version'] = tracker.version
+            values['_full'] = int(full)
+
+            self.sendObject('status', values)
+
+    def getStatus(self):
+        """
+        Current status as a dict. Daemons able to tell it without a request to the hardware
+        should override it, so that the status may be pushed to subscribed peers
+        """
+        return None
+
+    @catch
+    def publishStatus(self):
+        """Push the status to subscribed peer, if it changed enough or it is time for a heartbeat"""
+        if self._subscription is None:
+            return
+
+        status = self.getStatus()
+        if status is None:
+            return
+
+        changes = self._subscription.changes(status, self.factory._reactor.seconds())
+        if changes is None:
+            return
+
+        values, full = changes
+
+        tracker = self.factory.status
+        tracker.update(status)
+
+        values['_version'] = tracker.version
+        values['_full'] = int(full)
+
+        self.sendObject('status', values)
+
+    def unsubscribeStatus(self):
+        if self._subscriptionTimer is not None:
+            self._subscriptionTimer.stop()
+            self._subscriptionTimer = None
+
+        self._subscription = None
+
     def update(self):
         pass
 
 
+class CommandTimeout(Exception):
+    """Command sent through CommandQueue got no reply in time"""
+    pass
+
+
+class CommandQueue(object):
+    """
+    Pipelined request / response engine for instrument protocols replying to the commands in order.
+    Commands from clients are sent before the ones issued by the driver itself (like status polling),
+    up to _depth_ of them are sent to the device without waiting for the replies, and every reply is
+    matched to the oldest command in flight. Commands not replied within _timeout_ seconds are re-sent
+    up to _retries_ times, and then their Deferreds fail with CommandTimeout. As replies carry no
+    identification, after a timeout the queue resyncs: the rest of the commands in flight are re-sent
+    as well, but only after _settle_ seconds (same as the timeout by default), and the late replies
+    arriving meanwhile are discarded instead of being matched to the wrong commands.
+    """
+
+    def __init__(self, protocol, depth=1, timeout=None, retries=0, settle=None):
+        self.protocol = protocol
+        self.depth = depth
+        self.timeout = timeout
+        self.retries = retries
+        self.settle = settle
+
+        self._settleTimer = None  # Set while waiting for the late replies after a timeout
+
+        self._urgent = deque()  # Commands from clients, waiting to be sent
+        self._queue = deque()  # Commands from the driver itself, waiting to be sent
+        self.inflight = deque()  # Commands sent and waiting for the replies
+
+        # Statistics
+        self.sent = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.resent = 0
+        self.failed = 0
+        self.discarded = 0  # Replies not matched to any command
+        self.latency = Timing()
+
+    def __len__(self):
+        return len(self._urgent) + len(self._queue) + len(self.inflight)
+
+    def add(self, cmd, source='itself', keep=True, timeout=None, retries=None, urgent=None, priority=False):
+        """
+        Queue the command for sending. If _keep_ is set, the command expects a reply, and the returned
+        Deferred fires with it, otherwise it fires with None once the command is sent.
+        By default, the commands from any _source_ except 'itself' go before the driver own ones.
+        Commands with _priority_ set go before all the waiting ones, like error queries.
+        """
+        entry = {'cmd': cmd, 'source': source, 'keep': keep, 'sent': False, 'tries': 0, 'time': None, 'timer': None,
+                 'timeout': self.timeout if timeout is None else timeout,
+                 'retries': self.retries if retries is None else retries,
+                 'deferred': Deferred()}
+
+        if urgent is None:
+            urgent = source != 'itself'
+
+        if priority:
+            self._urgent.appendleft(entry)
+        elif urgent:
+            self._urgent.append(entry)
+        else:
+            self._queue.append(entry)
+
+        self.pump()
+
+        return entry['deferred']
+
+    def current(self):
+        """The oldest command waiting for the reply, or None"""
+        return self.inflight[0] if self.inflight else None
+
+    def reply(self, string):
+        """
+        Match the reply to the oldest command in flight, forward it to the client who sent the command,
+        and fire its Deferred. Returns the command entry, or None if no command expected the reply.
+        """
+        if not self.inflight:
+            # Late reply to the timed out command, or unsolicited one
+            self.discarded += 1
+            return None
+
+        entry = self.inflight.popleft()
+        self._cancelTimer(entry)
+
+        self.replies += 1
+        self.latency.add(self.protocol.factory._reactor.seconds() - entry['time'])
+
+        if entry['source'] != 'itself':
+            self.forward(entry, string)
+
+        entry['deferred'].callback(string)
+
+        self.pump()
+
+        return entry
+
+    def forward(self, entry, string):
+        """Send the reply back to the client who sent the command"""
+        daemon = self.protocol.object.get('daemon') if isinstance(self.protocol.object, dict) else None
+        if daemon is not None:
+            daemon.messageAll(string, entry['source'])
+
+    def clear(self):
+        """Drop all queued and in flight commands, e.g. on disconnection"""
+        entries = list(self.inflight) + list(self._urgent) + list(self._queue)
+        self.inflight.clear()
+        self._urgent.clear()
+        self._queue.clear()
+
+        if self._settleTimer is not None and self._settleTimer.active():
+            self._settleTimer.cancel()
+        self._settleTimer = None
+
+        for entry in entries:
+            self._cancelTimer(entry)
+            self._fail(entry, CommandTimeout('Command %r cancelled' % entry['cmd']))
+
+    def pump(self):
+        """Send as many waiting commands as the pipelining depth allows"""
+        if self.protocol.transport is None or self._settleTimer is not None:
+            return
+
+        while len(self.inflight) < self.depth and (self._urgent or self._queue):
+            entry = self._urgent.popleft() if self._urgent else self._queue.popleft()
+            self._send(entry)
+
+    def _send(self, entry):
+        entry['sent'] = True
+        entry['tries'] += 1
+        entry['time'] = self.protocol.factory._reactor.seconds()
+        self.sent += 1
+
+        SimpleProtocol.message(self.protocol, entry['cmd'])
+
+        if entry['keep']:
+            self.inflight.append(entry)
+            if entry['timeout']:
+                entry['timer'] = self.protocol.factory._reactor.callLater(entry['timeout'], self._expire, entry)
+        else:
+            entry['deferred'].callback(None)
+
+    def _expire(self, entry):
+        entry['timer'] = None
+        if entry not in self.inflight:
+            return
+
+        self.timeouts += 1
+
+        # Replies to the commands sent after this one may not be trusted anymore, so re-send them too
+        resend = [_ for _ in self.inflight if _ is not entry]
+        self.inflight.clear()
+        for other in resend:
+            self._cancelTimer(other)
+            # It is not their fault, so it does not count as a try
+            other['tries'] -= 1
+
+        if entry['tries'] <= entry['retries']:
+            resend.insert(0, entry)
+        else:
+            self.failed += 1
+            self._fail(entry, CommandTimeout('No reply to %r' % entry['cmd']))
+
+        # Re-send them before anything else
+        self.resent += len(resend)
+        self._urgent.extendleft(reversed(resend))
+
+        # Wait for the late replies before sending anything
+        settle = entry['timeout'] if self.settle is None else self.settle
+        self._settleTimer = self.protocol.factory._reactor.callLater(settle, self._resync)
+
+    def _resync(self):
+        self._settleTimer = None
+        self.pump()
+
+    def _cancelTimer(self, entry):
+        if entry['timer'] is not None and entry['timer'].active():
+            entry['timer'].cancel()
+        entry['timer'] = None
+
+    def _fail(self, entry, exc):
+        entry['deferred'].errback(exc)
+        # Nobody may be listening, so do not let it end up as unhandled error
+        entry['deferred'].addErrback(lambda failure: None)
+
+    def stats(self):
+        """Queue statistics, with the reply latencies"""
+        result = {'pending': len(self._urgent) + len(self._queue),
+                  'inflight': len(self.inflight),
+                  'sent': self.sent,
+                  'replies': self.replies,
+                  'timeouts': self.timeouts,
+                  'resent': self.resent,
+                  'failed': self.failed,
+                  'discarded': self.discarded}
+        result.update(self.latency.summary('latency'))
+
+        return result
+
+
 class SimpleFactory(Factory):
     """
     Class that manages all connections, both incoming and outgoing.
@@ -365,24 +822,47 @@ class SimpleFactory(Factory):
     so it may be accessed from connection protocol
     """
 
+    # Connection attributes indexed for fast lookups
+    _indexed_keys = ('name', 'type', 'addr')
+
     def __init__(self, protocol, object=None, reactor=None, name=None, type=None):
         self._protocol = protocol
         self._reactor = reactor
 
         self.connections = []  # List of all currently active connections
+        self._index = {_: {} for _ in self._indexed_keys}  # Active connections by the values of their indexed attributes
         self.object = object  # User-supplied object what should be accessible by all connections and daemon itself
 
         # Name and type of the daemon
-        self.name = ''
-        self.type = ''
+        self.name = name or ''
+        self.type = type or ''
 
         # number of connections made since the deamon start
         self._nconnections = 0
 
+        # Whether the daemon shares the reactor with others (see host.py), so that it should not stop it
+        self.hosted = False
+
+        self._ports = []  # Listening ports
+        self._services = []  # Persistent outgoing connections
+
         if not self._reactor:
             from twisted.internet import reactor
             self._reactor = reactor
 
+        # Periodic tasks of all connections, shared between all factories using the same reactor
+        self.scheduler = PollScheduler.forReactor(self._reactor)
+
+        # Runtime metrics registry, also shared
+        self.metrics = Metrics.forReactor(self._reactor)
+        self.metrics_prefix = ''  # Prepended to connection metrics names, to tell apart several daemons in one process
+        self.metrics.addSource(self.getMetrics)
+        # Scheduler is shared, so it is registered (and reported) just once
+        self.metrics.addSource(self.scheduler.metrics)
+
+        # Versioned status for delta-encoded replies, see sendStatus()
+        self.status = StatusTracker()
+
     def buildProtocol(self, addr):
         p = self._protocol()
 
@@ -396,39 +876,148 @@ class SimpleFactory(Factory):
 
         return p
 
-    def findConnection(self, name=None, type=None):
+    def addConnection(self, c):
+        """Register new active connection"""
+        self.connections.append(c)
+        for key in self._indexed_keys:
+            self._index[key].setdefault(getattr(c, key, None), {})[c] = True
+
+    def removeConnection(self, c):
+        """Unregister the connection"""
+        self.connections.remove(c)
+        for key in self._indexed_keys:
+            self._unindex(c, key, getattr(c, key, None))
+
+    def _unindex(self, c, key, value):
+        bucket = self._index[key].get(value)
+        if bucket is not None:
+            bucket.pop(c, None)
+            if not bucket:
+                del self._index[key][value]
+
+    def reindex(self, c, key, old, new):
+        """Update the index after the connection attribute _key_ changed its value from _old_ to _new_"""
+        if c in self._index[key].get(old, ()):
+            self._unindex(c, key, old)
+            self._index[key].setdefault(new, {})[c] = True
+
+    def indexValues(self, key):
+        """List of distinct values of indexed attribute among active connections"""
+        return list(self._index[key].keys())
+
+    def findConnections(self, name=None, type=None, **kwargs):
+        """List of active connections with given name and type (and other indexed attributes, like addr)"""
+        filters = [(_, v) for _, v in [('name', name), ('type', type)] if v]
+        filters += [(_, v) for _, v in kwargs.items() if v is not None]
+
+        if not filters:
+            return list(self.connections)
+
+        # Start from the smallest matching index bucket and check the rest of attributes directly
+        buckets = [self._index[_].get(v, {}) for _, v in filters]
+        bucket = min(buckets, key=len)
+
+        return [c for c in bucket if all(getattr(c, _, None) == v for _, v in filters)]
+
+    def findConnection(self, name=None, type=None, **kwargs):
         """Find the first connection with given name and type among the active connections"""
-        for c in self.connections:
-            isMatched = True
+        if not name and not type and not kwargs:
+            return self.connections[0] if self.connections else None
 
-            if name and c.name != name:
-                isMatched = False
+        result = self.findConnections(name=name, type=type, **kwargs)
 
-            if type and c.type != type:
-                isMatched = False
+        return result[0] if result else None
 
-            if isMatched:
-                return c
+    def broadcast(self, string, name=None, type=None):
+        """
+        Send the message to all (or with a given name/type only) active connections.
+        The message is encoded, with terminator, only once and the same bytes object
+        is written to every connection. Connections with custom message() methods
+        get the encoded message without terminator. Failures do not prevent sending to
+        other connections, and are returned as a list of (connection, exception) tuples.
+        """
+        data = string.encode('ascii') if not isinstance(string, bytes) else string
+        frames = {}  # Encoded message with terminator, for every terminator in use
+        failures = []
 
-        return None
+        for c in self.findConnections(name=name, type=type):
+            try:
+                if c.__class__.message is SimpleProtocol.message:
+                    term = c._comand_end_character
+                    if term not in frames:
+                        frames[term] = data + term
+
+                    if c._debug:
+                        print(">>", c._peer.host, c._peer.port, '>>', frames[term])
+
+                    c.writeFrames((frames[term],))
+                else:
+                    c.message(data)
+            except Exception as e:
+                failures.append((c, e))
+
+        return failures
 
     def messageAll(self, string, name=None, type=None, **kwargs):
         """Send the message to all (or with a given name/type only) active connections"""
+        if kwargs:
+            # Custom message() arguments, let every connection handle the message by itself
+            data = string.encode('ascii') if not isinstance(string, bytes) else string
+            failures = []
+            for c in self.findConnections(name=name, type=type):
+                try:
+                    c.message(data, **kwargs)
+                except Exception as e:
+                    failures.append((c, e))
+        else:
+            failures = self.broadcast(string, name=name, type=type)
+
+        for c, e in failures:
+            print("Error sending message to %s: %s" % (c.name, e))
+
+        return failures
+
+    def getMetrics(self):
+        """
+        Statistics of every active connection, prefixed with the factory name (or protocol class name,
+        if not set) and connection name, so that the connections of different factories are kept apart
+        """
+        result = {}
+
         for c in self.connections:
-            if name and c.name != name:
-                continue
-            if type and c.type != type:
-                continue
-            try:
-                c.message(string.encode('ascii'), **kwargs)
-            except Exception as e:
-                c.message(string, **kwargs)
-                
-                
+            prefix = '%s%s.%s.' % (self.metrics_prefix, self.name or self._protocol.__name__, c.name)
+
+            result[prefix + 'bytes_in'] = c.bytes_in
+            result[prefix + 'bytes_out'] = c.bytes_out
+            result[prefix + 'messages_in'] = c.messages_in
+            result[prefix + 'messages_out'] = c.messages_out
+            result[prefix + 'queued_bytes'] = c._queued_bytes
+            result[prefix + 'dropped_messages'] = c.dropped_messages
+            result[prefix + 'unknown_commands'] = c.unknown_commands
+            if c._subscription is not None:
+                result[prefix + 'status_pushes'] = c._subscription.pushes
+                result[prefix + 'status_suppressed'] = c._subscription.suppressed
+            result.update(c.process_time.summary(prefix + 'process'))
+
+            task = getattr(c, '_updateTimer', None)
+            if task is not None:
+                result[prefix + 'update_overruns'] = task.overruns
+                result[prefix + 'update_max'] = task.max_duration
+
+            # Hardware command queue, if the connection keeps one
+            commands = getattr(c, 'commands', None)
+            if isinstance(commands, (list, deque, CommandQueue)):
+                result[prefix + 'commands'] = len(commands)
+            if isinstance(commands, CommandQueue):
+                for key, value in commands.stats().items():
+                    result[prefix + 'commands_' + key] = value
+
+        return result
+
     def listen(self, port=0):
         """Listen for incoming connections on a given port"""
         print("Listening for incoming connections on port %d" % port)
-        TCP4ServerEndpoint(self._reactor, port).listen(self)
+        TCP4ServerEndpoint(self._reactor, port).listen(self).addCallback(self._ports.append)
 
     def connect(self, host, port, reconnect=True):
         """Initiate outgoing connection, either persistent or no"""
@@ -437,9 +1026,25 @@ class SimpleFactory(Factory):
         if reconnect:
             service = ClientService(ep, self, retryPolicy=lambda x: 1)
             service.startService()
+            self._services.append(service)
         else:
             ep.connect(self)
 
+    def stop(self):
+        """Stop listening and reconnecting, and close all connections, leaving the reactor running"""
+        ports, self._ports = self._ports, []
+        for port in ports:
+            port.stopListening()
+
+        services, self._services = self._services, []
+        for service in services:
+            service.stopService()
+
+        self.metrics.removeSource(self.getMetrics)
+
+        for c in list(self.connections):
+            c.closeConnection()
+
     def log(self, message, type='info'):
         """Generic interface for sending system-level log messages, to be stored to DB and shown in GUI"""
         # TODO: should we send it to specific names/types only?
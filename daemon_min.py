@@ -9,10 +9,10 @@ from serial import Serial
 from time import time
 from logging import getLogger, ERROR, DEBUG
 from binascii import crc32
-from pyudev import Context, Monitor, MonitorObserver
 from struct import pack
 
-from twisted.internet.task import LoopingCall
+from scheduler import PollScheduler
+from hotplug import HotplugService
 
 min_logger = getLogger('min')
 
@@ -112,31 +112,26 @@ class MINProtocol():
         if refresh > 0:
             self._refresh = refresh
 
-        self._updateTimer = LoopingCall(self.update)
-        self._updateTimer.start(self._refresh)
+        self._updateTimer = PollScheduler.forReactor().add(self.update, self._refresh)
 
-        context = Context()
-        for device in context.list_devices(subsystem='tty'):
-            if 'DEVLINKS' in device.keys() and self._devname in device.get('DEVLINKS'):
-                self.Connect()
-                self.connectionMade()
+        hotplug = HotplugService.forReactor()
+        for device in hotplug.find(subsystem='tty', devlink=self._devname):
+            self.Connect()
+            self.connectionMade()
 
-        cm = Monitor.from_netlink(context)
-        cm.filter_by(subsystem='tty')
-        observer = MonitorObserver(cm, callback=self.ConnectionMCallBack, name='monitor-observer')
-        observer.start()
+        self._hotplug = hotplug.register(self.ConnectionMCallBack, subsystem='tty', devlink=self._devname)
 
     def Connect(self):
         self.object['hw'] = Serial(port=self._devname, baudrate=self.baudrate, bytesize=self.bytesize,
                                    parity=self.parity, stopbits=self.stopbits, timeout=self.timeout)
 
     def ConnectionMCallBack(self, dd):
-        if self._devname in dd.get('DEVLINKS'):
-            if dd.action == 'add':
-                self.Connect()
-                self.connectionMade()
-            if dd.action == 'remove':
-                self.connectionLost()
+        # Only the events for our device are delivered here by HotplugService
+        if dd.action == 'add':
+            self.Connect()
+            self.connectionMade()
+        if dd.action == 'remove':
+            self.connectionLost()
 
     def connectionMade(self):
         self.transport_reset()
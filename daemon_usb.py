@@ -0,0 +1,326 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# USB and serial device protocols. Kept separate from daemon.py so that the daemons talking
+# only TCP do not have to import pylibftdi, pyudev and serial port support. They are still
+# available as daemon.FTDIProtocol and daemon.SerialUSBProtocol, loaded on first access.
+
+from twisted.internet.protocol import Protocol
+from twisted.internet.serialport import SerialPort
+from twisted.internet import task
+
+import pylibftdi
+
+import time
+import threading
+
+from scheduler import PollScheduler
+from hotplug import HotplugService
+from daemon import catch
+
+
+class FTDIProtocol(Protocol):
+    """ Class for outgoing connection to a FTDI device """
+    _debug = False
+    _refresh = 1.0
+    pylibftdi.USB_PID_LIST.append(0xFAF0)
+
+    # How to get the data from the device: 'poll' calls read() every refresh/10 seconds,
+    # 'thread' reads it in a dedicated thread and passes complete frames to ProcessMessage
+    _reader = 'poll'
+    _read_chunk = 4096  # Max number of bytes to read at once in reader thread
+    _read_idle = 0.002  # Pause after empty read, on top of the latency timer wait inside libftdi
+
+    _settle_delay = 0.05  # Pause before and after flushing the buffers of just opened device
+
+    def __init__(self, serial_num, obj, refresh=0, baudrate=115200, reader=None):
+        # Name and type of the connection peer
+        self.name = ''
+        self.type = ''
+
+        self.object = obj
+        self.baudrate = baudrate
+        self.serial_num = serial_num
+        self.devpath = ''
+
+        if refresh > 0:
+            self._refresh = refresh
+
+        if reader is not None:
+            self._reader = reader
+
+        self.device = pylibftdi.Device(mode='b', device_id=self.serial_num, lazy_open=True)
+        self.device._baudrate = self.baudrate
+
+        from twisted.internet import reactor
+        self._reactor = reactor
+
+        scheduler = PollScheduler.forReactor(self._reactor)
+        self._updateTimer = scheduler.add(self.update, self._refresh)
+        if self._reader == 'thread':
+            self._readTimer = None
+        else:
+            self._readTimer = scheduler.add(self.read, self._refresh/10)
+
+        # Reader thread state
+        self._rx = bytearray()
+        self._readThread = None
+        self._readLock = threading.Lock()
+        self._reading = False
+
+        # Reader statistics
+        self.read_calls = 0
+        self.read_bytes = 0
+        self.idle_reads = 0
+        self.frames = 0
+        self.latency_count = 0
+        self.latency_sum = 0
+        self.latency_max = 0
+
+        # the shared udev service will monitor the connection and call ConnectionMade and ConnectionLost
+        # pyftdi doesn't seem to support this so this pyudev service is necessary
+
+        hotplug = HotplugService.forReactor()
+        # find out whether device is already connected and if that is the case open ftdi connection
+        for device in hotplug.find(subsystem='usb', serial=self.serial_num):
+            if device.get('ID_SERIAL_SHORT') == self.serial_num:
+                for ch in device.children:
+                    if 'tty' not in ch.get('DEVPATH'):
+                        self.devpath = ch.get('DEVPATH')
+                        self.ConnectionMade()
+
+        self._hotplug = hotplug.register(self.ConnectionMCallBack, subsystem='usb', serial=self.serial_num)
+
+    def ConnectionMCallBack(self, dd):
+        if self.devpath == '':
+            if dd.get('ID_SERIAL_SHORT') == self.serial_num:
+                for ch in dd.children:
+                    if 'tty' not in ch.get('DEVPATH'):
+                        self.devpath = ch.get('DEVPATH')
+                        self.ConnectionMade()
+        elif dd.get('DEVPATH') == self.devpath:
+            if dd.action == 'remove':
+                self.ConnectionLost()
+            if dd.action == 'add' and self.device.closed:
+                self.ConnectionMade()
+
+    def ConnectionMade(self):
+        """
+        Open the device and set it up. The setup is finished asynchronously, as the device needs some time to settle,
+        so it returns a Deferred firing with True when it is done, or with False if the device is gone meanwhile
+        """
+        self.device.open()
+        self.device.baudrate = self.baudrate
+        self.device.ftdi_fn.ftdi_set_line_property(8, 1, 0)  # number of bits, number of stop bits, no parity
+
+        # Hotplug callbacks run in the reactor thread, so we should not block it while waiting
+        d = task.deferLater(self._reactor, self._settle_delay, self._flushDevice)
+        d.addCallback(lambda _: task.deferLater(self._reactor, self._settle_delay, self._setupDevice))
+
+        return d
+
+    @catch
+    def _flushDevice(self):
+        if not self.device.closed:
+            self.device.flush(pylibftdi.FLUSH_BOTH)
+
+    @catch
+    def _setupDevice(self):
+        if self.device.closed:
+            # Disconnected while settling
+            return False
+
+        # this is pulled from ftdi.h
+        SIO_RTS_CTS_HS = (0x1 << 8)
+        self.device.ftdi_fn.ftdi_setflowctrl(SIO_RTS_CTS_HS)
+        self.device.ftdi_fn.ftdi_setrts(1)
+
+        if self._reader == 'thread':
+            self.startReading()
+
+        print('Connected to', self.devpath)
+
+        return True
+
+    def ConnectionLost(self):
+        self.stopReading()
+        self.device.close()
+        print('Disconnected from', self.devpath)
+
+    def startReading(self):
+        """Start the thread reading the data from the device"""
+        self._rx = bytearray()
+        self._reading = True
+        self._readThread = threading.Thread(target=self._readLoop, name='ftdi-reader-' + str(self.serial_num))
+        self._readThread.daemon = True
+        self._readThread.start()
+
+    def stopReading(self):
+        """Stop the reader thread, waiting for the read in progress to finish"""
+        if self._readThread is None:
+            return
+
+        self._reading = False
+        with self._readLock:
+            self._readThread = None
+
+    def _readLoop(self):
+        # Runs in the reader thread. libftdi read returns after the chip latency timer (16 ms by default)
+        # expires even if there is no data, and releases GIL while waiting.
+        while self._reading:
+            with self._readLock:
+                if not self._reading or self.device.closed:
+                    break
+                try:
+                    data = self.device.read(self._read_chunk)
+                except:
+                    import traceback
+                    traceback.print_exc()
+                    break
+
+            self.read_calls += 1
+
+            if data:
+                self.read_bytes += len(data)
+                self._reactor.callFromThread(self.dataReceived, data, time.time())
+            else:
+                self.idle_reads += 1
+                time.sleep(self._read_idle)
+
+    def dataReceived(self, data, when=None):
+        """Accumulate incoming data and pass complete frames to ProcessMessage, in reactor thread"""
+        if when is not None:
+            latency = time.time() - when
+            self.latency_count += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+
+        self._rx += data
+
+        while self._rx:
+            result = self.extractFrame(self._rx)
+            if result is None:
+                break
+
+            frame, size = result
+            del self._rx[:size]
+
+            self.frames += 1
+            self.ProcessMessage(frame)
+
+    def extractFrame(self, buffer):
+        """
+        Get the first complete frame from the buffer, returning (frame, size) tuple or None if more data is needed.
+        Default is to pass everything received as a single frame.
+        """
+        return bytes(buffer), len(buffer)
+
+    def readerStats(self):
+        """Reader thread statistics"""
+        return {'reader': self._reader,
+                'read_calls': self.read_calls,
+                'read_bytes': self.read_bytes,
+                'idle_reads': self.idle_reads,
+                'frames': self.frames,
+                'latency_mean': self.latency_sum/self.latency_count if self.latency_count else 0,
+                'latency_max': self.latency_max}
+
+    def send_message(self, packed_msg):
+        if self._debug:
+            print(">>", self.devpath, '>>', packed_msg, '(', packed_msg.hex(':'), ')')
+        self.device.write(packed_msg)
+
+    def ProcessMessage(self, msg):
+        pass
+
+    def update(self):
+        print('dummy updater')
+        pass
+
+    def read(self):
+        print('dummy read')
+        pass
+
+
+class SerialUSBProtocol(Protocol):
+    """ Class for outgoing connection to a USB serial device """
+    _comand_end_character = b''
+    _buffer = b''
+    _devname = None
+    _refresh = 1.0
+    _binary_length = None
+
+    def __init__(self, serial_num, obj, refresh=0, baudrate=115200, bytesize=8, parity='N', stopbits=2, timeout=400, debug=False):
+        # Name and type of the connection peer
+        self.name = ''
+        self.type = ''
+
+        self.serial_num = serial_num
+        self.object = obj
+        self.baudrate = baudrate
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self.timeout = timeout
+
+        self._debug = debug
+
+        if refresh > 0:
+            self._refresh = refresh
+
+        self._updateTimer = None
+
+        hotplug = HotplugService.forReactor(self.object['daemon']._reactor)
+        for device in hotplug.find(subsystem='tty', serial=self.serial_num):
+            if device.get('ID_SERIAL_SHORT') == self.serial_num:
+                self._devname = device['DEVNAME']
+                self.Connect()
+
+        self._hotplug = hotplug.register(self.ConnectionMCallBack, subsystem='tty', serial=self.serial_num)
+
+    def Connect(self):
+        self.object['hw'] = SerialPort(self, self._devname, self.object['daemon']._reactor,
+                                       baudrate=self.baudrate, bytesize=self.bytesize, parity=self.parity, stopbits=self.stopbits, timeout=self.timeout)
+
+    def ConnectionMCallBack(self, dd):
+        if not self._devname:
+            if dd.get('ID_SERIAL_SHORT') == self.serial_num and dd.action == 'add':
+                self._devname = dd['DEVNAME']
+                self.Connect()
+        elif dd.get('DEVNAME') == self._devname:
+            if dd.action == 'add':
+                self.Connect()
+
+    def connectionMade(self):
+        print('Connected to', self._devname, 'serial number', self.serial_num)
+        self._updateTimer = PollScheduler.forReactor(self.object['daemon']._reactor).add(self.update, self._refresh)
+
+    def connectionLost(self, reason):
+        print('Disconnected from', self._devname, 'serial number', self.serial_num, reason)
+        if self._updateTimer is not None:
+            self._updateTimer.stop()
+            self._updateTimer = None
+
+    def update(self):
+        pass
+
+    def dataReceived(self, data):
+        """Parse incoming data and split it into messages"""
+        # NOTE: user is responsible for not switching between binary ans string modes while in the process of receiving data
+        self._buffer = self._buffer + data
+        while len(self._buffer):
+            if len(self._buffer) >= self._binary_length:
+                bdata = self._buffer[:self._binary_length]
+                self._buffer = self._buffer[self._binary_length:]
+                self.processBinary(bdata)
+
+    def message(self, string):
+        """Sending outgoing message"""
+        if type(string) == str:
+            string = string.encode('ascii')+self._comand_end_character
+        else:
+            string = string+self._comand_end_character
+
+        if self._debug:
+            print(">>", self._devname, '>>', string)
+
+        self.transport.write(string)
@@ -2,12 +2,20 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import psycopg2, psycopg2.extras
 import datetime
+import os
+import time
+import pickle
+import threading
+
+from collections import deque, OrderedDict
 
 import numpy as np
 
+from metrics import Timing
+
 class DB:
     """Class encapsulating the connection to PostgreSQL database"""
-    def __init__(self, dbname='ccdlab', dbhost='', dbport=0, dbuser='', dbpassword='', readonly=False):
+    def __init__(self, dbname='ccdlab', dbhost='', dbport=0, dbuser='', dbpassword='', readonly=False, lazy=False):
         connstring = "dbname=" + dbname
         if dbhost:
             connstring += " host="+dbhost
@@ -18,7 +26,13 @@ class DB:
         if dbpassword:
             connstring += " password='%s'" % dbpassword
 
-        self.connect(connstring, readonly)
+        if lazy:
+            # Connect on first query instead, so that the database may be down at startup
+            self.conn = None
+            self.connstring = connstring
+            self.readonly = readonly
+        else:
+            self.connect(connstring, readonly)
 
     def connect(self, connstring, readonly=False):
         self.conn = psycopg2.connect(connstring)
@@ -32,7 +46,7 @@ class DB:
         self.readonly = readonly
 
     def query(self, string="", data=(), simplify=True, debug=False, array=False):
-        if self.conn.closed:
+        if self.conn is None or self.conn.closed:
             print("Re-connecting to DB")
             self.connect(self.connstring, self.readonly)
 
@@ -89,3 +103,257 @@ class DB:
             source = ''
 
         self.query('INSERT INTO log (time, source, type, message) VALUES (%s, %s, %s, %s);', (time, source, type, message))
+
+    def insert_rows(self, table, columns, rows):
+        """Insert several rows, given as tuples of column values, with a single statement"""
+        if self.conn is None or self.conn.closed:
+            print("Re-connecting to DB")
+            self.connect(self.connstring, self.readonly)
+
+        cur = self.conn.cursor()
+        psycopg2.extras.execute_values(cur, 'INSERT INTO %s (%s) VALUES %%s' % (table, ', '.join(columns)), rows, page_size=len(rows))
+
+    def close(self):
+        try:
+            self.conn.close()
+        except:
+            pass
+
+
+class DBWriter(object):
+    """
+    Asynchronous batched writer to the database. Rows are queued in memory and inserted by a separate
+    thread, several at once, so that the caller never waits for the database. Failed inserts are retried
+    with increasing delays, and the rows not fitting into the queue meanwhile are spilled to a disk file
+    of limited size, to be inserted once the database is back, even after the restart. The database
+    should be created with lazy=True, so that the thread connects to it on first insert, and re-connects on failures.
+    """
+
+    def __init__(self, db, spill=None, max_queue=10000, batch=500, max_spill=100*1024*1024, retry=1.0, max_retry=60.0):
+        self.db = db
+        self.spill = spill  # Spill file name, rows are dropped instead if not set
+        self.max_queue = max_queue
+        self.batch = batch
+        self.max_spill = max_spill
+        self.retry = retry
+        self.max_retry = max_retry
+
+        self._queue = deque()
+        self._overflow = deque()  # Rows not fitting into the queue, to be spilled by the thread
+        self._cond = threading.Condition()
+        self._running = True
+
+        # Rows before _spill_pos in the spill file are already inserted. The file is accessed from the thread only
+        self._spill_pos = 0
+        self._spill_size = os.path.getsize(spill) if spill and os.path.exists(spill) else 0
+
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latency = Timing()
+
+        self._thread = threading.Thread(target=self._run, name='DBWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def insert(self, table, columns, values):
+        """Queue the row for insertion into the table. Values should not be modified afterwards"""
+        row = (table, tuple(columns), tuple(values))
+
+        with self._cond:
+            if len(self._queue) < self.max_queue:
+                self._queue.append(row)
+            elif len(self._overflow) < self.max_queue:
+                # Spilling to disk is up to the thread, we should not wait for it
+                self._overflow.append(row)
+            else:
+                self.dropped += 1
+                return
+
+            self._cond.notify()
+
+    def log(self, message, time=None, source=None, type='info'):
+        """Queue the message for log table, same as DB.log()"""
+        if time is None:
+            time = datetime.datetime.utcnow()
+
+        if not source:
+            source = ''
+
+        self.insert('log', ('time', 'source', 'type', 'message'), (time, source, type, message))
+
+    def stop(self, timeout=5):
+        """Stop the thread after it inserts the queued rows, or spills them if the database is down"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+        self._thread.join(timeout)
+
+    def stats(self):
+        result = {'db_queue': len(self._queue) + len(self._overflow),
+                  'db_spill_bytes': self._spill_size - self._spill_pos,
+                  'db_written': self.written,
+                  'db_spilled': self.spilled,
+                  'db_dropped': self.dropped,
+                  'db_errors': self.errors}
+        result.update(self.latency.summary('db_insert'))
+
+        return result
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue and not self._overflow and self._spill_pos >= self._spill_size:
+                    self._cond.wait()
+
+                rows = [self._queue.popleft() for _ in range(min(self.batch, len(self._queue)))]
+                overflow = self._takeOverflow()
+                running = self._running
+
+            if overflow:
+                self._spill(overflow)
+
+            if not rows and running:
+                rows = self._unspill()
+
+            if not rows:
+                if running:
+                    continue
+
+                # Stopped, and everything queued is written
+                self._compact()
+                return
+
+            rows = self._write(rows)
+
+            if rows:
+                # Stopped while retrying, keep the rest for the next run
+                with self._cond:
+                    rows += list(self._queue) + self._takeOverflow()
+                    self._queue.clear()
+
+                self._spill(rows)
+                self._compact()
+                return
+
+            if self._spill_pos and self._spill_pos >= self._spill_size:
+                # All spilled rows are inserted
+                self._compact()
+
+    def _takeOverflow(self):
+        """Get the rows overflowing the queue, to be spilled. Should be called with the lock held"""
+        rows = list(self._overflow)
+        self._overflow.clear()
+
+        return rows
+
+    def _backoff(self, delay):
+        """Wait before the next attempt, spilling the rows overflowing the queue meanwhile. Returns True if stopped"""
+        deadline = time.monotonic() + delay
+
+        while True:
+            with self._cond:
+                remaining = deadline - time.monotonic()
+                if self._running and not self._overflow and remaining > 0:
+                    self._cond.wait(remaining)
+
+                overflow = self._takeOverflow()
+                running = self._running
+
+            if overflow:
+                self._spill(overflow)
+
+            if not running:
+                return True
+
+            if time.monotonic() >= deadline:
+                return False
+
+    def _write(self, rows):
+        """Insert the rows, grouped by tables, until success. Returns the rows left unwritten if stopped meanwhile"""
+        groups = OrderedDict()
+        for table, columns, values in rows:
+            groups.setdefault((table, columns), []).append(values)
+
+        delay = self.retry
+
+        while groups:
+            key = next(iter(groups))
+
+            try:
+                t0 = time.time()
+                self.db.insert_rows(key[0], key[1], groups[key])
+                self.latency.add(time.time() - t0)
+                self.written += len(groups.pop(key))
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # Connection problem, re-connect on next attempt
+                self.errors += 1
+                print("Error writing to DB, retrying in %g s: %s" % (delay, e))
+                self.db.close()
+
+                if self._backoff(delay):
+                    return [(key[0], key[1], values) for key, group in groups.items() for values in group]
+
+                delay = min(2*delay, self.max_retry)
+            except Exception as e:
+                # The rows themselves are bad, retrying would not help
+                self.errors += 1
+                print("Error writing to DB, dropping %d rows: %s" % (len(groups[key]), e))
+                self.dropped += len(groups.pop(key))
+
+        return []
+
+    def _spill(self, rows):
+        """Append the rows to the spill file, or drop them if it is full"""
+        if not self.spill or self._spill_size >= self.max_spill:
+            self.dropped += len(rows)
+            return
+
+        try:
+            with open(self.spill, 'ab') as f:
+                for row in rows:
+                    pickle.dump(row, f, 2)
+                self._spill_size = f.tell()
+            self.spilled += len(rows)
+        except Exception as e:
+            print("Error spilling DB rows to %s: %s" % (self.spill, e))
+            self.dropped += len(rows)
+
+    def _unspill(self):
+        """Read next batch of rows from the spill file"""
+        rows = []
+
+        try:
+            with open(self.spill, 'rb') as f:
+                f.seek(self._spill_pos)
+                while len(rows) < self.batch and f.tell() < self._spill_size:
+                    rows.append(pickle.load(f))
+                self._spill_pos = f.tell()
+        except Exception as e:
+            print("Error reading spilled DB rows from %s, dropping them: %s" % (self.spill, e))
+            self._spill_pos = self._spill_size
+
+        return rows
+
+    def _compact(self):
+        """Remove already inserted rows from the spill file"""
+        if not self._spill_pos:
+            return
+
+        try:
+            with open(self.spill, 'rb') as f:
+                f.seek(self._spill_pos)
+                data = f.read()
+
+            if data:
+                with open(self.spill, 'wb') as f:
+                    f.write(data)
+            else:
+                os.unlink(self.spill)
+        except Exception as e:
+            print("Error compacting DB spill file %s: %s" % (self.spill, e))
+            data = b''
+
+        self._spill_pos, self._spill_size = 0, len(data)
@@ -2,7 +2,7 @@
 
 import os, sys
 
-from daemon import SimpleFactory, SimpleProtocol
+from daemon import SimpleFactory, SimpleProtocol, commandHandler
 from command import Command
 
 ### Example code with server daemon and outgoing connection to hardware
@@ -11,24 +11,24 @@ class DaemonProtocol(SimpleProtocol):
     _debug = True # Display all traffic for debug purposes
 
     def processMessage(self, string):
-        # It will handle some generic messages and return pre-parsed Command object
+        # It will handle generic and registered commands, and return pre-parsed Command object for the rest
         cmd = SimpleProtocol.processMessage(self, string)
         if cmd is None:
             return
-        
-        obj = self.object # Object holding the state
-        hw = obj['hw'] # HW factory
-
-        if cmd.name == 'get_status':
-            self.message('status hw_connected=%s val1=%s val2=%s val3=%s' % (self.object['hw_connected'], self.object['val1'], self.object['val2'], self.object['val3']))
-        elif cmd.name == 'set':
-            for varname in ['val1', 'val2', 'val3', 'hw_connected']:
-                if cmd.has_key(varname):
-                    self.object[varname] = cmd.get(varname)
-        else:
-            if obj['hw_connected']:
-                # Pass all other commands directly to hardware
-                hw.messageAll(string, name='hw', type='hw')
+
+        if self.object['hw_connected']:
+            # Pass all other commands directly to hardware
+            self.object['hw'].messageAll(string, name='hw', type='hw')
+
+    @commandHandler('get_status')
+    def commandGetStatus(self, cmd):
+        self.message('status hw_connected=%s val1=%s val2=%s val3=%s' % (self.object['hw_connected'], self.object['val1'], self.object['val2'], self.object['val3']))
+
+    @commandHandler('set')
+    def commandSet(self, cmd):
+        for varname in ['val1', 'val2', 'val3', 'hw_connected']:
+            if varname in cmd:
+                self.object[varname] = cmd.get(varname)
 
 class HWProtocol(SimpleProtocol):
     _debug = True # Display all traffic for debug purposes
@@ -45,7 +45,7 @@ class HWProtocol(SimpleProtocol):
 
     def processMessage(self, string):
         # Process the device reply
-        print "hw > %s" % string
+        print("hw > %s" % string)
 
     def update(self):
         # Request the hardware state from the device
@@ -0,0 +1,105 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import re
+
+
+class LineFramer(object):
+    """
+    Incremental splitter of the incoming byte stream into messages.
+
+    Data is accumulated in a single bytearray, and messages are returned as
+    memoryview slices into it, so that no copies are made while splitting.
+    The consumed part of the buffer is dropped lazily, only when it becomes
+    larger than the unconsumed one. The views are only valid until the next
+    call to feed(), so the consumer should copy or decode them before that.
+
+    Text messages are terminated by any of the delimiter bytes. Binary
+    messages of a given length may be requested with switchToBinary(), which
+    may be called from within the loop over frames() to affect the next frame.
+    """
+
+    def __init__(self, delimiters=b'\0\n'):
+        self._buffer = bytearray()
+        self._start = 0  # Start of the unconsumed data
+        self._scan = 0  # Position up to which the unconsumed data has no delimiters
+        self._delimiters = bytes(delimiters)
+        self._regex = re.compile(b'[' + re.escape(self._delimiters) + b']')
+
+        self.is_binary = False
+        self.binary_length = 0
+
+    def __len__(self):
+        """Number of pending (unconsumed) bytes"""
+        return len(self._buffer) - self._start
+
+    def feed(self, data):
+        """Append new chunk of data to the buffer"""
+        if self._start and self._start >= len(self._buffer) - self._start:
+            # Compact the buffer, dropping already consumed part
+            del self._buffer[:self._start]
+            self._scan -= self._start
+            self._start = 0
+
+        self._buffer += data
+
+    def switchToBinary(self, length=0):
+        """Make the next message a binary one, consisting of exactly _length_ bytes"""
+        self.is_binary = True
+        self.binary_length = length
+
+    def reset(self):
+        """Drop all the pending data"""
+        self._buffer = bytearray()
+        self._start = 0
+        self._scan = 0
+        self.is_binary = False
+        self.binary_length = 0
+
+    def _find(self):
+        """Return the position of next delimiter in unconsumed data, or -1"""
+        if len(self._delimiters) == 1:
+            return self._buffer.find(self._delimiters, self._scan)
+
+        m = self._regex.search(self._buffer, self._scan)
+
+        return m.start() if m else -1
+
+    def next(self):
+        """
+        Extract next complete message from the buffer.
+        Returns (is_binary, memoryview) tuple, or None if more data is needed
+        """
+        if self.is_binary:
+            end = self._start + self.binary_length
+            if end > len(self._buffer):
+                return None
+
+            view = memoryview(self._buffer)[self._start:end]
+            self._start = self._scan = end
+            self.is_binary = False
+
+            return True, view
+        else:
+            pos = self._find()
+            if pos < 0:
+                # No need to re-scan this part again when more data arrive
+                self._scan = len(self._buffer)
+                return None
+
+            view = memoryview(self._buffer)[self._start:pos]
+            self._start = self._scan = pos + 1
+
+            return False, view
+
+    def frames(self):
+        """Iterate over all complete messages currently in the buffer"""
+        while True:
+            frame = self.next()
+            if frame is None:
+                break
+
+            try:
+                yield frame
+            finally:
+                # Release the view so that the buffer may be resized later
+                frame[1].release()
@@ -11,6 +11,9 @@ from command import Command
 class DaemonProtocol(SimpleProtocol):
     _debug = False  # Display all traffic for debug purposes
 
+    # GPIB address of the connection, indexed in the factory for fast reply routing
+    addr = property(lambda self: self.__dict__.get('_addr'), lambda self, value: self._setIndexed('addr', value))
+
     @catch
     def __init__(self):
         SimpleProtocol.__init__(self)
@@ -60,6 +63,7 @@ class GPIBProtocol(SimpleProtocol):
     _debug = False  # Display all traffic for debug purposes
     _tcp_keepidle = 10  # Faster detection of peer disconnection
     _refresh = 0.01
+    # No output coalescing here: Prologix needs a pause after '++addr' before the device command
 
     def __init__(self):
         SimpleProtocol.__init__(self)
@@ -97,11 +101,10 @@ class GPIBProtocol(SimpleProtocol):
         if len(self.commands) and self.commands[0] in ['++addr']:
             # We are silently ignoring the results from these commands
             self.commands.pop(0)  # Remove the command from queue
-        else:
-            for conn in daemon.connections:
-                if conn.addr == self.object['current_addr'] and self.object['current_addr'] >= 0:
-                    # Send the device reply to the client connection with given address
-                    conn.message(string)
+        elif self.object['current_addr'] >= 0:
+            for conn in daemon.findConnections(addr=self.object['current_addr']):
+                # Send the device reply to the client connection with given address
+                conn.message(string)
         self.readBusy = [False,time.time()]
 
     @catch
@@ -131,7 +134,7 @@ class GPIBProtocol(SimpleProtocol):
         If a new GPIB device connected, add it, disconnected devices should stay in the dict
         """
         self.gpibAddrList = [
-            _.addr for _ in self.object['daemon'].connections if _.addr > 0]
+            _ for _ in self.object['daemon'].indexValues('addr') if _ is not None and _ > 0]
         for addr in self.gpibAddrList:
             if addr not in self.daemonQs.keys():
                 self.daemonQs[addr] = []
@@ -0,0 +1,107 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# History of the status values for monitor plots, kept in plot-ready typed arrays.
+# Every array has twice the depth, and every sample is written to both halves, so that
+# the last depth samples are always contiguous and may be returned as a view without copying.
+
+import datetime
+import numpy as np
+
+_epoch = datetime.datetime(1970, 1, 1)
+
+
+def toTimestamp(time):
+    """Microseconds since Unix epoch for naive UTC datetime"""
+    delta = time - _epoch
+
+    return (delta.days*86400 + delta.seconds)*1000000 + delta.microseconds
+
+
+def toFloat(value):
+    """Numerical form of the status value, NaN if it has none"""
+    if value is None:
+        return np.nan
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class History(object):
+    """Fixed-depth ring buffer of float64 samples of several named values with common int64 timestamps"""
+
+    def __init__(self, names, depth=1000):
+        self.names = list(names)
+        self.depth = depth
+
+        self.time = np.zeros(2*depth, dtype=np.int64)  # Microseconds since Unix epoch
+        self.data = np.full((len(self.names), 2*depth), np.nan)  # One row per value
+        self._rows = {name: i for i, name in enumerate(self.names)}
+
+        self.count = 0  # Total number of samples ever added, also the sequence number of the next one
+        self.start = 0  # Sequence number of the first sample kept since the last clear()
+        self.version = 0  # Changes on every modification
+
+    def __len__(self):
+        return min(self.count - self.start, self.depth)
+
+    def first(self):
+        """Sequence number of the oldest sample kept"""
+        return self.count - len(self)
+
+    def append(self, time, values):
+        """Add the sample with given datetime and dict of values, missing or non-numerical ones become NaN"""
+        pos = self.count % self.depth
+
+        self.time[pos] = self.time[pos + self.depth] = toTimestamp(time)
+        self.data[:, pos] = self.data[:, pos + self.depth] = [toFloat(values.get(name)) for name in self.names]
+
+        self.count += 1
+        self.version += 1
+
+    def _window(self, since=None):
+        end = self.count % self.depth + self.depth if self.count >= self.depth else self.count
+        length = len(self)
+
+        if since is not None:
+            # Only the samples with sequence numbers since the given one, if still kept
+            length -= max(0, min(length, since - self.first()))
+
+        return slice(end - length, end)
+
+    def view(self, name, since=None):
+        """Samples of the value, oldest first, as a read-only view into the buffer"""
+        array = self.time if name == 'time' else self.data[self._rows[name]]
+        result = array[self._window(since)]
+        result.flags.writeable = False
+
+        return result
+
+    def times(self, since=None):
+        """Timestamps of the samples as datetime64 view, directly usable for plotting"""
+        return self.view('time', since).view('datetime64[us]')
+
+    def columns(self, since=None):
+        """
+        Samples added since the given sequence number as a dict of plain lists, ready for JSON.
+        Timestamps are in milliseconds, missing values are None. If the samples right after
+        the given one are no longer kept, or were cleared, all the kept ones are returned with reset flag
+        """
+        reset = since is None or since <= self.start or since < self.first() or since > self.count
+        if reset:
+            since = None
+
+        values = {}
+        for name in self.names:
+            y = self.view(name, since)
+            values[name] = [None if _ != _ else _ for _ in y.tolist()]
+
+        return {'seq': self.count, 'reset': reset, 'depth': self.depth,
+                'time': (self.view('time', since)//1000).tolist(),
+                'values': values}
+
+    def clear(self):
+        """Drop all the samples. Sequence numbers continue, so that incremental readers notice it"""
+        self.start = self.count
+        self.version += 1
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Runs several device daemons inside a single process and reactor.
+# Every section of the config file describes one daemon:
+#
+#   [mx100qp]
+#   module = mx100qp.py
+#   options = -p 7034 -H 192.168.1.14
+#
+# The module should provide getOptionParser() and buildDaemon(options, reactor) functions.
+# It is loaded separately for every section, so that the daemons do not share any class
+# or module level state, and each of them has its own listen port and obj state.
+# 'exit' command sent to one of the daemons stops just it, along with its hardware connections.
+
+import os
+import sys
+import shlex
+import posixpath
+import importlib.util
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import reactors
+reactors.install()
+
+from twisted.internet import reactor
+
+_root = os.path.dirname(os.path.abspath(__file__))
+
+
+def loadModule(filename, name):
+    """Load the daemon script as a separate module with a given unique name"""
+    path = filename if os.path.isabs(filename) else os.path.join(_root, filename)
+
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except:
+        sys.modules.pop(name, None)
+        raise
+
+    return module
+
+
+def loadINI(filename):
+    """List of enabled daemon sections from the config file"""
+    # We use ConfigObj library, same as monitor.py
+    from configobj import ConfigObj, Section
+    from validate import Validator
+
+    schema = ConfigObj(StringIO('''
+    [__many__]
+    enabled = boolean(default=True)
+    module = string
+    options = string(default='')
+    '''), list_values=False)
+
+    conf = ConfigObj(filename, configspec=schema)
+    result = conf.validate(Validator())
+    if result != True:
+        print("Config file failed validation: %s" % filename)
+        print(result)
+
+        raise RuntimeError
+
+    devices = []
+    for sname in conf:
+        section = conf[sname]
+
+        if type(section) != Section or not section['enabled']:
+            continue
+
+        device = section.dict()
+        device['name'] = sname
+        devices.append(device)
+
+    return devices
+
+
+def startDevice(device, reactor=reactor):
+    """Load the device module and start its daemon in the shared reactor, returning the daemon factory"""
+    module = loadModule(device['module'], 'host_' + device['name'].replace('-', '_'))
+
+    (options, args) = module.getOptionParser().parse_args(shlex.split(device['options']))
+
+    daemon = module.buildDaemon(options, reactor=reactor)
+
+    # 'exit' command should stop this daemon only, not the whole process
+    daemon.hosted = True
+
+    # Keep the metrics of different daemons apart
+    daemon.metrics_prefix = device['name'] + '/'
+    hw = daemon.object.get('hw') if isinstance(daemon.object, dict) else None
+    if hasattr(hw, 'metrics_prefix'):
+        hw.metrics_prefix = device['name'] + '/'
+
+    return daemon
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="usage: %prog [options] [name ...]")
+    parser.add_option('-c', '--config', help='Config file', action='store', dest='config', default='%s.ini' % posixpath.splitext(__file__)[0])
+
+    (options, args) = parser.parse_args()
+
+    devices = loadINI(options.config)
+    if args:
+        # Only the daemons named on command line
+        devices = [_ for _ in devices if _['name'] in args]
+
+    daemons = {}
+    for device in devices:
+        # Failure of one daemon should not prevent the others from running
+        try:
+            daemons[device['name']] = startDevice(device)
+            print("Started %s from %s" % (device['name'], device['module']))
+        except:
+            import traceback
+            traceback.print_exc()
+            print("Failed to start %s from %s" % (device['name'], device['module']))
+
+    if not daemons:
+        print("No daemons to run")
+        sys.exit(1)
+
+    reactor.run()
@@ -0,0 +1,177 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from pyudev import Context, Monitor, MonitorObserver
+
+
+class HotplugListener(object):
+    """Single callback registered in HotplugService"""
+
+    def __init__(self, service, callback, subsystem=None, serial=None, devlink=None):
+        self.service = service
+        self.callback = callback
+        self.subsystem = subsystem
+        self.serial = serial
+        self.devlink = devlink
+
+    def matches(self, subsystem, serial, devlinks):
+        if self.subsystem is not None and subsystem != self.subsystem:
+            return False
+        if self.serial is not None and serial != self.serial:
+            return False
+        if self.devlink is not None and self.devlink not in devlinks:
+            return False
+
+        return True
+
+    def stop(self):
+        self.service.unregister(self)
+
+
+class HotplugService(object):
+    """
+    Process-wide tracker of USB and tty devices. Devices are enumerated once, and a single
+    udev monitor thread is used for all the protocols in the process. The devices are indexed
+    by their serial number (ID_SERIAL_SHORT of the device or its nearest USB parent) and by
+    DEVLINKS, and add / remove events are delivered to the registered callbacks in the reactor
+    thread, with device.action set accordingly.
+    """
+
+    _instances = {}
+
+    _subsystems = ('usb', 'tty')
+
+    @classmethod
+    def forReactor(cls, reactor=None):
+        """Get the service shared by everybody using the given reactor"""
+        if reactor is None:
+            from twisted.internet import reactor
+
+        if reactor not in cls._instances:
+            cls._instances[reactor] = cls(reactor)
+
+        return cls._instances[reactor]
+
+    def __init__(self, reactor):
+        self._reactor = reactor
+        self._context = Context()
+
+        self._devices = {}  # DEVPATH -> (device, subsystem, serial, devlinks)
+        self._by_serial = {}  # serial -> {DEVPATH: True}
+        self._by_devlink = {}  # devlink -> DEVPATH
+        self._listeners = []
+
+        for subsystem in self._subsystems:
+            for device in self._context.list_devices(subsystem=subsystem):
+                self._add(device)
+
+        monitor = Monitor.from_netlink(self._context)
+        for subsystem in self._subsystems:
+            monitor.filter_by(subsystem=subsystem)
+
+        self._observer = MonitorObserver(monitor, callback=self._event, name='hotplug-observer')
+        self._observer.daemon = True
+        self._observer.start()
+
+    def _serial(self, device):
+        """Serial number of the device itself or of its nearest parent having one"""
+        while device is not None:
+            serial = device.get('ID_SERIAL_SHORT')
+            if serial:
+                return serial
+            device = device.parent
+
+        return None
+
+    def _add(self, device):
+        devpath = device.get('DEVPATH')
+        serial = self._serial(device)
+        devlinks = device.get('DEVLINKS', '').split()
+
+        self._remove(devpath)
+
+        self._devices[devpath] = (device, device.subsystem, serial, devlinks)
+        if serial:
+            self._by_serial.setdefault(serial, {})[devpath] = True
+        for link in devlinks:
+            self._by_devlink[link] = devpath
+
+        return self._devices[devpath]
+
+    def _remove(self, devpath):
+        if devpath not in self._devices:
+            return None
+
+        entry = self._devices.pop(devpath)
+        device, subsystem, serial, devlinks = entry
+
+        if serial in self._by_serial:
+            self._by_serial[serial].pop(devpath, None)
+            if not self._by_serial[serial]:
+                self._by_serial.pop(serial)
+        for link in devlinks:
+            if self._by_devlink.get(link) == devpath:
+                self._by_devlink.pop(link)
+
+        return entry
+
+    def _event(self, device):
+        # Called in the observer thread, everything else happens in the reactor one
+        self._reactor.callFromThread(self._dispatch, device)
+
+    def _dispatch(self, device):
+        if device.action == 'remove':
+            # Removed device may already miss some properties, so use the indexed ones if possible
+            entry = self._remove(device.get('DEVPATH'))
+            if entry is None:
+                entry = (device, device.subsystem, device.get('ID_SERIAL_SHORT'), device.get('DEVLINKS', '').split())
+        else:
+            try:
+                entry = self._add(device)
+            except:
+                import traceback
+                traceback.print_exc()
+                return
+
+        _, subsystem, serial, devlinks = entry
+
+        for listener in list(self._listeners):
+            if listener.matches(subsystem, serial, devlinks):
+                try:
+                    listener.callback(device)
+                except:
+                    import traceback
+                    traceback.print_exc()
+
+    def find(self, subsystem=None, serial=None, devlink=None):
+        """List of currently present devices matching the criteria"""
+        if serial is not None:
+            paths = list(self._by_serial.get(serial, {}).keys())
+        elif devlink is not None:
+            paths = [self._by_devlink[devlink]] if devlink in self._by_devlink else []
+        else:
+            paths = list(self._devices.keys())
+
+        result = []
+        for path in paths:
+            device, dsubsystem, dserial, devlinks = self._devices[path]
+            if subsystem is not None and dsubsystem != subsystem:
+                continue
+            if devlink is not None and devlink not in devlinks:
+                continue
+            result.append(device)
+
+        return result
+
+    def register(self, callback, subsystem=None, serial=None, devlink=None):
+        """
+        Call _callback_(device) in the reactor thread for every add / remove event of the devices
+        matching the criteria. Returns HotplugListener object which may be used to stop the calls.
+        """
+        listener = HotplugListener(self, callback, subsystem=subsystem, serial=serial, devlink=devlink)
+        self._listeners.append(listener)
+
+        return listener
+
+    def unregister(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
@@ -153,7 +153,7 @@ class DaemonProtocol(SimpleProtocol):
                 break
 
             if string[-1] == '?':
-                print 'unrecog query cmd', string
+                print('unrecog query cmd', string)
                 hw.messageAll(string, type='hw', keep=True, source=self.name)
             else:
                 hw.messageAll(string, type='hw', keep=False, source=self.name)
@@ -169,6 +169,7 @@ class DaemonProtocol(SimpleProtocol):
 class KeithleyProtocol(SimpleProtocol):
     _debug = False  # Display all traffic for debug purposes
     _refresh = 0.1
+    _coalesce = True  # Send command bursts to GPIB multiplexor in a single write
 
     def __init__(self):
         SimpleProtocol.__init__(self)
@@ -206,8 +207,8 @@ class KeithleyProtocol(SimpleProtocol):
         daemon = obj['daemon']
 
         if self._debug:
-            print 'KEITHLEY6485 >> %s' % string
-            print 'commands Q:', self.commands
+            print('KEITHLEY6485 >> %s' % string)
+            print('commands Q:', self.commands)
         # Update the last reply timestamp
         obj['hw_last_reply_time'] = datetime.datetime.utcnow()
         obj['hw_connected'] = 1
@@ -303,7 +304,8 @@ class KeithleyProtocol(SimpleProtocol):
             self.lastAutoRead = datetime.datetime.utcnow()
 
 
-if __name__ == '__main__':
+def getOptionParser():
+    """Command-line options of the daemon, also used by host.py"""
     from optparse import OptionParser
 
     parser = OptionParser(usage="usage: %prog [options] arg")
@@ -314,8 +316,11 @@ if __name__ == '__main__':
     parser.add_option('-n', '--name', help='Daemon name', action='store', dest='name', default='keithley6485')
     parser.add_option("-D", '--debug', help='Debug mode', action="store_true", dest="debug")
 
-    (options, args) = parser.parse_args()
+    return parser
+
 
+def buildDaemon(options, reactor=None):
+    """Create and start the daemon and hardware factories, and return the daemon one"""
     # Object holding actual state and work logic.
     # May be anything that will be passed by reference - list, dict, object etc
     obj = {
@@ -333,8 +338,8 @@ if __name__ == '__main__':
 
     # Factories for daemon and hardware connections
     # We need two different factories as the protocols are different
-    daemon = SimpleFactory(DaemonProtocol, obj)
-    hw = SimpleFactory(KeithleyProtocol, obj)
+    daemon = SimpleFactory(DaemonProtocol, obj, reactor=reactor)
+    hw = SimpleFactory(KeithleyProtocol, obj, reactor=reactor)
 
     if options.debug:
         daemon._protocol._debug = True
@@ -352,4 +357,12 @@ if __name__ == '__main__':
     # Outgoing connection
     hw.connect(options.hw_host, options.hw_port)
 
+    return daemon
+
+
+if __name__ == '__main__':
+    (options, args) = getOptionParser().parse_args()
+
+    daemon = buildDaemon(options)
+
     daemon._reactor.run()
@@ -0,0 +1,144 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+
+
+class Timing(object):
+    """Count, total and maximal value of durations, with a histogram in power-of-two microsecond bins"""
+
+    _nbins = 32
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.bins = [0]*self._nbins  # bin i holds durations below 2**i microseconds
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.bins[min(int(duration*1e6).bit_length(), self._nbins - 1)] += 1
+
+    def quantile(self, q):
+        """Upper bound of the given quantile, in seconds"""
+        if not self.count:
+            return 0
+
+        target = q*self.count
+        accumulated = 0
+        for i, n in enumerate(self.bins):
+            accumulated += n
+            if accumulated >= target:
+                return min(2**i*1e-6, self.max)
+
+        return self.max
+
+    def summary(self, prefix):
+        """Flat dict of the statistics, with keys starting with prefix"""
+        return {prefix + '_count': self.count,
+                prefix + '_mean': self.total/self.count if self.count else 0,
+                prefix + '_p99': self.quantile(0.99),
+                prefix + '_max': self.max}
+
+    def reset(self):
+        self.__init__()
+
+
+class FunctionStats(Timing):
+    """Timing of a single function wrapped with daemon.catch, along with the number of exceptions caught"""
+
+    def __init__(self):
+        Timing.__init__(self)
+        self.errors = 0
+
+
+# Statistics of all instrumented functions in the process, by their qualified names
+functions = {}
+
+
+def functionStats(func):
+    """Get FunctionStats object for a given function, creating it if necessary"""
+    name = getattr(func, '__module__', '?') + '.' + getattr(func, '__qualname__', getattr(func, '__name__', '?'))
+
+    if name not in functions:
+        functions[name] = FunctionStats()
+
+    return functions[name]
+
+
+class Metrics(object):
+    """
+    Registry of runtime metrics, shared by all factories using the same reactor.
+    Hot paths keep plain counters and Timing objects, and everything else is collected
+    by the registered sources only when the snapshot is requested.
+    """
+
+    _instances = {}
+
+    @classmethod
+    def forReactor(cls, reactor=None):
+        """Get the registry shared by everybody using the given reactor"""
+        if reactor is None:
+            from twisted.internet import reactor
+
+        if reactor not in cls._instances:
+            cls._instances[reactor] = cls()
+
+        return cls._instances[reactor]
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = {}
+        self.timings = {}
+        self._gauges = {}
+        self._sources = []
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def timing(self, name):
+        """Get the Timing object with a given name, creating it if necessary"""
+        if name not in self.timings:
+            self.timings[name] = Timing()
+
+        return self.timings[name]
+
+    def gauge(self, name, func):
+        """Register the function returning the current value of some quantity"""
+        self._gauges[name] = func
+
+    def addSource(self, func):
+        """Register the function returning the dict of metrics to be merged into snapshot"""
+        if func not in self._sources:
+            self._sources.append(func)
+
+    def removeSource(self, func):
+        if func in self._sources:
+            self._sources.remove(func)
+
+    def snapshot(self):
+        """Flat dict with current values of all metrics"""
+        result = {'uptime': time.time() - self.started}
+
+        result.update(self.counters)
+
+        for name, timing in self.timings.items():
+            result.update(timing.summary(name))
+
+        for name, func in self._gauges.items():
+            try:
+                result[name] = func()
+            except:
+                import traceback
+                traceback.print_exc()
+
+        for func in self._sources:
+            try:
+                result.update(func())
+            except:
+                import traceback
+                traceback.print_exc()
+
+        return result
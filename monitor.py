@@ -2,9 +2,15 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import reactors
+reactors.install()
+
 from twisted.internet import stdio
+from twisted.internet.defer import Deferred, succeed
+from twisted.python.failure import Failure
 from twisted.protocols.basic import LineReceiver
-from twisted.web.server import Site
+from twisted.web.server import Site, NOT_DONE_YET
+from twisted.web import http
 from twisted.web.resource import Resource
 from twisted.web.static import File
 from twisted.internet.endpoints import TCP4ServerEndpoint
@@ -34,32 +40,72 @@ except:
     from io import BytesIO, StringIO
 
 import json
+import hashlib
 import numpy as np
 
 from collections import OrderedDict
 
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.figure import Figure
-from matplotlib.dates import DateFormatter
-from matplotlib.ticker import ScalarFormatter, LogLocator, LinearLocator, MaxNLocator, NullLocator
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from daemon import SimpleFactory, SimpleProtocol
+from daemon import SimpleFactory, SimpleProtocol, CommandDispatcher, commandHandler
 from command import Command
 from daemon import catch
-from db import DB
+from db import DB, DBWriter
+from history import History
+import plotting
+import profiler
+import wire
 
 
 def kwargsToString(kwargs, prefix=''):
-    return " ".join([prefix + _ + '=' + kwargs[_] for _ in kwargs])
+    return " ".join([prefix + _ + '=' + wire.formatValue(kwargs[_]) for _ in kwargs])
+
+
+def summarizeMetrics(metrics):
+    """Per-daemon totals over all its connections, to quickly spot the busiest or lagging ones"""
+    summary = {'messages_in_rate': 0, 'messages_out_rate': 0, 'bytes_in_rate': 0, 'bytes_out_rate': 0,
+               'process_max': 0, 'commands': 0, 'dropped_messages': 0, 'update_overruns': 0,
+               'scheduler_max_lateness': metrics.get('scheduler_max_lateness', 0)}
+
+    for key, value in metrics.items():
+        if '.' not in key or not isinstance(value, (int, float)):
+            continue
+
+        name = key.rsplit('.', 1)[1]
+        if name == 'process_max':
+            summary[name] = max(summary[name], value)
+        elif name in summary:
+            summary[name] += value
+
+    return summary
 
 
 class MonitorProtocol(SimpleProtocol):
     _debug = False
+    _output_policy = 'coalesce'  # Slow peers get only the latest status
+
+    _metrics_refresh = 10.0  # Interval between get_metrics requests to the peer
+    _metrics_rate_keys = ('bytes_in', 'bytes_out', 'messages_in', 'messages_out', 'dropped_messages')
+
+    _status_full_interval = 60.0  # Interval between full status requests to the peers supporting delta-encoded or pushed ones
+
+    # Status push settings for the peers supporting it. Deadbands are set per client in the config file
+    _status_min_interval = 0.1
+    _status_heartbeat = 10.0
 
     def __init__(self):
         SimpleProtocol.__init__(self)
         self.name = None
         self.status = {}
+        self.status_version = 0  # Last status version received from the peer, for delta-encoded status
+        self._peer_status_delta = False  # Whether the peer supports delta-encoded status
+        self._peer_status_push = False  # Whether we are subscribed to the peer status
+        self._status_full_time = 0
+        self.metrics = {}
+        self._metrics_prev = None
+        self._metricsTimer = None
 
     @catch
     def connectionMade(self):
@@ -68,87 +114,170 @@ class MonitorProtocol(SimpleProtocol):
         self.message('id name=monitor')  # Send our identity to the peer
         self.message('get_id')  # Request peer identity
 
+        self._metricsTimer = self.factory.scheduler.add(self.requestMetrics, self._metrics_refresh)
+
     @catch
     def connectionLost(self, reason):
         if self.name in self.object['clients']:
             self.log("%s disconnected" % self.name, type='info')
             # print "Disconnected:", self.name
 
+        if self._metricsTimer is not None:
+            self._metricsTimer.stop()
+            self._metricsTimer = None
+
         SimpleProtocol.connectionLost(self, reason)
 
     @catch
     def processMessage(self, string):
-        if self._debug:
-            print("%s:%d > %s" % (self._peer.host, self._peer.port, string))
+        cmd = SimpleProtocol.processMessage(self, string)
+        if cmd is None:
+            return
 
-        cmd = Command(string)
+        # Everything else is handled the same way as from console or web interface, except for console-only commands
+        self.factory.commands.dispatch(cmd, self.message, source=self.name, trusted=False)
 
-        if cmd.name == 'id':
-            self.name = cmd.get('name', None)
-            self.type = cmd.get('type', None)
+    @commandHandler('id')
+    def commandId(self, cmd):
+        self.name = cmd.get('name', None)
+        self.type = cmd.get('type', None)
 
-            if self.name in self.object['clients']:
-                self.log("%s connected" % self.name, type='info')
-                # print "Connected:", self.name
+        if self.name in self.object['clients']:
+            self.log("%s connected" % self.name, type='info')
+            # print "Connected:", self.name
+
+        # Ask the peer to send typed messages in the best format we both support
+        fmt = wire.negotiate(cmd.get('wire', 'text'))
+        if fmt != 'text':
+            self.message('set_wire format=%s' % fmt)
+
+        features = cmd.get('status', '').split(',')
+        self._peer_status_delta = 'delta' in features
+        self._peer_status_push = 'push' in features
+
+        if self._peer_status_push:
+            # The peer will send us its status when it changes, so no need to poll it
+            client = self.object['clients'].get(self.name, {})
+            string = 'subscribe_status min_interval=%g heartbeat=%g deadband=%g' % (self._status_min_interval, self._status_heartbeat,
+                                                                                    client.get('deadband', 0))
+            for key, value in (client.get('deadbands') or {}).items():
+                string += ' deadband.%s=%g' % (key, value)
+            self.message(string)
+
+    @commandHandler('exit')
+    def commandExit(self, cmd):
+        # Network peers may not stop the monitor, only the console and web interface
+        pass
 
-        elif cmd.name == 'status':
-            # We keep var=value pairs from the status to report it to clients
-            self.status = cmd.kwargs
-
-            # We have to keep the history of values for some variables for plots
-            if self.name in self.object['values']:
-                for name in self.object['values'][self.name]:
-                    if name == 'time':
-                        value = datetime.datetime.utcnow()
-                    else:
-                        value = self.status.get(name, None)
-                        # Now we should try to convert the value to numerical form, if possible
-                        try:
-                            value = float(value)
-                        except:
-                            pass
-
-                    self.object['values'][self.name][name].append(value)
-                    # Keep the maximal length of data arrays limited
-                    # TODO: make it configurable, probably for every plot
-                    if len(self.object['values'][self.name][name]) > 1000:
-                        self.object['values'][self.name][name] = self.object['values'][self.name][name][100:]
-
-            # Broadcast new values to all CCDs, if the client itself is not CCD
-            if self.type != 'ccd':
-                self.factory.messageAll("set_keywords " + " ".join([self.name+'.'+_+'=\"' +
-                                                                    self.status[_]+'\"' for _ in self.status.keys()]), type="ccd")
-
-            # Store the values to database, if necessary
-            if 'db' in self.object and self.object['db'] is not None:
-                if (datetime.datetime.utcnow() - self.object['db_status_timestamp']).total_seconds() > self.object['db_status_interval']:
-                    # FIXME: should we also store the status if no peer is reporting at all?
-                    # print "Storing the state to DB"
-
-                    time = datetime.datetime.utcnow()
-                    status = self.factory.getStatus(as_dict=True)
-                    self.object['db'].query('INSERT INTO monitor_status (time, status) VALUES (%s,%s)', (time, status))
-
-                    self.object['db_status_timestamp'] = datetime.datetime.utcnow()
-                    pass
-
-        elif cmd.name == 'get_status':
-            if cmd.kwargs.get('format', 'plain') == 'json':
-                self.message('status_json ' + json.dumps(self.factory.getStatus(as_dict=True)))
+    @commandHandler('profile')
+    def commandProfile(self, cmd):
+        # Same for profiling, so do not use the SimpleProtocol handler here
+        self.factory.commands.dispatch(cmd, self.message, source=self.name, trusted=False)
+
+    @commandHandler('status')
+    def commandStatus(self, cmd):
+        self.processStatus(cmd.kwargs)
+
+    @commandHandler('metrics')
+    def commandMetrics(self, cmd):
+        # Peer reply to our get_metrics
+        self.processMetrics(cmd.kwargs)
+
+    def processObject(self, name, kwargs):
+        if name == 'status':
+            # Typed status values, no need to convert them from strings
+            self.processStatus(kwargs)
+        elif name == 'metrics':
+            self.processMetrics(kwargs)
+        else:
+            SimpleProtocol.processObject(self, name, kwargs)
+
+    @catch
+    def processStatus(self, status):
+        if '_version' in status:
+            # Delta-encoded status, either full or containing the changed values only
+            version = int(status.pop('_version'))
+            full = int(status.pop('_full', 1))
+
+            if full:
+                self.status = status
+            elif version < self.status_version:
+                # Stale delta, arrived after the newer one, so we are out of sync - ask for the full snapshot
+                self.message('get_status delta=0')
+                return
             else:
-                self.message(self.factory.getStatus())
+                self.status.update(status)
 
-        elif cmd.name == 'send' and cmd.chunks[1]:
-            c = self.factory.findConnection(name=cmd.chunks[1])
-            if c:
-                c.message(" ".join(cmd.chunks[2:]))
+            self.status_version = version
+            changed = status
+        else:
+            # We keep var=value pairs from the status to report it to clients
+            self.status = status
+            changed = status
 
-        elif cmd.name in ['debug', 'info', 'message', 'error', 'warning', 'success']:
-            msg = " ".join(cmd.chunks[1:])
-            self.log(msg, source=self.name, type=cmd.name)
+        # Pushed status is sampled for plots in update(), with fixed cadence, instead of on every push or heartbeat
+        if not self._peer_status_push:
+            self.appendHistory()
 
-        elif cmd.name == 'reset_plots':
-            self.factory.reset_plots()
+        # Broadcast new values to all CCDs, if the client itself is not CCD
+        if self.type != 'ccd' and changed:
+            self.factory.messageAll("set_keywords " + " ".join([self.name+'.'+_+'=\"' +
+                                                                wire.valueToString(changed[_])+'\"' for _ in changed.keys()]), type="ccd")
+
+        # Store the values to database, if necessary
+        if 'db' in self.object and self.object['db'] is not None:
+            if (datetime.datetime.utcnow() - self.object['db_status_timestamp']).total_seconds() > self.object['db_status_interval']:
+                # FIXME: should we also store the status if no peer is reporting at all?
+                # print "Storing the state to DB"
+
+                time = datetime.datetime.utcnow()
+                # Copy of the client statuses, as they will be written later
+                status = {key: dict(value) if isinstance(value, dict) else value
+                          for key, value in self.factory.getStatus(as_dict=True).items()}
+                self.object['db'].insert('monitor_status', ('time', 'status'), (time, status))
+                self.factory.metrics.inc('db_status_writes')
+
+                self.object['db_status_timestamp'] = datetime.datetime.utcnow()
+
+    @catch
+    def processMetrics(self, metrics):
+        now = self.factory._reactor.seconds()
+
+        values = {}
+        for key, value in metrics.items():
+            try:
+                value = float(value)
+            except:
+                pass
+            values[key] = value
+
+        # Rates of the traffic counters since the previous request
+        rates = {}
+        if self._metrics_prev is not None:
+            prev_time, prev = self._metrics_prev
+            dt = now - prev_time
+
+            for key, value in values.items():
+                if dt > 0 and key in prev and isinstance(value, float) and key.endswith(self._metrics_rate_keys):
+                    delta = value - prev[key]
+                    if delta < 0:
+                        # Counter was reset by reconnection
+                        delta = value
+                    rates[key + '_rate'] = delta/dt
+
+        self._metrics_prev = (now, values)
+        self.metrics = dict(values, **rates)
+
+    def appendHistory(self):
+        """Keep the history of current values for some variables for plots"""
+        if self.name in self.object['history']:
+            time = datetime.datetime.utcnow()
+            for history in self.object['history'][self.name].values():
+                history.append(time, self.status)
+
+    def requestMetrics(self):
+        if self.name or self.type:
+            self.message('get_metrics')
 
     def log(self, msg, time=None, source=None, type='message'):
         if source is None:
@@ -157,17 +286,162 @@ class MonitorProtocol(SimpleProtocol):
         self.factory.log(msg, time=time, source=source, type=type)
 
     def update(self):
-        if self.name or self.type:
+        if not self.name and not self.type:
+            return
+
+        if self._peer_status_push and self.status:
+            # Merged status of the subscribed peer, sampled on the same cadence as the polled ones
+            self.appendHistory()
+
+        if self._peer_status_delta or self._peer_status_push:
+            # Periodic full snapshots keep us in sync even if something went wrong
+            now = self.factory._reactor.seconds()
+            if now > self._status_full_time + self._status_full_interval:
+                self._status_full_time = now
+                self.message('get_status delta=0' if self._peer_status_delta else 'get_status')
+            elif not self._peer_status_push:
+                self.message('get_status delta=%d' % self.status_version)
+        else:
             self.message('get_status')
 
 
 class WSProtocol(SimpleProtocol):
-    def message(self, string):
-        """Sending outgoing message with no newline"""
-        self.transport.write(string.encode('ascii'))
+    # Every message is a separate SockJS frame, so no newline
+    _comand_end_character = b''
+    # Stalled browsers lose the oldest log messages
+    _output_high_water = 256*1024
+    _output_policy = 'drop-oldest'
+
+
+def consoleOnly(func):
+    '''Decorator marking the monitor command as available from console and web interfaces only, not to network peers'''
+    func._console_only = True
+
+    return func
+
+
+class MonitorCommands(CommandDispatcher):
+    """
+    Commands understood by the monitor, shared by TCP, console and web interfaces.
+    Every handler gets the command, the function to send text replies with, and the name of the source.
+    The ones marked with @consoleOnly are refused to network peers
+    """
+    _log_types = ['debug', 'info', 'message', 'error', 'warning', 'success']
+
+    refused_commands = 0
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.object = factory.object
+
+    def dispatch(self, cmd, reply, source='web', trusted=True):
+        """Handle the command, return False if it is unknown, or not allowed for untrusted source"""
+        if not trusted:
+            attr = self._commands.get(cmd.name)
+            if attr is not None and getattr(getattr(self, attr), '_console_only', False):
+                self.refused_commands += 1
+                print("Command %s from %s refused" % (cmd.name, source))
+                return False
+
+        if self.dispatchCommand(cmd, reply, source):
+            return True
+
+        self.unknownCommand(cmd)
+
+        return False
+
+    @commandHandler('exit')
+    @consoleOnly
+    def commandExit(self, cmd, reply, source):
+        self.factory._reactor.stop()
+
+    @commandHandler('connections')
+    @consoleOnly
+    def commandConnections(self, cmd, reply, source):
+        reply("Number of connections: %d" % len(self.factory.connections))
+        for c in self.factory.connections:
+            reply("  %s:%s name:%s type:%s\n" % (c._peer.host, c._peer.port, c.name, c.type))
+
+        if 'ws' in self.object:
+            reply("Number of WS connections: %d" % len(self.object['ws'].connections))
+            for c in self.object['ws'].connections:
+                reply("  %s:%s name:%s type:%s\n" % (c._peer.host, c._peer.port, c.name, c.type))
+
+    @commandHandler('clients')
+    @consoleOnly
+    def commandClients(self, cmd, reply, source):
+        reply("Number of registered clients: %d" % len(self.object['clients']))
+        for name, c in self.object['clients'].items():
+            conn = self.factory.findConnection(name=c['name'])
+            reply("  %s:%s name:%s connected:%s" % (c['host'], c['port'], c['name'], conn != None))
+        reply('')
+
+    @commandHandler('send')
+    def commandSend(self, cmd, reply, source):
+        if len(cmd.chunks) > 1:
+            c = self.factory.findConnection(name=cmd.chunks[1])
+            if c:
+                c.message(" ".join(cmd.chunks[2:]))
+
+    @commandHandler('broadcast', 'send_all')
+    @consoleOnly
+    def commandBroadcast(self, cmd, reply, source):
+        self.factory.messageAll(" ".join(cmd.chunks[1:]))
+
+    @commandHandler('set')
+    @consoleOnly
+    def commandSet(self, cmd, reply, source):
+        if 'interval' in cmd:
+            self.object['db_status_interval'] = float(cmd.get('interval'))
+            self.factory.log('DB status interval set to %g' % self.object['db_status_interval'], type='info')
+
+    @commandHandler('get_status')
+    def commandGetStatus(self, cmd, reply, source):
+        if cmd.kwargs.get('format', 'plain') == 'json':
+            reply('status_json ' + json.dumps(self.factory.getStatus(as_dict=True)))
+        else:
+            reply(self.factory.getStatus())
+
+    @commandHandler('metrics')
+    @consoleOnly
+    def commandMetrics(self, cmd, reply, source):
+        # Summary table, busiest connections first
+        summaries = [(name, summarizeMetrics(m)) for name, m in self.factory.getClientMetrics().items()]
+        reply("%-20s %10s %10s %12s %12s %8s %8s %8s" % ('client', 'msg/s in', 'msg/s out', 'kB/s in', 'proc max ms', 'queue', 'dropped', 'overruns'))
+        for name, s in sorted(summaries, key=lambda _: -_[1]['process_max']):
+            reply("%-20s %10.1f %10.1f %12.1f %12.2f %8d %8d %8d" % (name, s['messages_in_rate'], s['messages_out_rate'], s['bytes_in_rate']/1024,
+                                                                 1e3*s['process_max'], s['commands'], s['dropped_messages'], s['update_overruns']))
+
+    @commandHandler('profile')
+    @consoleOnly
+    def commandProfile(self, cmd, reply, source):
+        # Report is printed to the console, so no need to repeat it
+        reply(wire.toString('profile_state', profiler.command(cmd, name='monitor')))
+
+    @commandHandler(*_log_types)
+    def commandLog(self, cmd, reply, source):
+        msg = " ".join(cmd.chunks[1:])
+        self.factory.log(msg, time=datetime.datetime.utcnow(), source=source, type=cmd.name)
+
+    @commandHandler('reset_plots')
+    def commandResetPlots(self, cmd, reply, source):
+        self.factory.reset_plots()
 
 
 class MonitorFactory(SimpleFactory):
+    def __init__(self, *args, **kwargs):
+        SimpleFactory.__init__(self, *args, **kwargs)
+
+        # Command handlers shared by all the interfaces
+        self.commands = MonitorCommands(self)
+
+    def getMetrics(self):
+        result = SimpleFactory.getMetrics(self)
+        result['unknown_commands'] = self.commands.unknown_commands
+        result['refused_commands'] = self.commands.refused_commands
+
+        return result
+
     @catch
     def getStatus(self, as_dict=False):
         if as_dict:
@@ -196,6 +470,16 @@ class MonitorFactory(SimpleFactory):
 
         return status
 
+    def getClientMetrics(self):
+        """Latest metrics of all monitored clients, along with the monitor own ones"""
+        result = {'monitor': self.metrics.snapshot()}
+
+        for name in self.object['clients']:
+            c = self.findConnection(name=name)
+            result[name] = c.metrics if c else {}
+
+        return result
+
     @catch
     def log(self, msg, time=None, source=None, type='message'):
         """Log the message to both console, web-interface and database, if connected"""
@@ -210,6 +494,7 @@ class MonitorFactory(SimpleFactory):
         # DB
         if 'db' in self.object and self.object['db'] is not None:
             self.object['db'].log(msg, time=time, source=source, type=type)
+            self.metrics.inc('db_log_writes')
 
         # WebSockets
         if 'ws' in self.object:
@@ -217,11 +502,9 @@ class MonitorFactory(SimpleFactory):
 
     @catch
     def reset_plots(self):
-        values = self.object['values']
-
-        for client in values.keys():
-            for param in values[client].keys():
-                values[client][param] = []
+        for plots in self.object['history'].values():
+            for history in plots.values():
+                history.clear()
 
         self.log('Resetting plots', source='monitor', type='info')
         pass
@@ -245,41 +528,11 @@ class CmdlineProtocol(LineReceiver):
     def lineReceived(self, line):
         cmd = Command(line.decode('ascii'))
 
-        if cmd.name == 'exit':
-            self.factory._reactor.stop()
-
-        elif cmd.name == 'connections':
-            self.message("Number of connections: %d" % len(self.factory.connections))
-            for c in self.factory.connections:
-                self.message("  %s:%s name:%s type:%s\n" % (c._peer.host, c._peer.port, c.name, c.type))
-
-            if 'ws' in self.object:
-                self.message("Number of WS connections: %d" % len(self.object['ws'].connections))
-                for c in self.object['ws'].connections:
-                    self.message("  %s:%s name:%s type:%s\n" % (c._peer.host, c._peer.port, c.name, c.type))
-
-        elif cmd.name == 'clients' or not cmd.name:
-            self.message("Number of registered clients: %d" % len(self.object['clients']))
-            for name, c in self.object['clients'].items():
-                conn = self.factory.findConnection(name=c['name'])
-                self.message("  %s:%s name:%s connected:%s" % (c['host'], c['port'], c['name'], conn != None))
-            self.message()
-
-        elif cmd.name == 'send' and cmd.chunks[1]:
-            c = self.factory.findConnection(name=cmd.chunks[1])
-            if c:
-                c.message(" ".join(cmd.chunks[2:]))
-
-        elif cmd.name == 'get_status':
-            self.message(self.factory.getStatus())
-
-        elif cmd.name in ['debug', 'info', 'message', 'error', 'warning']:
-            msg = " ".join(cmd.chunks[1:])
-            time = datetime.datetime.utcnow()
-            self.factory.log(msg, time=time, source='web', type=cmd.name)
+        if not cmd.name:
+            # Empty line lists the clients
+            cmd = Command('clients')
 
-        elif cmd.name == 'reset_plots':
-            self.factory.reset_plots()
+        self.factory.commands.dispatch(cmd, self.message, source='web')
 
         self.transport.write(b'### ')
 
@@ -289,73 +542,156 @@ def serve_json(request, **kwargs):
     return json.dumps(kwargs)
 
 
-def make_plot(file, obj, client_name, plot_name, size=800):
-    plot = obj['clients'][client_name]['plots'][plot_name]
-    values = obj['values'][client_name]
-
-    has_data = False
-
-    fig = Figure(facecolor='white', dpi=72, figsize=(plot['width']/72, plot['height']/72), tight_layout=True)
-    ax = fig.add_subplot(111)
-
-    for _ in plot['values'][1:]:
-        # Check whether we have at least one data point to plot
-        if np.any(np.array(values[_]) != None):
-            has_data = True
-            ax.plot(values[plot['values'][0]], values[_], '-', label=_)
+class PlotCache(object):
+    """
+    Rendered plot images, re-rendered only when the plot history changes. Rendering is done
+    in a pool of worker processes from the snapshots of the history arrays, so it does not block
+    the reactor. Concurrent requests for the same plot share the single rendering, and when too
+    many renderings are already in flight, the stale image (or nothing) is returned instead.
+    If a worker dies, the pool is re-created
+    """
 
-    if plot['values'][0] == 'time' and len(values[plot['values'][0]]) > 1 and has_data:
-        ax.xaxis.set_major_formatter(DateFormatter('%H:%M:%S'))
-        fig.autofmt_xdate()
-
-    if plot['xlabel']:
-        ax.set_xlabel(plot['xlabel'])
-    else:
-        ax.set_xlabel(plot['values'][0])
-
-    if plot['ylabel']:
-        ax.set_ylabel(plot['ylabel'])
-    elif len(plot['values']) == 1:
-        ax.set_ylabel(plot['values'][1])
-
-    if has_data:
-        if plot['xscale'] != 'linear':
-            ax.set_xscale(plot['xscale'], nonposx='clip')
+    def __init__(self, object, reactor, workers=2, max_pending=8):
+        self.object = object
+        self._reactor = reactor
+        self._cache = {}  # (client, plot) -> (history version, PNG data, ETag)
+        self._pending = {}  # (client, plot) -> list of Deferreds waiting for its rendering
+
+        self.max_pending = max_pending
+        self.workers = workers
+
+        self._pool = self._makePool() if workers > 0 else None
+        if self._pool is not None:
+            self._reactor.addSystemEventTrigger('before', 'shutdown', lambda: self._pool.shutdown(wait=False))
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0  # Requests answered with 304
+        self.deduplicated = 0  # Requests joined to already running rendering
+        self.shed = 0  # Requests not rendered due to too many pending ones
+        self.errors = 0
+        self.restarts = 0  # Pool re-creations after worker crashes
+
+    def _makePool(self):
+        # Workers are forked from a separate server process with plotting module preloaded,
+        # as forking the monitor itself is unsafe with the threads it runs
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['plotting'])
+
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def _restartPool(self, pool):
+        """Replace the broken pool with the new one, unless it is already done"""
+        if pool is not self._pool:
+            return
+
+        print('Plot rendering pool is broken, re-creating it')
+        self.restarts += 1
+        pool.shutdown(wait=False)
+        self._pool = self._makePool()
+
+    def get(self, client_name, plot_name):
+        """
+        Deferred firing with PNG image of the plot along with its ETag, or with None if it can't be rendered now.
+        Returns None if there is no such plot
+        """
+        history = self.object['history'].get(client_name, {}).get(plot_name)
+        if history is None:
+            return None
+
+        key = (client_name, plot_name)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == history.version:
+            self.hits += 1
+            return succeed(entry[1:])
+
+        if key in self._pending:
+            # The image being rendered may be a bit older than the history, but the next request will catch up
+            self.deduplicated += 1
+            d = Deferred()
+            self._pending[key].append(d)
+            return d
+
+        if len(self._pending) >= self.max_pending:
+            self.shed += 1
+            return succeed(entry[1:] if entry is not None else None)
+
+        self.misses += 1
+        d = Deferred()
+        self._pending[key] = [d]
+
+        args = plotting.snapshot(self.object['clients'][client_name]['plots'][plot_name], history)
+
+        try:
+            if self._pool is None:
+                self._finished(key, history.version, plotting.render(*args))
+            else:
+                pool = self._pool
+                try:
+                    future = pool.submit(plotting.render, *args)
+                except BrokenProcessPool:
+                    self._restartPool(pool)
+                    pool = self._pool
+                    future = pool.submit(plotting.render, *args)
+                future.add_done_callback(lambda f, version=history.version, pool=pool:
+                                         self._reactor.callFromThread(self._done, key, version, f, pool))
+        except Exception:
+            self._finished(key, history.version, None, Failure())
+
+        return d
+
+    def _done(self, key, version, future, pool=None):
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            # The worker died, so every further submit to this pool would fail as well
+            self._restartPool(pool)
+
+        if error is None:
+            self._finished(key, version, future.result())
+        else:
+            self._finished(key, version, None, Failure(error))
 
-        if plot['yscale'] != 'linear':
-            ax.set_yscale(plot['yscale'], nonpositive='clip')
+    def _finished(self, key, version, data, failure=None):
+        waiting = self._pending.pop(key, [])
 
-            if plot['yscale'] == 'log':
-                # Try to fix the ticks if the data span is too small
-                axis = ax.get_yaxis()
-                if np.ptp(np.log10(axis.get_data_interval())) < 1:
-                    axis.set_major_locator(MaxNLocator())
-                    axis.set_minor_locator(NullLocator())
+        if failure is not None:
+            self.errors += 1
+            print('Error rendering plot %s/%s: %s' % (key[0], key[1], failure.getErrorMessage()))
+            for d in waiting:
+                d.errback(failure)
+            return
 
-        if len(plot['values']) > 4:
-            ax.legend(frameon=True, loc=2, framealpha=0.99)
-        elif len(plot['values']) > 2:
-            ax.legend(frameon=False)
+        entry = (version, data, '"%s"' % hashlib.sha1(data).hexdigest())
+        self._cache[key] = entry
 
-    if plot['name']:
-        ax.set_title(plot['name'])
-    ax.margins(0.01, 0.1)
+        for d in waiting:
+            d.callback(entry[1:])
 
-    # FIXME: make it configurable
-    ax.grid(True)
+    def stats(self):
+        requests = self.hits + self.misses
 
-    # Return the image
-    canvas = FigureCanvas(fig)
-    canvas.print_png(file)#, bbox_inches='tight')
+        return {'plot_cache_hits': self.hits,
+                'plot_cache_misses': self.misses,
+                'plot_cache_not_modified': self.not_modified,
+                'plot_cache_deduplicated': self.deduplicated,
+                'plot_cache_shed': self.shed,
+                'plot_cache_errors': self.errors,
+                'plot_cache_restarts': self.restarts,
+                'plot_cache_pending': len(self._pending),
+                'plot_cache_hit_rate': self.hits/requests if requests else 0,
+                'plot_cache_bytes': sum(len(_[1]) for _ in self._cache.values())}
 
 
 class WebMonitor(Resource):
     isLeaf = True
 
-    def __init__(self, factory=None, object=None):
+    def __init__(self, factory=None, object=None, plot_workers=2, plot_pending=8):
         self.factory = factory
         self.object = object
 
+        self.plots = PlotCache(object, factory._reactor, workers=plot_workers, max_pending=plot_pending)
+        self.factory.metrics.addSource(self.plots.stats)
+
     @catch
     def render_GET(self, request):
         q = urlparse(request.uri)
@@ -367,46 +703,81 @@ class WebMonitor(Resource):
             return serve_json(request,
                               clients=self.object['clients'],
                               status=self.factory.getStatus(as_dict=True)).encode('ascii')
+        elif q.path == b'/monitor/metrics':
+            metrics = self.factory.getClientMetrics()
+            return serve_json(request,
+                              metrics=metrics,
+                              summary={name: summarizeMetrics(m) for name, m in metrics.items()}).encode('ascii')
         # /monitor/plots/{client}/{name}
         elif qs[1] == 'monitor' and qs[2] == 'plot' and len(qs) > 4:
-            s = BytesIO()
-            make_plot(s, self.object, qs[3], qs[4])
-            request.responseHeaders.setRawHeaders("Content-Type", ['image/png'])
-            request.responseHeaders.setRawHeaders("Content-Length", [str(len(s.getvalue()))])
-            request.responseHeaders.setRawHeaders("Cache-Control", ['no-store, no-cache, must-revalidate, max-age=0'])
-            return s.getvalue()
+            d = self.plots.get(qs[3], qs[4])
+            if d is None:
+                request.setResponseCode(404)
+                return b''
+
+            finished = []
+            request.notifyFinish().addBoth(finished.append)
+
+            d.addCallback(self.renderPlot, request, finished)
+            d.addErrback(self.renderPlotError, request, finished)
+
+            return NOT_DONE_YET
+        # /monitor/data/{client}/{name}?since={seq}
+        elif qs[1] == 'monitor' and qs[2] == 'data' and len(qs) > 4:
+            history = self.object['history'].get(qs[3], {}).get(qs[4])
+            if history is None:
+                request.setResponseCode(404)
+                return b''
+
+            try:
+                since = int(args[b'since'][0])
+            except (KeyError, ValueError):
+                # Missing or malformed sequence number, just send all the kept samples
+                since = None
+
+            request.responseHeaders.setRawHeaders("Cache-Control", ['no-store'])
+            return serve_json(request, **history.columns(since)).encode('ascii')
         elif path == '/monitor/command' and b'string' in args:
             cmd = Command(args[b'string'][0].decode('ascii'))
 
-            # TODO: re-use the command processing code from TCP server part
-            if cmd.name == 'exit':
-                self.factory._reactor.stop()
+            replies = []
+            self.factory.commands.dispatch(cmd, replies.append, source='web')
 
-            elif cmd.name == 'send' and cmd.chunks[1]:
-                c = self.factory.findConnection(name=cmd.chunks[1])
-                if c:
-                    c.message(" ".join(cmd.chunks[2:]))
+            return serve_json(request, reply=replies).encode('ascii')
 
-            elif (cmd.name == 'broadcast' or cmd.name == 'send_all'):
-                self.factory.messageAll(" ".join(cmd.chunks[1:]))
+        else:
+            return q.path
 
-            elif (cmd.name == 'set'):
-                if 'interval' in cmd:
-                    self.object['db_status_interval'] = float(cmd.get('interval'))
-                    self.factory.log('DB status interval set to %g' % self.object['db_status_interval'], type='info')
+    def renderPlot(self, result, request, finished):
+        if finished:
+            # Client is already gone
+            return
 
-            elif cmd.name in ['debug', 'info', 'message', 'error', 'warning']:
-                msg = " ".join(cmd.chunks[1:])
-                time = datetime.datetime.utcnow()
-                self.factory.log(msg, time=time, source='web', type=cmd.name)
+        if result is None:
+            # Not rendered due to the load, and there is no older image
+            request.setResponseCode(503)
+            request.responseHeaders.setRawHeaders("Retry-After", ['1'])
+            request.finish()
+            return
 
-            elif cmd.name == 'reset_plots':
-                self.factory.reset_plots()
+        data, etag = result
 
-            return serve_json(request).encode('ascii')
+        # Browsers may keep the image, but have to check whether it is still valid
+        request.responseHeaders.setRawHeaders("Cache-Control", ['no-cache'])
+        if request.setETag(etag.encode('ascii')) == http.CACHED:
+            self.plots.not_modified += 1
+            request.finish()
+            return
 
-        else:
-            return q.path
+        request.responseHeaders.setRawHeaders("Content-Type", ['image/png'])
+        request.responseHeaders.setRawHeaders("Content-Length", [str(len(data))])
+        request.write(data)
+        request.finish()
+
+    def renderPlotError(self, failure, request, finished):
+        if not finished:
+            request.setResponseCode(500)
+            request.finish()
 
 
 def loadINI(filename, obj):
@@ -428,6 +799,10 @@ def loadINI(filename, obj):
     host = string(default=localhost)
     description = string(default=None)
     template = string(default=default.html)
+    deadband = float(min=0, default=0)
+
+    [[deadbands]]
+    __many__ = float(min=0)
 
     [[plots]]
     [[[__many__]]]
@@ -439,6 +814,7 @@ def loadINI(filename, obj):
     height = integer(min=0,max=2048,default=300)
     xscale = string(default=linear)
     yscale = string(default=linear)
+    depth = integer(min=2,default=1000)
     ''' % (obj['port'], obj['http_port'], obj['name'], obj['db_host'], obj['db_status_interval'])), list_values=False)
 
     confname = '%s.ini' % posixpath.splitext(__file__)[0]
@@ -461,18 +837,15 @@ def loadINI(filename, obj):
             client = section.dict()
             client['name'] = sname
 
-            obj['values'][sname] = {}
+            obj['history'][sname] = {}
 
             if 'plots' in section:
-                values = []
-
-                # Parse parameters of plots
+                # Parse parameters of plots, every one keeping its own history
                 for plot in section['plots']:
                     client['plots'][plot] = section['plots'][plot]
 
-                    values += section['plots'][plot]['values']
-
-                obj['values'][sname] = {_: [] for _ in set(values)}  # Unique values
+                    names = [_ for _ in client['plots'][plot]['values'] if _ != 'time']
+                    obj['history'][sname][plot] = History(names, depth=client['plots'][plot]['depth'])
 
             obj['clients'][sname] = client
 
@@ -489,7 +862,7 @@ if __name__ == '__main__':
     from optparse import OptionParser
 
     # Object holding actual state and work logic.
-    obj = {'clients': OrderedDict(), 'values': {}, 'port': 7100, 'http_port': 8888, 'db_host': None,
+    obj = {'clients': OrderedDict(), 'history': {}, 'port': 7100, 'http_port': 8888, 'db_host': None,
            'db_status_interval': 60.0, 'name': 'monitor', 'db': None}
 
     # First read client config from INI file
@@ -505,6 +878,10 @@ if __name__ == '__main__':
     parser.add_option('-D', '--debug', help='Debug output', action='store_true', dest='debug', default=False)
     parser.add_option('-s', '--server', help='Act as a TCP and HTTP server', action='store_true', dest='server', default=False)
     parser.add_option('-i', '--interval', help='DB logging status inteval', dest='interval', type='float', default=obj['db_status_interval'])
+    parser.add_option('-w', '--plot-workers', help='Number of plot rendering processes, 0 to render in main one', action='store', dest='plot_workers', type='int', default=2)
+    parser.add_option('-q', '--plot-queue', help='Max number of plots being rendered at once', action='store', dest='plot_queue', type='int', default=8)
+    parser.add_option('--db-spill', help='File to keep the data while the database is down', action='store', dest='db_spill', type='string',
+                      default='%s.spill' % posixpath.splitext(__file__)[0])
     parser.add_option('-a', '--auth-file', help='passwords file', action='store', dest='passwd_file', type='string')  # htpasswd -c -d passwdfile user
 
     (options, args) = parser.parse_args()
@@ -545,7 +922,7 @@ if __name__ == '__main__':
         # Serve files from web
         root = File(r"web")
         root.putChild(b"", File('web/main.html'))
-        root.putChild(b"monitor", WebMonitor(factory=daemon, object=obj))
+        root.putChild(b"monitor", WebMonitor(factory=daemon, object=obj, plot_workers=options.plot_workers, plot_pending=options.plot_queue))
         if options.passwd_file and os.path.exists(options.passwd_file):
             site = Site(Auth(root, options.passwd_file))
         else:
@@ -557,8 +934,11 @@ if __name__ == '__main__':
             obj['ws'] = ws
             root.putChild(b"ws", SockJSResource(ws))
 
-        # Database connection
-        obj['db'] = DB(dbhost=options.db_host)
+        # Database connection. Everything is written asynchronously from a separate thread, which also
+        # connects to the database when needed, so it is fine for it to be down at startup
+        obj['db'] = DBWriter(DB(dbhost=options.db_host, lazy=True), spill=options.db_spill)
+        daemon.metrics.addSource(obj['db'].stats)
+        daemon._reactor.addSystemEventTrigger('before', 'shutdown', obj['db'].stop)
         obj['db_status_timestamp'] = datetime.datetime.utcfromtimestamp(0)
 
         print("Listening for incoming HTTP connections on port %d" % options.http_port)
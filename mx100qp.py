@@ -4,7 +4,7 @@ import datetime
 import numpy as np
 import re
 
-from daemon import SimpleFactory, SimpleProtocol, catch
+from daemon import SimpleFactory, SimpleProtocol, CommandQueue, catch
 
 
 class DaemonProtocol(SimpleProtocol):
@@ -72,9 +72,14 @@ class mx100qp_Protocol(SimpleProtocol):
     _debug = False  # Display all traffic for debug purposes
     _refresh = 0.01
 
+    # Command queue settings
+    _depth = 1  # Number of queries sent without waiting for replies
+    _timeout = 2.0  # Seconds to wait for the reply
+    _retries = 1  # Number of re-sends for the queries without reply
+
     def __init__(self):
         SimpleProtocol.__init__(self)
-        self.commands = []  # Queue of command sent to the device which will provide replies, each entry is a dict with keys "cmd","source","timeStamp"
+        self.commands = CommandQueue(self, depth=self._depth, timeout=self._timeout, retries=self._retries)  # Queue of commands sent to the device
         self.status_commands = ['I1?', 'V1?', 'I1O?', 'V1O?', 'OP1?',
                                 'I2?', 'V2?', 'I2O?', 'V2O?', 'OP2?',
                                 'I3?', 'V3?', 'I3O?', 'V3O?', 'OP3?',
@@ -90,14 +95,14 @@ class mx100qp_Protocol(SimpleProtocol):
     @catch
     def connectionMade(self):
         SimpleProtocol.connectionMade(self)
-        self.commands = []
+        self.commands.clear()
         # We will set this flag when we receive any reply from the device
         self.object['hw_connected'] = 1
         SimpleProtocol.message(self, '*RST')
 
     @catch
     def connectionLost(self, reason):
-        self.commands = []
+        self.commands.clear()
         SimpleProtocol.connectionLost(self, reason)
         resetObjStatus(self.object)
 
@@ -109,73 +114,48 @@ class mx100qp_Protocol(SimpleProtocol):
         # Update the last reply timestamp
         obj['hw_last_reply_time'] = datetime.datetime.utcnow()
         obj['hw_connected'] = 1
+        # Match the reply to the oldest command sent, forwarding it to the client who sent the command
+        entry = self.commands.reply(string)
+        if entry is None:
+            return
+        ccmd = entry['cmd'].decode()
         # Process the device reply
-        while len(self.commands):
-            ccmd = self.commands[0]['cmd'].decode()
-            # We have some sent commands in the queue - let's check what was the oldest one
-            br = False
-            for ch in ['1', '2', '3', '4']:
-                if ccmd == 'I'+ch+'?':
-                    obj['I'+ch] = float(string[3:-1])
-                    br = True
-                    break
-                if ccmd == 'V'+ch+'?':
-                    obj['V'+ch] = float(string[3:-1])
-                    br = True
-                    break
-                if ccmd == 'V'+ch+'O?':
-                    obj['V'+ch+'O'] = float(string[0:-2])
-                    br = True
-                    break
-                if ccmd == 'I'+ch+'O?':
-                    obj['I'+ch+'O'] = float(string[0:-2])
-                    br = True
-                    break
-                if ccmd == 'OP'+ch+'?':
-                    obj['VOut'+ch] = int(string[0])
-                    br = True
-                    break
-                if ccmd == 'OVP'+ch+'?':
-                    obj['OVP'+ch] = float(string[:-1].split()[1])
-                    br = True
-                    break
-                if ccmd == 'OCP'+ch+'?':
-                    obj['OCP'+ch] = float(string[:-1].split()[1])
-                    br = True
-                    break
-            if br:
+        for ch in ['1', '2', '3', '4']:
+            if ccmd == 'I'+ch+'?':
+                obj['I'+ch] = float(string[3:-1])
+                break
+            if ccmd == 'V'+ch+'?':
+                obj['V'+ch] = float(string[3:-1])
+                break
+            if ccmd == 'V'+ch+'O?':
+                obj['V'+ch+'O'] = float(string[0:-2])
+                break
+            if ccmd == 'I'+ch+'O?':
+                obj['I'+ch+'O'] = float(string[0:-2])
+                break
+            if ccmd == 'OP'+ch+'?':
+                obj['VOut'+ch] = int(string[0])
+                break
+            if ccmd == 'OVP'+ch+'?':
+                obj['OVP'+ch] = float(string[:-1].split()[1])
+                break
+            if ccmd == 'OCP'+ch+'?':
+                obj['OCP'+ch] = float(string[:-1].split()[1])
                 break
-
-            # some more commands
-            break
-        else:
-            return
-        if not self.commands[0]['source'] == 'itself':
-            # in case the origin of the query was not itself, forward the answer to the origin
-            obj['daemon'].messageAll(string, self.commands[0]['source'])
-        self.commands.pop(0)
 
     @catch
     def update(self):
         if self._debug:
-            print('--------self.commands--------------')
-            for cc in self.commands:
-                print(cc)
-            print('----------------------')
+            print('commands:', self.commands.stats())
         # first check if device is hw_connected
         if self.object['hw_connected'] == 0:
             # if not connected do not send any commands
             return
 
-        if len(self.commands) and not self.commands[0]['sent']:
-            SimpleProtocol.message(self, self.commands[0]['cmd'])
-            if not self.commands[0]['keep']:
-                self.commands.pop(0)
-            else:
-                self.commands[0]['sent'] = True
-        elif not len(self.commands):
+        # Commands are sent by the queue itself, we just need to poll the status when it is empty
+        if not len(self.commands):
             for k in self.status_commands:
-                self.commands.append({'cmd': k.encode('ascii'), 'source': 'itself', 'keep': True, 'sent': False})
+                self.commands.add(k.encode('ascii'))
 
     @catch
     def message(self, string, keep=False, source='itself'):
@@ -183,21 +163,13 @@ class mx100qp_Protocol(SimpleProtocol):
         Send the message to the controller. If keep=True, expect reply
         """
         if string == b'reset_q':
-            self.commands = []
+            self.commands.clear()
             return
 
-        if string in [b'EER?', b'QER?']:
-            self.commands.insert(0, {'cmd': string, 'source': source, 'keep': keep, 'sent': False})
-            return
-
-        n = 0
-        for cc in self.commands:
-            if not cc['sent']:
-                break
-            n += 1
+        # Error queries go first, other commands from clients go before the status polling ones
         if self._debug:
-            print('cmd', string, 'from', source, 'will be inserted at', n)
-        self.commands.insert(n, {'cmd': string, 'source': source, 'keep': keep, 'sent': False})
+            print('cmd', string, 'from', source)
+        self.commands.add(string, source=source, keep=keep, priority=string in [b'EER?', b'QER?'])
 
 
 def resetObjStatus(obj):
@@ -232,7 +204,8 @@ def resetObjStatus(obj):
     obj['OCP4'] = np.nan
 
 
-if __name__ == '__main__':
+def getOptionParser():
+    """Command-line options of the daemon, also used by host.py"""
     from optparse import OptionParser
     parser = OptionParser(usage="usage: %prog [options] arg")
     parser.add_option('-H', '--hw-host', help='Hardware host to connect', action='store', dest='hw_host', default='192.168.1.14')
@@ -240,7 +213,12 @@ if __name__ == '__main__':
     parser.add_option('-p', '--port', help='Daemon port', action='store', dest='port', type='int', default=7034)
     parser.add_option('-n', '--name', help='Daemon name', action='store', dest='name', default='mx100qp')
     parser.add_option("-D", '--debug', help='Debug mode', action="store_true", dest="debug")
-    (options, args) = parser.parse_args()
+
+    return parser
+
+
+def buildDaemon(options, reactor=None):
+    """Create and start the daemon and hardware factories, and return the daemon one"""
     # Object holding actual state and work logic.
     # May be anything that will be passed by reference - list, dict, object etc
     obj = {}
@@ -248,8 +226,8 @@ if __name__ == '__main__':
 
     # Factories for daemon and hardware connections
     # We need two different factories as the protocols are different
-    daemon = SimpleFactory(DaemonProtocol, obj)
-    hw = SimpleFactory(mx100qp_Protocol, obj)
+    daemon = SimpleFactory(DaemonProtocol, obj, reactor=reactor)
+    hw = SimpleFactory(mx100qp_Protocol, obj, reactor=reactor)
     if options.debug:
         daemon._protocol._debug = True
         hw._protocol._debug = True
@@ -261,4 +239,13 @@ if __name__ == '__main__':
     daemon.listen(options.port)
     # Outgoing connection
     hw.connect(options.hw_host, options.hw_port)
+
+    return daemon
+
+
+if __name__ == '__main__':
+    (options, args) = getOptionParser().parse_args()
+
+    daemon = buildDaemon(options)
+
     daemon._reactor.run()
@@ -2,7 +2,7 @@
 import re
 import numpy as np
 
-from daemon import SimpleFactory, SimpleProtocol, catch
+from daemon import SimpleFactory, SimpleProtocol, CommandQueue, catch
 
 class DaemonProtocol(SimpleProtocol):
     _debug = False  # Display all traffic for debug purposes
@@ -64,11 +64,16 @@ class Owon_odp6033Protocol(SimpleProtocol):
 
     _tcp_keepidle = 1  # Faster detection of peer disconnection
     _tcp_user_timeout = 3000  # Faster detection of peer disconnection
+
+    # Command queue settings
+    _depth = 1  # Number of queries sent without waiting for replies
+    _timeout = 2.0  # Seconds to wait for the reply
+    _retries = 1  # Number of re-sends for the queries without reply
     
     @catch
     def __init__(self):
         SimpleProtocol.__init__(self)
-        self.commands = []  # Queue of command sent to the device which will provide replies, each entry is a dict with keys "cmd","source","keep", and "sent"
+        self.commands = CommandQueue(self, depth=self._depth, timeout=self._timeout, retries=self._retries)  # Queue of commands sent to the device
         self.name = 'hw'
         self.type = 'hw'
         self.status_commands = [':APP:VOLT?',':APP:CURR?','CHAN:OUTP:ALL?']
@@ -93,6 +98,7 @@ class Owon_odp6033Protocol(SimpleProtocol):
         self.object['O1'] = -1
         self.object['O2'] = -1
         self.object['O3'] = -1
+        self.commands.clear()
         SimpleProtocol.connectionLost(self, reason)
         
     @catch
@@ -101,62 +107,49 @@ class Owon_odp6033Protocol(SimpleProtocol):
         if self._debug:
             print ('hw cc > %s' % string)
 
-        obj = self.object  # Object holding the state
-        daemon = obj['daemon']
-        
-        while len(self.commands) and string != "\r":
-            if self._debug:
-                print ('last command which expects reply was:', self.commands[0]['cmd'])
-                print ('received reply:', string)
-            if not self.commands[0]['source'] == 'itself':
-                # in case the origin of the query was not itself, forward the answer to the origin
-                daemon.messageAll(string, self.commands[0]['source'])
-                
-            if self.commands[0]['cmd'] == ':APP:VOLT?':
-                VV = string.split(',')
-                self.object['V1'] = float(VV[0])
-                self.object['V2'] = float(VV[1])
-                self.object['V3'] = float(VV[2])
-                break
-            if self.commands[0]['cmd'] == ':APP:CURR?':
-                II = string.split(',')
-                self.object['I1'] = float(II[0])
-                self.object['I2'] = float(II[1])
-                self.object['I3'] = float(II[2])
-                break
-            if self.commands[0]['cmd'] == 'CHAN:OUTP:ALL?':
-                OO = string.split(',')
-                self.object['O1'] = int(OO[0])
-                self.object['O2'] = int(OO[1])
-                self.object['O3'] = int(OO[2])
-                break
-            break
-        else:
+        if string == "\r":
             return
-        self.commands.pop(0)
+
+        # Match the reply to the oldest command sent, forwarding it to the client who sent the command
+        entry = self.commands.reply(string)
+        if entry is None:
+            return
+
+        cmd = entry['cmd'].decode('ascii') if isinstance(entry['cmd'], bytes) else entry['cmd']
+        if self._debug:
+            print ('last command which expects reply was:', cmd)
+            print ('received reply:', string)
+
+        if cmd == ':APP:VOLT?':
+            VV = string.split(',')
+            self.object['V1'] = float(VV[0])
+            self.object['V2'] = float(VV[1])
+            self.object['V3'] = float(VV[2])
+        elif cmd == ':APP:CURR?':
+            II = string.split(',')
+            self.object['I1'] = float(II[0])
+            self.object['I2'] = float(II[1])
+            self.object['I3'] = float(II[2])
+        elif cmd == 'CHAN:OUTP:ALL?':
+            OO = string.split(',')
+            self.object['O1'] = int(OO[0])
+            self.object['O2'] = int(OO[1])
+            self.object['O3'] = int(OO[2])
 
 
     @catch
     def update(self):
-        if _debug:
-            print ('--------self.commands--------------')
-            for cc in self.commands:
-                print (cc)
-            print ('----------------------')
+        if self._debug:
+            print ('commands:', self.commands.stats())
         # first check if device is hw_connected
         if self.object['hw_connected'] == 0:
             # if not connected do not send any commands
             return        
  
-        if len(self.commands) and not self.commands[0]['sent']:
-            SimpleProtocol.message(self, self.commands[0]['cmd'])
-            if not self.commands[0]['keep']:
-                self.commands.pop(0)
-            else:
-                 self.commands[0]['sent'] = True
-        elif not len(self.commands):
+        # Commands are sent by the queue itself, we just need to poll the status when it is empty
+        if not len(self.commands):
             for k in self.status_commands:
-                self.commands.append({'cmd': k, 'source': 'itself', 'keep': True, 'sent':False})
+                self.commands.add(k)
                 
 
     @catch
@@ -164,15 +157,12 @@ class Owon_odp6033Protocol(SimpleProtocol):
         """
         Send the message to the controller. If keep=True, expect reply
         """
-        n = 0
-        for cc in self.commands:
-            if not cc['sent']:
-                break
-            n += 1
-        self.commands.insert(n, {'cmd': string, 'source': source, 'keep': keep, 'sent':False})
+        # Commands from clients go before the status polling ones
+        self.commands.add(string, source=source, keep=keep)
                 
         
-if __name__ == '__main__':
+def getOptionParser():
+    """Command-line options of the daemon, also used by host.py"""
     from optparse import OptionParser
 
     parser = OptionParser(usage="usage: %prog [options] arg")
@@ -182,14 +172,17 @@ if __name__ == '__main__':
     parser.add_option('-n', '--name', help='Daemon name', action='store', dest='name', default='Owon_odp6033')
     parser.add_option("-D", '--debug', help='Debug mode', action="store_true", dest="debug")
 
-    (options, args) = parser.parse_args()
+    return parser
+
 
+def buildDaemon(options, reactor=None):
+    """Create and start the daemon and hardware factories, and return the daemon one"""
     # Object holding actual state and work logic.
     # May be anything that will be passed by reference - list, dict, object etc
     obj = {'hw_connected': 0,'V1':np.nan,'V2':np.nan,'V3':np.nan,'I1':np.nan,'I2':np.nan,'I3':np.nan,'O1':-1,'O2':-1,'O3':-1}
 
-    daemon = SimpleFactory(DaemonProtocol, obj)
-    hw = SimpleFactory(Owon_odp6033Protocol, obj)
+    daemon = SimpleFactory(DaemonProtocol, obj, reactor=reactor)
+    hw = SimpleFactory(Owon_odp6033Protocol, obj, reactor=reactor)
 
     daemon.name = options.name
 
@@ -205,4 +198,12 @@ if __name__ == '__main__':
     # Outgoing connection
     hw.connect(options.hw_host, options.hw_port)
 
+    return daemon
+
+
+if __name__ == '__main__':
+    (options, args) = getOptionParser().parse_args()
+
+    daemon = buildDaemon(options)
+
     daemon._reactor.run()
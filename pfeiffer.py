@@ -5,7 +5,7 @@ import sys
 
 from daemon import SimpleFactory, SimpleProtocol
 from twisted.internet.serialport import SerialPort
-from twisted.internet.task import LoopingCall
+from scheduler import PollScheduler
 from command import Command
 from optparse import OptionParser
 
@@ -39,8 +39,7 @@ class HWProtocol(SimpleProtocol):
     def connectionMade(self):
         self.object['hw_connected'] = 1
         # SimpleProtocol.connectionMade(self)
-        self._updateTimer = LoopingCall(self.update)
-        self._updateTimer.start(self._refresh)
+        self._updateTimer = PollScheduler.forReactor().add(self.update, self._refresh)
 
     def connectionLost(self, reason):
         self.object['hw_connected'] = 0
@@ -52,7 +51,7 @@ class HWProtocol(SimpleProtocol):
     def processMessage(self, string):
         # Process the device reply
         if self._debug:
-            print "hw > %s" % string
+            print("hw > %s" % string)
 
         if len(string) and string[0] >= '0' and string[0] <= '6' and 'E' in string:
             # b,sx.xxxxEsxx
@@ -62,9 +61,8 @@ class HWProtocol(SimpleProtocol):
     def message(self, string):
         """Sending outgoing message"""
         if self._debug:
-            print ">> serial >>", string
-        self.transport.write(string)
-        self.transport.write("\r\n")
+            print(">> serial >>", string)
+        self.transport.write(string.encode('ascii') + b'\r\n')
 
     def update(self):
         # Request the hardware state from the device
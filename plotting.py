@@ -0,0 +1,89 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Rendering of the monitor plots. It works on plain copies of the history arrays,
+# so that it may run in a separate worker process, away from the reactor.
+
+try:
+    from StringIO import StringIO as BytesIO
+except ImportError:
+    from io import BytesIO
+
+import numpy as np
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.figure import Figure
+from matplotlib.dates import DateFormatter
+from matplotlib.ticker import ScalarFormatter, LogLocator, LinearLocator, MaxNLocator, NullLocator
+
+
+def snapshot(plot, history):
+    """Arguments for render() with copies of the plotted data, safe to be sent to another process"""
+    if plot['values'][0] == 'time':
+        x = history.times().copy()
+    else:
+        x = history.view(plot['values'][0]).copy()
+
+    ys = [(_, history.view(_).copy()) for _ in plot['values'][1:]]
+
+    return dict(plot), x, ys
+
+
+def render(plot, x, ys):
+    """Render the plot of ys, list of (name, values) pairs, versus x, and return PNG data"""
+    has_data = False
+
+    fig = Figure(facecolor='white', dpi=72, figsize=(plot['width']/72, plot['height']/72), tight_layout=True)
+    ax = fig.add_subplot(111)
+
+    for name, y in ys:
+        # Check whether we have at least one data point to plot
+        if np.any(np.isfinite(y)):
+            has_data = True
+            ax.plot(x, y, '-', label=name)
+
+    if plot['values'][0] == 'time' and len(x) > 1 and has_data:
+        ax.xaxis.set_major_formatter(DateFormatter('%H:%M:%S'))
+        fig.autofmt_xdate()
+
+    if plot['xlabel']:
+        ax.set_xlabel(plot['xlabel'])
+    else:
+        ax.set_xlabel(plot['values'][0])
+
+    if plot['ylabel']:
+        ax.set_ylabel(plot['ylabel'])
+    elif len(plot['values']) == 1:
+        ax.set_ylabel(plot['values'][1])
+
+    if has_data:
+        if plot['xscale'] != 'linear':
+            ax.set_xscale(plot['xscale'], nonposx='clip')
+
+        if plot['yscale'] != 'linear':
+            ax.set_yscale(plot['yscale'], nonpositive='clip')
+
+            if plot['yscale'] == 'log':
+                # Try to fix the ticks if the data span is too small
+                axis = ax.get_yaxis()
+                if np.ptp(np.log10(axis.get_data_interval())) < 1:
+                    axis.set_major_locator(MaxNLocator())
+                    axis.set_minor_locator(NullLocator())
+
+        if len(plot['values']) > 4:
+            ax.legend(frameon=True, loc=2, framealpha=0.99)
+        elif len(plot['values']) > 2:
+            ax.legend(frameon=False)
+
+    if plot['name']:
+        ax.set_title(plot['name'])
+    ax.margins(0.01, 0.1)
+
+    # FIXME: make it configurable
+    ax.grid(True)
+
+    # Return the image
+    s = BytesIO()
+    canvas = FigureCanvas(fig)
+    canvas.print_png(s)#, bbox_inches='tight')
+
+    return s.getvalue()
@@ -0,0 +1,211 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Runtime profiling of a live daemon, controlled by 'profile' command:
+#   profile start [mode=sample|cprofile] [interval=0.005] - start collecting
+#   profile stop - stop collecting, keeping the data
+#   profile report [top=30] - write the report to a file in temporary directory (and console), reply with its path
+#   profile reset - drop collected data, including the timings of @catch wrapped functions
+#   profile - just reply with current state
+# 'sample' mode periodically looks at the reactor thread stack from a separate thread, and is cheap
+# enough to be used under real load; 'cprofile' mode traces every call with cProfile.
+
+import os
+import sys
+import time
+import threading
+import tempfile
+
+import metrics
+
+
+class Profiler(object):
+    """Process-wide profiler, either deterministic (cProfile) or statistical (stack sampling)"""
+
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+
+        return cls._instance
+
+    def __init__(self):
+        self.mode = None
+        self.running = False
+        self.started = None
+        self.duration = 0
+
+        self._profile = None
+
+        self._thread = None
+        self._target = None  # Identifier of the thread being sampled
+        self.interval = 0.005
+        self.samples = 0
+        self._self_counts = {}  # (file, line, function) -> number of samples where it was on top of the stack
+        self._total_counts = {}  # (file, line, function) -> number of samples where it was anywhere in the stack
+        self._lock = threading.Lock()  # Protects the counts, updated from the sampler thread
+
+    def start(self, mode='sample', interval=None):
+        """Start profiling the calling thread, normally the reactor one"""
+        if self.running:
+            self.stop()
+
+        if mode != self.mode:
+            self.reset()
+
+        self.mode = mode
+        self.running = True
+        self.started = time.time()
+
+        if interval:
+            self.interval = interval
+
+        if mode == 'cprofile':
+            import cProfile
+            if self._profile is None:
+                self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._target = threading.current_thread().ident
+            self._thread = threading.Thread(target=self._sample, name='profiler-sampler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+
+        self.running = False
+        self.duration += time.time() - self.started
+
+        if self.mode == 'cprofile':
+            self._profile.disable()
+        elif self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        """Drop all collected data"""
+        running, mode = self.running, self.mode
+        self.stop()
+
+        self._profile = None
+        with self._lock:
+            self.samples = 0
+            self._self_counts = {}
+            self._total_counts = {}
+        self.duration = 0
+
+        for stats in metrics.functions.values():
+            stats.reset()
+
+        if running:
+            self.start(mode)
+
+    def _sample(self):
+        # Runs in the sampler thread
+        while self.running:
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                top = (frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name)
+
+                # Recursive calls are counted once per sample
+                stack = set()
+                while frame is not None:
+                    stack.add((frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name))
+                    frame = frame.f_back
+
+                del frame
+
+                with self._lock:
+                    self.samples += 1
+                    self._self_counts[top] = self._self_counts.get(top, 0) + 1
+                    for key in stack:
+                        self._total_counts[key] = self._total_counts.get(key, 0) + 1
+
+            time.sleep(self.interval)
+
+    def state(self):
+        """Short summary of the profiler state"""
+        duration = self.duration + (time.time() - self.started if self.running else 0)
+
+        return {'state': 'running' if self.running else 'stopped',
+                'mode': self.mode or 'none',
+                'duration': duration,
+                'samples': self.samples}
+
+    def report(self, top=30):
+        """Text report of the hottest functions, along with the timings of @catch wrapped ones"""
+        lines = []
+
+        state = self.state()
+        lines.append('Profile: mode=%s state=%s duration=%.1f s' % (state['mode'], state['state'], state['duration']))
+
+        if self.mode == 'cprofile' and self._profile is not None:
+            import pstats
+            try:
+                from StringIO import StringIO
+            except ImportError:
+                from io import StringIO
+
+            s = StringIO()
+            pstats.Stats(self._profile, stream=s).sort_stats('cumulative').print_stats(top)
+            lines.append(s.getvalue())
+        else:
+            # Copies, as the sampler thread may be updating them meanwhile
+            with self._lock:
+                samples = self.samples
+                self_counts = dict(self._self_counts)
+                total_counts = dict(self._total_counts)
+
+            if samples:
+                lines.append('%d samples every %g s' % (samples, self.interval))
+                lines.append('')
+                lines.append('%8s %8s  %s' % ('self %', 'total %', 'function'))
+
+                for key, count in sorted(total_counts.items(), key=lambda _: -_[1])[:top]:
+                    filename, line, name = key
+                    lines.append('%8.1f %8.1f  %s (%s:%d)' % (100.0*self_counts.get(key, 0)/samples, 100.0*count/samples,
+                                                              name, os.path.basename(filename), line))
+
+        lines.append('')
+        lines.append('%-60s %8s %6s %10s %10s %10s %10s' % ('@catch function', 'calls', 'errors', 'total s', 'mean ms', 'p99 ms', 'max ms'))
+
+        for name, stats in sorted(metrics.functions.items(), key=lambda _: -_[1].total)[:top]:
+            if stats.count:
+                lines.append('%-60s %8d %6d %10.3f %10.3f %10.3f %10.3f' % (name, stats.count, stats.errors, stats.total,
+                                                                           1e3*stats.total/stats.count, 1e3*stats.quantile(0.99), 1e3*stats.max))
+
+        return '\n'.join(lines) + '\n'
+
+
+def command(cmd, name='daemon'):
+    """Handle 'profile' command, returning the dict with the reply values"""
+    prof = Profiler.instance()
+
+    action = cmd.args[0] if cmd.args else 'state'
+    result = {}
+
+    if action == 'start':
+        prof.start(mode=cmd.get('mode', 'sample'), interval=float(cmd.get('interval', 0)))
+    elif action == 'stop':
+        prof.stop()
+    elif action == 'reset':
+        prof.reset()
+    elif action == 'report':
+        # Fixed location only, as the command may come from any network peer
+        filename = os.path.join(tempfile.gettempdir(), '%s-profile-%s.txt' % (os.path.basename(name or 'daemon'),
+                                                                             time.strftime('%Y%m%d-%H%M%S')))
+
+        report = prof.report(top=int(cmd.get('top', 30)))
+        print(report)
+
+        with open(filename, 'w') as f:
+            f.write(report)
+
+        result['file'] = filename
+
+    result.update(prof.state())
+
+    return result
@@ -0,0 +1,110 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Selection of Twisted reactor implementation, and helpers for writing handlers as coroutines.
+#
+# The reactor is chosen by CCDLAB_REACTOR environment variable:
+#   default - whatever Twisted considers best for the platform (epoll on Linux)
+#   asyncio - asyncioreactor on top of standard asyncio event loop
+#   uvloop  - asyncioreactor on top of uvloop, falling back to asyncio if it is not installed
+# It has to be installed before anything imports twisted.internet.reactor, so daemon.py does it
+# on import, and the scripts importing reactor directly should call install() first.
+
+import os
+import sys
+import functools
+
+
+def install(name=None):
+    """Install the reactor requested by name or CCDLAB_REACTOR environment variable, return its actual name"""
+    if name is None:
+        name = os.environ.get('CCDLAB_REACTOR', 'default')
+
+    if 'twisted.internet.reactor' in sys.modules:
+        # Too late, something has already installed the reactor
+        return current()
+
+    if name not in ['asyncio', 'uvloop']:
+        # Default one will be installed by whoever imports it first
+        return 'default'
+
+    import asyncio
+
+    loop = None
+    if name == 'uvloop':
+        try:
+            import uvloop
+            loop = uvloop.new_event_loop()
+        except ImportError:
+            print("uvloop is not installed, using plain asyncio event loop")
+
+    if loop is None:
+        loop = asyncio.new_event_loop()
+
+    asyncio.set_event_loop(loop)
+
+    from twisted.internet import asyncioreactor
+    asyncioreactor.install(loop)
+
+    return current()
+
+
+def current():
+    """Name of the reactor actually running: default, asyncio or uvloop"""
+    from twisted.internet import reactor
+
+    loop = getattr(reactor, '_asyncioEventloop', None)
+    if loop is None:
+        return 'default'
+    elif type(loop).__module__.startswith('uvloop'):
+        return 'uvloop'
+    else:
+        return 'asyncio'
+
+
+def isAsyncio():
+    return current() != 'default'
+
+
+def toDeferred(coro):
+    """Run the coroutine and return the Deferred firing with its result"""
+    from twisted.internet.defer import Deferred, ensureDeferred
+
+    if isAsyncio():
+        # Coroutine may await both asyncio futures and Deferreds
+        import asyncio
+        return Deferred.fromFuture(asyncio.ensure_future(coro))
+    else:
+        # Coroutine may await Deferreds only
+        return ensureDeferred(coro)
+
+
+def toFuture(d):
+    """Convert the Deferred into asyncio future, so that it may be awaited in asyncio code"""
+    import asyncio
+
+    return d.asFuture(asyncio.get_event_loop())
+
+
+def asyncHandler(func):
+    """
+    Decorator turning 'async def' handler (like processMessage or update) into the normal function
+    running the coroutine in the reactor and returning the Deferred. Errors are printed like with catch.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        def errback(failure):
+            failure.printTraceback()
+
+        d = toDeferred(func(*args, **kwargs))
+        d.addErrback(errback)
+
+        return d
+
+    return wrapper
+
+
+def sleep(seconds):
+    """Awaitable delay, usable in coroutines with any reactor"""
+    from twisted.internet import reactor, task
+
+    return task.deferLater(reactor, seconds, lambda: None)
@@ -0,0 +1,185 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import heapq
+import itertools
+import random
+import time
+
+
+class PeriodicTask(object):
+    """Single periodic task registered in PollScheduler"""
+
+    def __init__(self, scheduler, func, period, jitter=0):
+        self.scheduler = scheduler
+        self.func = func
+        self.period = period
+        self.jitter = jitter
+        self.running = True
+
+        self._deadline = 0  # Nominal time of the next call, without jitter
+
+        # Statistics
+        self.calls = 0
+        self.errors = 0
+        self.overruns = 0  # Number of periods missed because of late calls or slow tasks
+        self.max_lateness = 0
+        self.max_duration = 0
+
+    def stop(self, *args):
+        """Stop the task. Extra arguments are ignored for compatibility with LoopingCall.stop() uses"""
+        if self.running:
+            self.running = False
+            self.scheduler._ntasks -= 1
+
+
+class PollScheduler(object):
+    """
+    Shared scheduler for periodic tasks (like protocol update() methods).
+    All tasks are kept in a heap ordered by their next call time, and a single
+    reactor timer is used to fire the earliest ones, so the cost does not grow
+    with the number of tasks. First calls are spread randomly over the period
+    (but no more than _max_phase seconds, so that slow tasks still start soon)
+    so that the tasks with equal periods do not fire in lockstep.
+    """
+
+    _instances = {}
+
+    # Tasks due within this interval from now are fired in the same timer call
+    _tolerance = 0.001
+
+    # Upper limit for the default random delay of the first call
+    _max_phase = 1.0
+
+    @classmethod
+    def forReactor(cls, reactor=None):
+        """Get the scheduler shared by everybody using the given reactor"""
+        if reactor is None:
+            from twisted.internet import reactor
+
+        if reactor not in cls._instances:
+            cls._instances[reactor] = cls(reactor)
+
+        return cls._instances[reactor]
+
+    def __init__(self, reactor, jitter=0):
+        self._reactor = reactor
+        self._jitter = jitter  # Default per-call jitter, as a fraction of period
+
+        self._heap = []
+        self._counter = itertools.count()  # Tie-breaker for tasks with equal times
+        self._timer = None
+        self._in_run = False
+        self._ntasks = 0
+
+        self.ticks = 0  # Number of timer calls
+
+    def add(self, func, period, phase=None, jitter=None):
+        """
+        Register func to be called every _period_ seconds. First call happens after _phase_
+        seconds, random between 0 and _period_ (or _max_phase) by default. If _jitter_ is set, every call
+        is delayed by a random amount up to _jitter_*_period_, without accumulating the drift.
+        Returns PeriodicTask object which may be used to stop the calls.
+        """
+        if not period > 0:
+            raise ValueError('Period should be positive, got %r' % (period,))
+
+        task = PeriodicTask(self, func, period, jitter=self._jitter if jitter is None else jitter)
+
+        if phase is None:
+            phase = random.uniform(0, min(period, self._max_phase))
+
+        task._deadline = self._reactor.seconds() + phase
+        self._push(task)
+        self._ntasks += 1
+
+        if not self._in_run:
+            self._reschedule()
+
+        return task
+
+    def _push(self, task):
+        when = task._deadline
+        if task.jitter:
+            when += random.uniform(0, task.jitter*task.period)
+
+        heapq.heappush(self._heap, (when, next(self._counter), task))
+
+    def _reschedule(self):
+        # Drop stopped tasks from the top of the heap
+        while self._heap and not self._heap[0][2].running:
+            heapq.heappop(self._heap)
+
+        if not self._heap:
+            if self._timer is not None and self._timer.active():
+                self._timer.cancel()
+            self._timer = None
+            return
+
+        when = self._heap[0][0]
+
+        if self._timer is not None and self._timer.active():
+            if self._timer.getTime() <= when:
+                return
+            self._timer.cancel()
+
+        self._timer = self._reactor.callLater(max(0, when - self._reactor.seconds()), self._run)
+
+    def _run(self):
+        self._timer = None
+        self._in_run = True
+        self.ticks += 1
+
+        try:
+            now = self._reactor.seconds()
+
+            while self._heap and self._heap[0][0] <= now + self._tolerance:
+                when, _, task = heapq.heappop(self._heap)
+
+                if not task.running:
+                    continue
+
+                lateness = max(0, now - when)
+                task.max_lateness = max(task.max_lateness, lateness)
+
+                t0 = time.perf_counter()
+                try:
+                    task.calls += 1
+                    task.func()
+                except:
+                    task.errors += 1
+                    import traceback
+                    traceback.print_exc()
+                duration = time.perf_counter() - t0
+                task.max_duration = max(task.max_duration, duration)
+
+                if not task.running:
+                    continue
+
+                # Next deadline on the same phase grid, skipping the periods we have missed
+                now = self._reactor.seconds()
+                task._deadline += task.period
+                if task._deadline <= now:
+                    missed = int((now - task._deadline) // task.period) + 1
+                    task.overruns += missed
+                    task._deadline += missed*task.period
+
+                self._push(task)
+        finally:
+            self._in_run = False
+            self._reschedule()
+
+    def stats(self):
+        """Summary statistics over all active tasks"""
+        tasks = [_[2] for _ in self._heap if _[2].running]
+
+        return {'tasks': self._ntasks,
+                'ticks': self.ticks,
+                'calls': sum(_.calls for _ in tasks),
+                'errors': sum(_.errors for _ in tasks),
+                'overruns': sum(_.overruns for _ in tasks),
+                'max_lateness': max([_.max_lateness for _ in tasks] or [0]),
+                'max_duration': max([_.max_duration for _ in tasks] or [0])}
+
+    def metrics(self):
+        """Same statistics with the names prefixed for the metrics registry"""
+        return {'scheduler_' + key: value for key, value in self.stats().items()}
@@ -2,7 +2,8 @@
 from optparse import OptionParser
 from libscrc import modbus
 
-from daemon import SimpleFactory, SimpleProtocol, SerialUSBProtocol, catch
+from daemon import SimpleFactory, SimpleProtocol, catch
+from daemon_usb import SerialUSBProtocol
 
 
 class DaemonProtocol(SimpleProtocol):
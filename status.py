@@ -0,0 +1,115 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Versioned daemon status for delta-encoded status replies.
+# The peer asks for 'get_status delta=<version>' with the last version it has seen, and gets
+# only the values changed since then, along with _version=<current version> and _full=0.
+# Full snapshot (_full=1) is sent when asked with delta=0, or when the peer version is unknown,
+# or when some values were removed since it, as removals can't be expressed as key=value pairs.
+#
+# Alternatively, the peer may subscribe to status updates with
+#   subscribe_status [min_interval=0.1] [heartbeat=10] [deadband=0] [deadband.<key>=<value> ...]
+# and then the daemon checks its status every min_interval seconds and pushes the values changed by
+# more than the deadband, or just the version every heartbeat seconds if nothing changes.
+
+
+class StatusTracker(object):
+    """Status dict remembering the version of the last change of every value"""
+
+    def __init__(self):
+        self.values = {}
+        self.version = 0
+        self._versions = {}  # key -> version of its last change
+        self._removed = 0  # Version of the last removal of any key
+
+    def update(self, status, replace=True):
+        """Merge new values, dropping the missing ones if replace is set. Return the list of changed keys"""
+        changed = [key for key, value in status.items() if key not in self.values or self.values[key] != value]
+        removed = [key for key in self.values if key not in status] if replace else []
+
+        if changed or removed:
+            self.version += 1
+
+            for key in changed:
+                self.values[key] = status[key]
+                self._versions[key] = self.version
+
+            if removed:
+                for key in removed:
+                    del self.values[key]
+                    del self._versions[key]
+                self._removed = self.version
+
+        return changed
+
+    def delta(self, since=0):
+        """Values changed after given version, along with the flag whether it is a full snapshot"""
+        if not since or since > self.version or since < self._removed:
+            return dict(self.values), True
+
+        return {key: self.values[key] for key, version in self._versions.items() if version > since}, False
+
+
+def _number(value):
+    """Numerical form of the status value, or None"""
+    if isinstance(value, bool):
+        return None
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class StatusSubscription(object):
+    """
+    Status push settings of a single subscribed peer, deciding which values are worth sending.
+    Numerical values are sent only when they move by more than the deadband from the last sent
+    ones, and something is sent at least every heartbeat seconds, even if nothing changed
+    """
+
+    def __init__(self, min_interval=0.1, heartbeat=10.0, deadband=0, deadbands=None):
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+        self.deadband = deadband  # Default for all numerical values
+        self.deadbands = deadbands or {}  # Per-key ones
+
+        self.sent = {}  # Values as they were last sent
+        self.last = None  # Time of the last push
+
+        self.pushes = 0
+        self.suppressed = 0  # Number of changes hidden by deadbands
+
+    def changes(self, status, now):
+        """Values to be pushed now and whether it is a full snapshot, or None if nothing should be sent"""
+        if self.last is None or any(key not in status for key in self.sent):
+            # First push, or some values are gone
+            changed, full = dict(status), True
+        else:
+            changed, full = {}, False
+
+            for key, value in status.items():
+                if key in self.sent:
+                    old = self.sent[key]
+                    if value == old:
+                        continue
+
+                    band = self.deadbands.get(key, self.deadband)
+                    if band:
+                        new, old = _number(value), _number(old)
+                        if new is not None and old is not None and abs(new - old) < band:
+                            self.suppressed += 1
+                            continue
+
+                changed[key] = value
+
+            if not changed and now - self.last < self.heartbeat:
+                return None
+
+        if full:
+            self.sent = dict(status)
+        else:
+            self.sent.update(changed)
+        self.last = now
+        self.pushes += 1
+
+        return changed, full
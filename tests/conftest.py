@@ -0,0 +1,96 @@
+import os
+import sys
+
+import pytest
+
+# Modules live at the top level of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+class FakeSocket(object):
+    def setsockopt(self, *args):
+        pass
+
+
+class FakeTransport(object):
+    """In-memory transport collecting the written data"""
+
+    def __init__(self, port):
+        self.port = port
+        self.written = []
+        self.connected = True
+        self.disconnecting = False
+        self.producer = None
+
+    def write(self, data):
+        self.written.append(data)
+
+    def writeSequence(self, data):
+        self.written.extend(data)
+
+    def take(self):
+        data, self.written = b''.join(self.written), []
+        return data
+
+    def getPeer(self):
+        from twisted.internet.address import IPv4Address
+        return IPv4Address('TCP', '127.0.0.1', self.port)
+
+    def getHandle(self):
+        return FakeSocket()
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+        if self.disconnecting:
+            self.connected = False
+
+    def loseConnection(self):
+        # Same as Twisted, the connection is kept while the producer is registered
+        self.disconnecting = True
+        if self.producer is None:
+            self.connected = False
+
+    def abortConnection(self):
+        self.connected = False
+
+
+class Pair(object):
+    """Two protocols from given factories connected to each other in memory"""
+
+    def __init__(self, factory1, factory2):
+        self.protocols = (factory1.buildProtocol(None), factory2.buildProtocol(None))
+        self.transports = (FakeTransport(1), FakeTransport(2))
+
+        for p, t in zip(self.protocols, self.transports):
+            p.makeConnection(t)
+
+    def pump(self, limit=100):
+        """Deliver the data both ways until nothing is sent, return the number of rounds, or None if it never stops"""
+        for rounds in range(limit):
+            data = [t.take() for t in self.transports]
+            if not any(data):
+                return rounds
+
+            for p, d in zip(reversed(self.protocols), data):
+                if d:
+                    p.dataReceived(d)
+
+        return None
+
+    def disconnect(self):
+        from twisted.python.failure import Failure
+        from twisted.internet.error import ConnectionDone
+
+        for p, t in zip(self.protocols, self.transports):
+            if t.connected:
+                t.connected = False
+                p.connectionLost(Failure(ConnectionDone()))
+
+
+@pytest.fixture
+def reactor():
+    from twisted.internet.testing import MemoryReactorClock
+    return MemoryReactorClock()
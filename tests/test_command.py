@@ -0,0 +1,71 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+import shlex
+
+import pytest
+
+from command import Command, tokenize
+
+
+def shlexOrError(string):
+    try:
+        return shlex.split(string)
+    except ValueError:
+        return ValueError
+
+
+def tokenizeOrError(string):
+    try:
+        return tokenize(string)
+    except ValueError:
+        return ValueError
+
+
+@pytest.mark.parametrize('string', [
+    '',
+    '   ',
+    'get_status',
+    'set  a=1\tb=2 ',
+    'set name="some value" other=\'single quoted\'',
+    'set path="C:\\\\dir\\\\file" quote="say \\"hi\\""',
+    "set a='back\\slash' b=\"\" c=''",
+    'set a=x"y z"w b=\\ c',
+    'message text="unclosed',
+    "message text='unclosed",
+    'message trailing\\',
+    'set a=1\x0bb=2 c=\xa0d',
+    'set a=1\u2003b=2',
+    'set key.sub="1 2" key.other=3',
+])
+def test_tokenize_like_shlex(string):
+    assert tokenizeOrError(string) == shlexOrError(string)
+
+
+def test_tokenize_random():
+    rng = random.Random(1)
+    alphabet = ['a', 'b', '=', ' ', '\t', '"', "'", '\\', '\n', '\xa0', '.']
+
+    for _ in range(5000):
+        string = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        assert tokenizeOrError(string) == shlexOrError(string), repr(string)
+
+
+def test_tokenize_cache():
+    result = tokenize('set a=1 b=2')
+    result.append('modified')
+
+    # Cached results are not affected by the modifications of returned lists
+    assert tokenize('set a=1 b=2') == ['set', 'a=1', 'b=2']
+
+    long = 'set ' + ' '.join('k%d=%d' % (_, _) for _ in range(30))
+    assert tokenize(long) == shlex.split(long)
+
+
+def test_command():
+    cmd = Command('set a=1 name="x y" flag')
+
+    assert cmd.name == 'set'
+    assert cmd.args == ['flag']
+    assert cmd.kwargs == {'a': '1', 'name': 'x y'}
+    assert 'name' in cmd and 'other' not in cmd
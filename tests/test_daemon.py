@@ -0,0 +1,263 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from daemon import SimpleFactory, SimpleProtocol
+
+from conftest import Pair
+
+
+def test_profile_reply_is_not_answered(reactor):
+    factory1 = SimpleFactory(SimpleProtocol, {}, reactor=reactor, name='one')
+    factory2 = SimpleFactory(SimpleProtocol, {}, reactor=reactor, name='two')
+    pair = Pair(factory1, factory2)
+
+    pair.protocols[0].message('profile')
+    rounds = pair.pump()
+
+    assert rounds is not None and rounds <= 2
+    assert pair.protocols[0].messages_in == 1
+    assert pair.protocols[1].messages_in == 1
+
+    pair.disconnect()
+
+
+def test_command_queue_priority(reactor):
+    from daemon import CommandQueue
+
+    factory = SimpleFactory(SimpleProtocol, {}, reactor=reactor)
+    pair = Pair(factory, SimpleFactory(SimpleProtocol, {}, reactor=reactor))
+    protocol, transport = pair.protocols[0], pair.transports[0]
+
+    queue = CommandQueue(protocol, depth=1)
+    for cmd in [b'V1?', b'I1?']:
+        queue.add(cmd)
+    queue.add(b'V2?', source='client')
+    queue.add(b'EER?', source='client', priority=True)
+
+    order = []
+    while queue.current() is not None:
+        order.append(queue.current()['cmd'])
+        queue.reply('0')
+
+    assert order == [b'V1?', b'EER?', b'V2?', b'I1?']
+    assert transport.take() == b'V1?\nEER?\nV2?\nI1?\n'
+
+    pair.disconnect()
+
+
+def test_malformed_status_delta(reactor):
+    class Protocol(SimpleProtocol):
+        _status_delta = True
+
+        def processMessage(self, string):
+            cmd = SimpleProtocol.processMessage(self, string)
+            if cmd and cmd.name == 'get_status':
+                self.sendStatus({'a': 1, 'b': 2})
+
+    factory = SimpleFactory(Protocol, {}, reactor=reactor)
+    pair = Pair(factory, SimpleFactory(SimpleProtocol, {}, reactor=reactor))
+    protocol, transport = pair.protocols[0], pair.transports[0]
+
+    protocol.processMessage('get_status delta=1')
+    protocol.processMessage('get_status delta=1')
+    transport.take()
+
+    # Malformed version falls back to the full snapshot
+    protocol.processMessage('get_status delta=abc')
+    reply = transport.take()
+    assert b'_full=1' in reply and b'a=1' in reply and b'b=2' in reply
+
+    pair.disconnect()
+
+
+def test_stop_closes_paused_connection(reactor):
+    factory = SimpleFactory(SimpleProtocol, {}, reactor=reactor)
+    pair = Pair(factory, SimpleFactory(SimpleProtocol, {}, reactor=reactor))
+    protocol, transport = pair.protocols[0], pair.transports[0]
+
+    # Stalled peer, nothing queued yet
+    protocol.pauseProducing()
+    factory.stop()
+
+    assert transport.producer is None
+    assert not transport.connected
+
+
+def test_output_overflow_disconnects(reactor):
+    class Protocol(SimpleProtocol):
+        _output_policy = 'disconnect'
+        _output_high_water = 100
+
+    factory = SimpleFactory(Protocol, {}, reactor=reactor)
+    pair = Pair(factory, SimpleFactory(SimpleProtocol, {}, reactor=reactor))
+    protocol, transport = pair.protocols[0], pair.transports[0]
+
+    protocol.pauseProducing()
+    for i in range(20):
+        protocol.message('status value=%d' % i)
+
+    assert transport.producer is None
+    assert not transport.connected
+    assert protocol.dropped_messages > 0
+
+
+def makeQueue(reactor, **kwargs):
+    from daemon import CommandQueue
+
+    factory = SimpleFactory(SimpleProtocol, {}, reactor=reactor)
+    pair = Pair(factory, SimpleFactory(SimpleProtocol, {}, reactor=reactor))
+    pair.transports[0].take()
+
+    return CommandQueue(pair.protocols[0], **kwargs), pair.transports[0]
+
+
+def test_command_queue_pipelining(reactor):
+    queue, transport = makeQueue(reactor, depth=2)
+
+    results = []
+    for cmd in [b'V1?', b'I1?', b'V2?']:
+        queue.add(cmd).addCallback(lambda reply, cmd=cmd: results.append((cmd, reply)))
+
+    # Only depth commands are sent before the replies
+    assert transport.take() == b'V1?\nI1?\n'
+
+    queue.reply('1.0')
+    assert transport.take() == b'V2?\n'
+    queue.reply('0.1')
+    queue.reply('2.0')
+
+    assert results == [(b'V1?', '1.0'), (b'I1?', '0.1'), (b'V2?', '2.0')]
+    assert queue.reply('extra') is None
+    assert queue.discarded == 1
+    assert len(queue) == 0
+
+
+def test_command_queue_timeout(reactor):
+    from daemon import CommandTimeout
+
+    queue, transport = makeQueue(reactor, depth=1, timeout=1.0, retries=0)
+
+    failures = []
+    queue.add(b'V1?').addErrback(failures.append)
+    assert transport.take() == b'V1?\n'
+
+    reactor.advance(1.1)
+    assert len(failures) == 1 and failures[0].check(CommandTimeout)
+    assert queue.timeouts == 1 and queue.failed == 1
+    assert len(queue) == 0
+
+
+def test_command_queue_retry_and_late_reply(reactor):
+    queue, transport = makeQueue(reactor, depth=2, timeout=1.0, retries=1)
+
+    results = []
+    for cmd in [b'V1?', b'I1?', b'V2?']:
+        queue.add(cmd).addCallback(lambda reply, cmd=cmd: results.append((cmd, reply)))
+    assert transport.take() == b'V1?\nI1?\n'
+
+    # No reply in time, nothing is sent while waiting for the late replies
+    reactor.advance(1.1)
+    assert transport.take() == b''
+    assert queue.timeouts == 1
+
+    # Late replies to both commands in flight are discarded, not matched to the re-sent ones
+    assert queue.reply('1.0') is None
+    assert queue.reply('0.1') is None
+    assert queue.discarded == 2
+
+    # Both are re-sent in the original order
+    reactor.advance(1.0)
+    assert transport.take() == b'V1?\nI1?\n'
+    assert queue.resent == 2
+
+    queue.reply('1.5')
+    queue.reply('0.2')
+    queue.reply('2.5')
+    assert transport.take() == b'V2?\n'
+
+    assert results == [(b'V1?', '1.5'), (b'I1?', '0.2'), (b'V2?', '2.5')]
+    assert queue.failed == 0
+    assert len(queue) == 0
+
+    # No more timers left
+    reactor.advance(10)
+    assert queue.timeouts == 1
+
+
+def test_metrics_per_factory(reactor):
+    class HWProtocol(SimpleProtocol):
+        pass
+
+    daemon = SimpleFactory(SimpleProtocol, {}, reactor=reactor, name='daemon')
+    hw = SimpleFactory(HWProtocol, {}, reactor=reactor)
+    pair1 = Pair(daemon, SimpleFactory(SimpleProtocol, {}, reactor=reactor, name='peer'))
+    pair2 = Pair(hw, SimpleFactory(SimpleProtocol, {}, reactor=reactor, name='device'))
+
+    pair1.protocols[0].message('hello')
+    snapshot = daemon.metrics.snapshot()
+
+    # Connections of both factories have the same default names, but do not overwrite each other
+    assert pair1.protocols[0].name == pair2.protocols[0].name
+    assert snapshot['daemon.%s.messages_out' % pair1.protocols[0].name] == 1
+    assert snapshot['HWProtocol.%s.messages_out' % pair2.protocols[0].name] == 0
+
+    # Shared scheduler is reported once
+    assert daemon.metrics._sources.count(daemon.scheduler.metrics) == 1
+    assert 'scheduler_tasks' in snapshot
+
+    daemon.stop()
+    assert daemon.getMetrics not in daemon.metrics._sources
+    assert hw.getMetrics in daemon.metrics._sources
+
+    pair1.disconnect()
+    pair2.disconnect()
+
+
+def test_connection_index(reactor):
+    class Protocol(SimpleProtocol):
+        addr = property(lambda self: self.__dict__.get('_addr'), lambda self, value: self._setIndexed('addr', value))
+
+    factory = SimpleFactory(Protocol, {}, reactor=reactor)
+    pairs = [Pair(factory, SimpleFactory(SimpleProtocol, {}, reactor=reactor)) for _ in range(3)]
+    c1, c2, c3 = [_.protocols[0] for _ in pairs]
+
+    assert factory.findConnection(name=c1.name) is c1
+
+    # Renaming by peer identification updates the index
+    old = c1.name
+    c1.processMessage('id name=ccd type=camera')
+    c2.setName('ccd', 'camera')
+    c3.setName('mount', 'camera')
+
+    assert factory.findConnection(name=old) is None
+    assert factory.findConnections(name='ccd') == [c1, c2]
+    assert sorted(_.name for _ in factory.findConnections(type='camera')) == ['ccd', 'ccd', 'mount']
+    assert factory.findConnections(name='mount', type='camera') == [c3]
+    assert factory.findConnections(name='mount', type='other') == []
+    assert 'ccd' in factory.indexValues('name') and old not in factory.indexValues('name')
+
+    # Other indexed attributes
+    c1.addr = 5
+    c2.addr = 7
+    assert factory.findConnections(addr=5) == [c1]
+    c1.addr = 7
+    assert factory.findConnections(addr=5) == []
+    assert factory.findConnections(name='ccd', addr=7) == [c1, c2]
+
+    # Messages are routed by the index
+    for _ in pairs:
+        _.transports[0].take()
+    factory.messageAll('hello', name='ccd')
+    assert [_.transports[0].take() for _ in pairs] == [b'hello\n', b'hello\n', b'']
+
+    # Disconnected ones are dropped from the index
+    pairs[0].disconnect()
+    assert factory.findConnections(name='ccd') == [c2]
+    assert factory.findConnections(addr=7) == [c2]
+
+    # Renaming of disconnected connection does not bring it back
+    c1.name = 'mount'
+    assert factory.findConnections(name='mount') == [c3]
+
+    for _ in pairs[1:]:
+        _.disconnect()
+    assert factory.indexValues('name') == []
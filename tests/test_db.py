@@ -0,0 +1,97 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import time
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+from db import DB, DBWriter
+
+
+def test_lazy_connection_database_down(tmp_path, monkeypatch):
+    attempts = []
+
+    def connect(connstring):
+        attempts.append(connstring)
+        raise psycopg2.OperationalError('database is down')
+
+    monkeypatch.setattr(psycopg2, 'connect', connect)
+
+    # No connection attempts until the first insert
+    db = DB(dbhost='nowhere', lazy=True)
+    assert not attempts
+
+    writer = DBWriter(db, spill=str(tmp_path / 'spill'), retry=0.01, max_retry=0.01)
+    writer.insert('log', ('message',), ('test',))
+
+    for _ in range(100):
+        if writer.errors >= 2:
+            break
+        time.sleep(0.01)
+
+    writer.stop()
+
+    assert len(attempts) >= 2
+    assert writer.errors >= 2
+    assert writer.spilled == 1
+
+
+def test_overflow_spilled_by_writer_thread(tmp_path):
+    import threading
+
+    class FakeDB(object):
+        down = True
+        rows = []
+
+        def insert_rows(self, table, columns, rows):
+            if self.down:
+                raise psycopg2.OperationalError('database is down')
+            self.rows.extend(rows)
+
+        def close(self):
+            pass
+
+    db = FakeDB()
+    writer = DBWriter(db, spill=str(tmp_path / 'spill'), max_queue=2, batch=2, retry=0.01, max_retry=0.01)
+
+    spill = writer._spill
+    threads = []
+
+    def recordSpill(rows):
+        threads.append(threading.current_thread())
+        spill(rows)
+
+    writer._spill = recordSpill
+
+    # First batch is being retried by the thread
+    for i in range(2):
+        writer.insert('test', ('value',), (i,))
+
+    for _ in range(100):
+        if writer.errors:
+            break
+        time.sleep(0.01)
+
+    # Next two fill the queue, the rest overflow it
+    for i in range(2, 6):
+        writer.insert('test', ('value',), (i,))
+
+    for _ in range(100):
+        if writer.spilled == 2:
+            break
+        time.sleep(0.01)
+
+    assert writer.spilled == 2
+    assert threads and threading.current_thread() not in threads
+
+    db.down = False
+    for _ in range(200):
+        if writer.written == 6:
+            break
+        time.sleep(0.01)
+
+    writer.stop()
+
+    assert sorted(db.rows) == [(i,) for i in range(6)]
+    assert writer.dropped == 0
@@ -0,0 +1,106 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from daemon import SimpleFactory, SimpleProtocol
+
+from conftest import Pair
+
+
+def test_archon_status(reactor):
+    import archon
+
+    obj = {'hw_connected': 0, 'status': {}, 'global': {}}
+    daemon = SimpleFactory(archon.DaemonProtocol, obj, reactor=reactor, name='archon')
+    hw = SimpleFactory(archon.ArchonProtocol, obj, reactor=reactor)
+    obj['daemon'] = daemon
+    obj['hw'] = hw
+
+    controller = SimpleFactory(SimpleProtocol, {}, reactor=reactor)
+    hwpair = Pair(hw, controller)
+    archonp, hwtransport = hwpair.protocols[0], hwpair.transports[0]
+    assert hwtransport.take() == b'>00SYSTEM\n'
+
+    archonp.update()
+    assert hwtransport.take() == b'>01STATUS\n>02FRAME\n'
+
+    archonp.processMessage('<01POWER=4 LOG=0 SUPPLY/V=5.0')
+    assert obj['status']['POWER'] == 'On'
+    assert obj['status']['SUPPLY_V'] == '5.0'
+
+    # Delta-encoded status for the monitor
+    client = SimpleFactory(SimpleProtocol, {}, reactor=reactor)
+    pair = Pair(daemon, client)
+    daemonp, transport = pair.protocols[0], pair.transports[0]
+    transport.take()
+
+    daemonp.processMessage('get_status delta=0')
+    reply = transport.take()
+    assert reply.startswith(b'status ')
+    assert b'_full=1' in reply and b'POWER=On' in reply and b'hw_connected=1' in reply
+
+    # Pushed status
+    daemonp.processMessage('subscribe_status min_interval=0.1')
+    reactor.advance(1)
+    assert b'_full=1' in transport.take()
+
+    obj['status']['POWER'] = 'Off'
+    reactor.advance(1)
+    reply = transport.take()
+    assert b'POWER=Off' in reply and b'_full=0' in reply and b'SUPPLY_V' not in reply
+
+    pair.disconnect()
+    hwpair.disconnect()
+
+
+def test_example(reactor):
+    import example
+
+    obj = {'hw_connected': 0, 'val1': 0, 'val2': 0, 'val3': 0}
+    daemon = SimpleFactory(example.DaemonProtocol, obj, reactor=reactor, name='example')
+    hw = SimpleFactory(example.HWProtocol, obj, reactor=reactor)
+    obj['daemon'] = daemon
+    obj['hw'] = hw
+
+    hwpair = Pair(hw, SimpleFactory(SimpleProtocol, {}, reactor=reactor))
+    pair = Pair(daemon, SimpleFactory(SimpleProtocol, {}, reactor=reactor))
+    daemonp, transport = pair.protocols[0], pair.transports[0]
+    transport.take()
+    hwpair.transports[0].take()
+
+    daemonp.processMessage('set val1=10 val3=abc')
+    daemonp.processMessage('get_status')
+    assert transport.take() == b'status hw_connected=1 val1=10 val2=0 val3=abc\n'
+
+    # Unknown commands are passed to the hardware
+    daemonp.processMessage('reset')
+    assert hwpair.transports[0].take() == b'reset\n'
+
+    hwpair.protocols[0].processMessage('ok')
+
+    pair.disconnect()
+    hwpair.disconnect()
+
+
+def test_pfeiffer():
+    pytest.importorskip('serial')
+    import pfeiffer
+
+    from conftest import FakeTransport
+
+    obj = {'hw_connected': 0, 'status': -1, 'pressure': 0}
+    proto = pfeiffer.HWProtocol()
+    proto.object = obj
+    transport = FakeTransport(1)
+    proto.makeConnection(transport)
+    assert obj['hw_connected'] == 1
+
+    proto.update()
+    assert transport.take() == b'COM\r\n'
+
+    proto.dataReceived(b'0,1.2500E-03\r\n')
+    assert obj['status'] == 0
+    assert obj['pressure'] == 1.25e-3
+
+    proto.connectionLost(None)
+    assert obj['hw_connected'] == 0
@@ -0,0 +1,73 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from framing import LineFramer
+
+
+def collect(framer):
+    return [(is_binary, view.tobytes()) for is_binary, view in framer.frames()]
+
+
+def test_partial_frames():
+    framer = LineFramer(b'\0\n')
+
+    framer.feed(b'get_st')
+    assert collect(framer) == []
+    assert len(framer) == 6
+
+    framer.feed(b'atus\nset a=1\0se')
+    assert collect(framer) == [(False, b'get_status'), (False, b'set a=1')]
+    assert len(framer) == 2
+
+    framer.feed(b't b=2\n')
+    assert collect(framer) == [(False, b'set b=2')]
+    assert len(framer) == 0
+
+
+def test_single_delimiter():
+    framer = LineFramer(b'\r')
+
+    framer.feed(b'1.0\r2.0\n3.0\r')
+    assert collect(framer) == [(False, b'1.0'), (False, b'2.0\n3.0')]
+
+
+def test_binary_frames():
+    framer = LineFramer(b'\n')
+
+    # Binary block may contain delimiters, and is requested from within the loop, like processMessage() does
+    framer.feed(b'image 5\nab\ncdtext\n')
+    result = []
+    for is_binary, view in framer.frames():
+        result.append((is_binary, view.tobytes()))
+        if view.tobytes() == b'image 5':
+            framer.switchToBinary(5)
+
+    assert result == [(False, b'image 5'), (True, b'ab\ncd'), (False, b'text')]
+
+    # Binary block split between several chunks
+    framer.switchToBinary(4)
+    framer.feed(b'\x00\x01')
+    assert collect(framer) == []
+    framer.feed(b'\x02\x03next\n')
+    assert collect(framer) == [(True, b'\x00\x01\x02\x03'), (False, b'next')]
+
+
+def test_buffer_compaction():
+    framer = LineFramer(b'\n')
+
+    for i in range(1000):
+        framer.feed(b'message %d\npartial' % i)
+        assert collect(framer) == [(False, (b'partial' if i else b'') + b'message %d' % i)]
+
+    # Consumed data does not accumulate
+    assert len(framer._buffer) < 100
+    assert len(framer) == len(b'partial')
+
+
+def test_reset():
+    framer = LineFramer(b'\n')
+    framer.feed(b'abc')
+    framer.switchToBinary(10)
+    framer.reset()
+
+    framer.feed(b'def\n')
+    assert collect(framer) == [(False, b'def')]
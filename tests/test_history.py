@@ -0,0 +1,84 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import datetime
+
+import numpy as np
+import pytest
+
+from history import History
+
+t0 = datetime.datetime(2020, 1, 1)
+
+
+def fill(history, values):
+    for value in values:
+        history.append(t0 + datetime.timedelta(seconds=value), {'a': value, 'b': 'text' if value % 2 else -value})
+
+
+def test_append_and_view():
+    history = History(['time', 'a', 'b'], depth=5)
+    fill(history, [0, 1, 2])
+
+    assert len(history) == 3
+    assert history.view('a').tolist() == [0, 1, 2]
+    assert np.isnan(history.view('b')[1]) and history.view('b')[2] == -2
+    assert history.times()[0] == np.datetime64('2020-01-01T00:00:00')
+    assert np.isnan(history.view('time')).sum() == 0
+
+    # Read-only views into the buffer
+    with pytest.raises(ValueError):
+        history.view('a')[0] = 10
+
+
+def test_wraparound():
+    history = History(['time', 'a'], depth=5)
+
+    for n in range(1, 23):
+        history.append(t0, {'a': n - 1})
+
+        # Last depth samples, oldest first, always contiguous
+        expected = list(range(max(0, n - 5), n))
+        assert history.view('a').tolist() == expected
+        assert len(history) == len(expected)
+        assert history.first() == n - len(expected)
+
+    assert history.count == 22
+    assert history.view('a', since=20).tolist() == [20, 21]
+    assert history.view('a', since=10).tolist() == [17, 18, 19, 20, 21]
+    assert history.view('a', since=22).tolist() == []
+
+
+def test_columns():
+    history = History(['time', 'a'], depth=5)
+    fill(history, range(8))
+
+    result = history.columns()
+    assert result['reset'] and result['seq'] == 8
+    assert result['values']['a'] == [3, 4, 5, 6, 7]
+    assert result['time'][-1] - result['time'][0] == 4000
+
+    # Incremental
+    result = history.columns(since=6)
+    assert not result['reset']
+    assert result['values']['a'] == [6, 7]
+
+    # No longer kept, or from the future
+    assert history.columns(since=1)['reset']
+    assert history.columns(since=100)['reset']
+
+
+def test_clear():
+    history = History(['time', 'a'], depth=5)
+    fill(history, range(4))
+    version = history.version
+
+    history.clear()
+    assert history.version > version
+    assert len(history) == 0
+    assert history.view('a').tolist() == []
+
+    # Sequence numbers continue, and readers of the old data get reset
+    fill(history, [10, 11])
+    assert history.view('a').tolist() == [10, 11]
+    assert history.columns(since=2)['reset']
+    assert history.columns(since=5)['values']['a'] == [11]
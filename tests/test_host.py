@@ -0,0 +1,61 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import host
+from daemon import SimpleFactory, SimpleProtocol
+
+from conftest import Pair
+
+# Minimal device daemon script, as expected by host.py
+module = '''
+from optparse import OptionParser
+from daemon import SimpleFactory, SimpleProtocol
+
+
+def getOptionParser():
+    parser = OptionParser()
+    parser.add_option('-p', '--port', action='store', dest='port', type='int')
+    parser.add_option('-n', '--name', action='store', dest='name')
+    return parser
+
+
+def buildDaemon(options, reactor=None):
+    obj = {}
+    daemon = SimpleFactory(SimpleProtocol, obj, reactor=reactor, name=options.name)
+    obj['daemon'] = daemon
+    obj['hw'] = SimpleFactory(SimpleProtocol, obj, reactor=reactor)
+    daemon.listen(options.port)
+    return daemon
+'''
+
+
+def test_exit_stops_only_one_hosted_daemon(reactor, tmp_path):
+    path = tmp_path / 'fake_device.py'
+    path.write_text(module)
+
+    daemons = [host.startDevice({'name': name, 'module': str(path), 'options': '-p %d -n %s' % (port, name)}, reactor=reactor)
+               for name, port in [('one', 7101), ('two', 7102)]]
+    assert len(reactor.tcpServers) == 2
+
+    # Client and hardware connections of the first daemon
+    client = SimpleFactory(SimpleProtocol, {}, reactor=reactor)
+    pair1 = Pair(client, daemons[0])
+    hw = Pair(daemons[0].object['hw'], SimpleFactory(SimpleProtocol, {}, reactor=reactor))
+    pair2 = Pair(client, daemons[1])
+
+    pair1.protocols[0].message('exit')
+    pair1.pump()
+
+    assert not reactor.hasStopped
+    assert not daemons[0]._ports
+    assert not pair1.transports[1].connected
+    assert not hw.transports[0].connected
+
+    # The other one is still alive
+    assert daemons[1]._ports
+    assert pair2.transports[1].connected
+    pair2.protocols[0].message('get_id')
+    pair2.pump()
+    assert pair2.protocols[0].messages_in == 1
+
+    for pair in [pair1, hw, pair2]:
+        pair.disconnect()
@@ -0,0 +1,157 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+import pytest
+
+pytest.importorskip('psycopg2')
+pytest.importorskip('matplotlib')
+
+from daemon import SimpleFactory, SimpleProtocol
+from command import Command
+
+from conftest import Pair
+
+
+def makeMonitor(reactor):
+    import monitor
+
+    obj = {'clients': OrderedDict(), 'history': {}, 'db_status_interval': 60}
+    factory = monitor.MonitorFactory(monitor.MonitorProtocol, obj, reactor=reactor, name='monitor')
+    peer = SimpleFactory(SimpleProtocol, {}, reactor=reactor, name='peer')
+
+    return Pair(factory, peer)
+
+
+def test_console_only_commands_refused_to_peers(reactor):
+    pair = makeMonitor(reactor)
+    pair.pump()
+    monitor, peer = pair.protocols
+
+    # Routed to the monitor from the peer side
+    peer.message('set peer.something=1')
+    peer.message('broadcast exit')
+    peer.message('profile start')
+    pair.pump()
+
+    assert monitor.factory.commands.refused_commands == 3
+    assert monitor.factory.commands.unknown_commands == 0
+
+    # The same command is accepted from console or web interface
+    replies = []
+    assert monitor.factory.commands.dispatch(Command('clients'), replies.append)
+
+    pair.disconnect()
+
+
+def test_stale_status_delta_discarded(reactor):
+    pair = makeMonitor(reactor)
+    pair.pump()
+    monitor, peer = pair.protocols
+    pair.transports[0].take()
+
+    monitor.processStatus({'_version': 5, '_full': 1, 'a': 1, 'b': 2})
+    monitor.processStatus({'_version': 7, '_full': 0, 'a': 3})
+    monitor.processStatus({'_version': 6, '_full': 0, 'b': 4})
+
+    assert monitor.status == {'a': 3, 'b': 2}
+    assert monitor.status_version == 7
+    assert b'get_status delta=0' in pair.transports[0].take()
+
+    pair.disconnect()
+
+
+def test_pushed_status_sampled_on_update(reactor):
+    from history import History
+
+    pair = makeMonitor(reactor)
+    monitor, peer = pair.protocols
+    monitor.object['history']['peer'] = {'plot': History(['time', 'a'], depth=10)}
+    history = monitor.object['history']['peer']['plot']
+
+    monitor.processMessage('id name=peer status=delta,push')
+    monitor.processStatus({'_version': 1, '_full': 1, 'a': 1})
+    monitor.processStatus({'_version': 2, '_full': 0, 'a': 2})
+    # Empty heartbeat
+    monitor.processStatus({'_version': 2, '_full': 0})
+    assert history.version == 0
+
+    monitor.update()
+    monitor.update()
+    assert history.version == 2
+
+    pair.disconnect()
+
+
+def test_plot_data_malformed_since(reactor):
+    import datetime
+    import json
+    import monitor
+    from history import History
+    from twisted.web.test.requesthelper import DummyRequest
+
+    pair = makeMonitor(reactor)
+    factory = pair.protocols[0].factory
+    history = History(['time', 'a'], depth=10)
+    factory.object['history']['peer'] = {'plot': history}
+    for i in range(3):
+        history.append(datetime.datetime.utcnow(), {'a': i})
+
+    web = monitor.WebMonitor(factory, factory.object, plot_workers=0)
+
+    for query, reset, length in [(b'since=2', False, 1), (b'since=abc', True, 3), (b'since=', True, 3)]:
+        request = DummyRequest([])
+        request.uri = b'/monitor/data/peer/plot?' + query
+        result = json.loads(web.render_GET(request))
+
+        assert request.responseCode in (None, 200)
+        assert result['reset'] == reset
+        assert len(result['values']['a']) == length
+
+    pair.disconnect()
+
+
+def test_plot_pool_recreated_after_crash(reactor, monkeypatch):
+    import datetime
+    import monitor
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+    from history import History
+
+    class Pool(object):
+        def __init__(self, broken):
+            self.broken = broken
+            self.shut = False
+
+        def submit(self, func, *args):
+            future = Future()
+            if self.broken:
+                future.set_exception(BrokenProcessPool('worker died'))
+            else:
+                future.set_result(b'png')
+            return future
+
+        def shutdown(self, wait=True):
+            self.shut = True
+
+    pools = [Pool(True), Pool(False)]
+    monkeypatch.setattr(monitor.PlotCache, '_makePool', lambda self: pools.pop(0))
+    monkeypatch.setattr(monitor.plotting, 'snapshot', lambda plot, history: ())
+    reactor.callFromThread = lambda func, *args: func(*args)
+
+    history = History(['time', 'a'], depth=10)
+    history.append(datetime.datetime.utcnow(), {'a': 1})
+    obj = {'clients': {'peer': {'plots': {'plot': {}}}}, 'history': {'peer': {'plot': history}}}
+    cache = monitor.PlotCache(obj, reactor, workers=1)
+    broken = cache._pool
+
+    errors = []
+    cache.get('peer', 'plot').addErrback(errors.append)
+    assert len(errors) == 1 and errors[0].check(BrokenProcessPool)
+    assert broken.shut and cache._pool is not broken
+    assert cache.restarts == 1
+
+    # Next request is rendered by the new pool
+    results = []
+    cache.get('peer', 'plot').addCallback(results.append)
+    assert results[0][0] == b'png'
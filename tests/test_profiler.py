@@ -0,0 +1,36 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import tempfile
+import time
+
+import profiler
+from command import Command
+
+
+def test_report_file_is_fixed(tmp_path):
+    target = tmp_path / 'target'
+    target.write_text('keep')
+
+    result = profiler.command(Command('profile report file=%s' % target), name='test')
+
+    assert target.read_text() == 'keep'
+    assert os.path.dirname(result['file']) == tempfile.gettempdir()
+    os.unlink(result['file'])
+
+
+def test_report_while_sampling():
+    prof = profiler.Profiler()
+    prof.start(mode='sample', interval=0.0001)
+
+    try:
+        t0 = time.time()
+        while time.time() < t0 + 0.5:
+            # New functions appear in the stack on every call, so the counts keep growing
+            exec(compile('def f%d(): return sum(range(1000))\nf%d()' % (prof.samples, prof.samples), '<test>', 'exec'), {})
+            report = prof.report()
+    finally:
+        prof.stop()
+
+    assert prof.samples > 0
+    assert 'samples every' in report
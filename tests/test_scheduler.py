@@ -0,0 +1,91 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from scheduler import PollScheduler
+
+
+def test_order_and_period(reactor):
+    scheduler = PollScheduler(reactor)
+    calls = []
+
+    scheduler.add(lambda: calls.append(('a', reactor.seconds())), 1.0, phase=0.5)
+    scheduler.add(lambda: calls.append(('b', reactor.seconds())), 2.0, phase=0.2)
+
+    for _ in range(40):
+        reactor.advance(0.1)
+
+    assert [(name, round(time, 6)) for name, time in calls] == [('b', 0.2), ('a', 0.5), ('a', 1.5), ('b', 2.2), ('a', 2.5), ('a', 3.5)]
+    # Single reactor timer for all the tasks
+    assert len(reactor.getDelayedCalls()) == 1
+
+
+def test_first_call_soon(reactor):
+    scheduler = PollScheduler(reactor)
+    calls = []
+
+    # Default phase is limited, so slow tasks start soon after registration
+    scheduler.add(lambda: calls.append(reactor.seconds()), 100.0)
+    reactor.advance(scheduler._max_phase)
+
+    assert len(calls) == 1
+
+
+def test_removal(reactor):
+    scheduler = PollScheduler(reactor)
+    calls = []
+
+    task1 = scheduler.add(lambda: calls.append(1), 1.0, phase=0)
+    task2 = scheduler.add(lambda: calls.append(2), 1.0, phase=0.5)
+    reactor.advance(0)
+    assert calls == [1]
+
+    task1.stop()
+    task1.stop()
+    assert scheduler.stats()['tasks'] == 1
+
+    reactor.advance(0.5)
+    reactor.advance(1)
+    assert calls == [1, 2, 2]
+
+    # The task may stop itself from within the call
+    task3 = scheduler.add(lambda: task3.stop(), 1.0, phase=0)
+    reactor.advance(0)
+    assert not task3.running
+
+    task2.stop()
+    reactor.advance(10)
+    assert calls == [1, 2, 2]
+    assert scheduler.stats()['tasks'] == 0
+    assert not reactor.getDelayedCalls()
+
+
+def test_overruns_and_errors(reactor):
+    scheduler = PollScheduler(reactor)
+    calls = []
+
+    def fail():
+        calls.append(reactor.seconds())
+        raise RuntimeError('test')
+
+    task = scheduler.add(fail, 1.0, phase=0)
+    reactor.advance(0)
+
+    # Reactor was busy for a while, the late call is done once, and missed periods are skipped, not called in a burst
+    reactor.advance(3.5)
+    assert calls == [0, 3.5]
+    assert task.overruns == 2
+    assert task.max_lateness == 2.5
+    assert task.errors == 2
+
+    # Back on the original phase grid
+    reactor.advance(0.5)
+    assert calls == [0, 3.5, 4.0]
+
+
+def test_invalid_period(reactor):
+    scheduler = PollScheduler(reactor)
+
+    for period in [0, -1, float('nan')]:
+        with pytest.raises(ValueError):
+            scheduler.add(lambda: None, period)
@@ -0,0 +1,100 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from daemon import SimpleFactory, SimpleProtocol
+from status import StatusTracker, StatusSubscription
+
+from conftest import Pair
+
+
+def test_tracker_delta():
+    tracker = StatusTracker()
+    assert tracker.update({'a': 1, 'b': 2}) == ['a', 'b']
+    v1 = tracker.version
+
+    assert tracker.update({'a': 1, 'b': 2}) == []
+    assert tracker.version == v1
+
+    tracker.update({'a': 1, 'b': 3})
+    assert tracker.delta(v1) == ({'b': 3}, False)
+    assert tracker.delta(tracker.version) == ({}, False)
+    assert tracker.delta(0) == ({'a': 1, 'b': 3}, True)
+    # Unknown version, like from before the daemon restart
+    assert tracker.delta(tracker.version + 10) == ({'a': 1, 'b': 3}, True)
+
+    # Removals can only be sent as full snapshot
+    v2 = tracker.version
+    tracker.update({'a': 1})
+    assert tracker.delta(v2) == ({'a': 1}, True)
+
+
+def test_subscription_changes():
+    sub = StatusSubscription(heartbeat=10, deadband=0.5, deadbands={'exact': 0})
+
+    assert sub.changes({'t': 1.0, 'exact': 1.0, 's': 'x'}, 0) == ({'t': 1.0, 'exact': 1.0, 's': 'x'}, True)
+    assert sub.changes({'t': 1.0, 'exact': 1.0, 's': 'x'}, 1) is None
+
+    # Small moves are suppressed, also when accumulating, until they exceed the deadband from the last sent value
+    assert sub.changes({'t': 1.2, 'exact': 1.0, 's': 'x'}, 2) is None
+    assert sub.changes({'t': 1.4, 'exact': 1.0, 's': 'x'}, 3) is None
+    assert sub.changes({'t': 1.6, 'exact': 1.0, 's': 'x'}, 4) == ({'t': 1.6}, False)
+    assert sub.suppressed == 2
+
+    # Per-key deadband, and non-numerical values
+    assert sub.changes({'t': 1.6, 'exact': 1.01, 's': 'y'}, 5) == ({'exact': 1.01, 's': 'y'}, False)
+
+    # Heartbeat
+    assert sub.changes({'t': 1.6, 'exact': 1.01, 's': 'y'}, 14) is None
+    assert sub.changes({'t': 1.6, 'exact': 1.01, 's': 'y'}, 15) == ({}, False)
+
+    # Removed value
+    assert sub.changes({'t': 1.6, 's': 'y'}, 16) == ({'t': 1.6, 's': 'y'}, True)
+    assert sub.pushes == 5
+
+
+def test_subscription_rate_limit(reactor):
+    state = {'value': 0}
+    polls = []
+
+    class Protocol(SimpleProtocol):
+        def getStatus(self):
+            polls.append(reactor.seconds())
+            return dict(state)
+
+    factory = SimpleFactory(Protocol, {}, reactor=reactor)
+    pair = Pair(factory, SimpleFactory(SimpleProtocol, {}, reactor=reactor))
+    protocol, transport = pair.protocols[0], pair.transports[0]
+    transport.take()
+
+    protocol.processMessage('subscribe_status min_interval=0.5 heartbeat=1.9')
+    # First push happens after random phase within min_interval
+    reactor.advance(0.5)
+    assert transport.take().startswith(b'status value=0 ')
+    del polls[:]
+
+    # Value changes every 0.125 s, but is polled and pushed only every 0.5 s
+    # (the clock is advanced in small steps, so the calls are late by at most one step)
+    step = 1 / 64
+    for i in range(40):
+        state['value'] = i
+        reactor.pump([step] * 8)
+
+    assert all(abs(b - a - 0.5) <= step for a, b in zip(polls, polls[1:]))
+    replies = transport.take().splitlines()
+    # Only the first poll may see the value unchanged
+    assert 9 <= len(polls) <= 11 and len(polls) - 1 <= len(replies) <= len(polls)
+    values = [int(r.split()[1].split(b'=')[1]) for r in replies]
+    assert values == sorted(values) and values[-1] >= 36
+
+    # Nothing changes, only heartbeats on the first poll after 1.9 s
+    reactor.pump([0.125] * 4)
+    transport.take()
+    reactor.pump([0.125] * 72)
+    assert transport.take().count(b'status ') == 4
+
+    # No more pushes after unsubscribing
+    protocol.processMessage('unsubscribe_status')
+    state['value'] = -1
+    reactor.advance(10)
+    assert transport.take() == b''
+
+    pair.disconnect()
@@ -0,0 +1,86 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+pytest.importorskip('pylibftdi')
+pytest.importorskip('serial')
+pytest.importorskip('pyudev')
+
+
+class FakeFunctions(object):
+    def __init__(self, calls):
+        self.calls = calls
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append(name)
+
+
+class FakeDevice(object):
+    def __init__(self):
+        self.closed = True
+        self.calls = []
+        self.ftdi_fn = FakeFunctions(self.calls)
+
+    def open(self):
+        self.closed = False
+        self.calls.append('open')
+
+    def close(self):
+        self.closed = True
+        self.calls.append('close')
+
+    def flush(self, what):
+        self.calls.append('flush')
+
+
+class FakeHotplug(object):
+    def find(self, **kwargs):
+        return []
+
+    def register(self, *args, **kwargs):
+        return None
+
+
+def makeProtocol(reactor, monkeypatch):
+    import daemon_usb
+
+    monkeypatch.setattr(daemon_usb.HotplugService, 'forReactor', classmethod(lambda cls, reactor=None: FakeHotplug()))
+
+    proto = daemon_usb.FTDIProtocol('test', {})
+    proto._updateTimer.stop()
+    proto._readTimer.stop()
+    proto._reactor = reactor
+    proto.device = FakeDevice()
+
+    return proto
+
+
+def test_ftdi_setup_does_not_block(reactor, monkeypatch):
+    proto = makeProtocol(reactor, monkeypatch)
+
+    results = []
+    proto.ConnectionMade().addCallback(results.append)
+
+    # Returns right after opening, the rest is done later
+    assert proto.device.calls == ['open', 'ftdi_set_line_property']
+
+    reactor.advance(proto._settle_delay)
+    assert proto.device.calls[-1] == 'flush'
+    assert not results
+
+    reactor.advance(proto._settle_delay)
+    assert proto.device.calls[-2:] == ['ftdi_setflowctrl', 'ftdi_setrts']
+    assert results == [True]
+
+
+def test_ftdi_removed_while_settling(reactor, monkeypatch):
+    proto = makeProtocol(reactor, monkeypatch)
+
+    results = []
+    proto.ConnectionMade().addCallback(results.append)
+    proto.ConnectionLost()
+
+    reactor.advance(proto._settle_delay)
+    reactor.advance(proto._settle_delay)
+    assert 'flush' not in proto.device.calls and 'ftdi_setflowctrl' not in proto.device.calls
+    assert results == [False]
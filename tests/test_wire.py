@@ -0,0 +1,31 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import wire
+from command import Command
+
+
+def roundtrip(kwargs):
+    return Command(wire.toString('status', kwargs)).kwargs
+
+
+def test_floats_are_lossless():
+    values = {'time': 1760812345.123456, 'small': 1.2345678901234567e-12, 'third': 1/3, 'one': 1.0, 'neg': -273.15}
+
+    result = roundtrip(values)
+
+    for key, value in values.items():
+        assert float(result[key]) == value
+
+
+def test_numpy_floats_are_lossless():
+    np = __import__('pytest').importorskip('numpy')
+
+    value = np.float64(1760812345.123456)
+
+    assert float(roundtrip({'t': value})['t']) == value
+
+
+def test_backslashes_survive():
+    values = {'path': 'C:\\data\\frame.fits', 'spaced': 'a \\ b', 'quoted': 'say "hi" \\n', 'plain': 'value'}
+
+    assert roundtrip(values) == values
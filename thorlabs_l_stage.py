@@ -4,7 +4,8 @@ from collections import namedtuple
 import struct as st
 #from threading import Thread
 
-from daemon import SimpleFactory, SimpleProtocol, FTDIProtocol, catch
+from daemon import SimpleFactory, SimpleProtocol, catch
+from daemon_usb import FTDIProtocol
 from time import sleep
 
 
@@ -426,14 +427,16 @@ class ThorlabsLSProtocol(FTDIProtocol):
     _buffer = bytes()
     _read_msg = None
 
+    _reader = 'thread'
+
     @catch
-    def __init__(self, serial_num, obj, debug=False):
+    def __init__(self, serial_num, obj, debug=False, reader=None):
         # commands send when device not busy to keep tabs on the state
         self.status_commands = [{'msg': Message(Message.MGMSG_MOT_REQ_STATUSUPDATE), 'source': 'itself',
                                  'get_c': -Message.MGMSG_MOT_GET_STATUSUPDATE, 'unit': 'mm'}]
         self.commands = []
         self._debug = debug
-        super().__init__(serial_num, obj)
+        super().__init__(serial_num, obj, reader=reader)
         self.name = 'hw'
         self.type = 'hw'
         self._refresh = 1
@@ -467,8 +470,12 @@ class ThorlabsLSProtocol(FTDIProtocol):
         self.commands.append({'msg': Message(Message.MGMSG_MOT_SET_HOMEPARAMS, data=params), 'source': 'itself', 'get_c': 0})
         params = st.pack('<HHH', 1, 20, 100)
         self.commands.append({'msg': Message(Message.MGMSG_MOT_SET_POWERPARAMS, data=params), 'source': 'itself', 'get_c': 0})
-        super().ConnectionMade()
-        self.object['hw_connected'] = 1
+        super().ConnectionMade().addCallback(self.DeviceReady)
+
+    @catch
+    def DeviceReady(self, ready):
+        if ready:
+            self.object['hw_connected'] = 1
 
     @catch
     def DecodeStatusBits(self, status_bits):
@@ -610,6 +617,24 @@ class ThorlabsLSProtocol(FTDIProtocol):
         else:
             print('unrequested responce:', '0x{:04x}'.format(msg.messageID), msg, r_str)
 
+    def extractFrame(self, buffer):
+        """Complete message from the beginning of the buffer, used by the reader thread mode"""
+        if len(buffer) < Message.MGMSG_HEADER_SIZE:
+            return None
+
+        msg = Message.unpack(bytes(buffer[:Message.MGMSG_HEADER_SIZE]), header_only=True)
+        if not msg.hasdata:
+            return msg, Message.MGMSG_HEADER_SIZE
+
+        size = Message.MGMSG_HEADER_SIZE + msg.datalength
+        if len(buffer) < size:
+            return None
+
+        msglist = list(msg)
+        msglist[-1] = bytes(buffer[Message.MGMSG_HEADER_SIZE:size])
+
+        return Message._make(msglist), size
+
     @catch
     def read(self):
         if not self.object['hw_connected']:
@@ -674,6 +699,7 @@ if __name__ == '__main__':
                       help='Serial number of the device to connect to. To ensure the USB device is accesible add udev rule, something like: ATTRS{idVendor}=="0403", ATTRS{idProduct}=="faf0" , MODE="0666", GROUP="plugdev"', action='store', dest='serial_num', type='str', default='40824267')
     parser.add_option('-p', '--port', help='Daemon port', action='store', dest='port', type='int', default=7028)
     parser.add_option('-n', '--name', help='Daemon name', action='store', dest='name', default='thorlabs_l_stage1')
+    parser.add_option('-r', '--reader', help='Device reading mode, thread or poll', action='store', dest='reader', choices=['thread', 'poll'], default='thread')
     parser.add_option("-D", '--debug', help='Debug mode', action="store_true", dest="debug")
 
     (options, args) = parser.parse_args()
@@ -699,7 +725,7 @@ if __name__ == '__main__':
     daemon.name = options.name
     obj['daemon'] = daemon
 
-    hw = ThorlabsLSProtocol(options.serial_num, obj, debug=options.debug)
+    hw = ThorlabsLSProtocol(options.serial_num, obj, debug=options.debug, reader=options.reader)
     obj['hw'] = hw
 
     # Incoming connections
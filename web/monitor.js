@@ -28,6 +28,9 @@ Monitor = function(parent_id, base="/monitor", title="Monitor"){
     this.refreshDelay = 2000;
     this.requestState();
 
+    // Plots are drawn in the browser from incremental data, unless asked for server-rendered images with ?plots=png
+    this.clientPlots = !!document.createElement('canvas').getContext && window.location.search.indexOf('plots=png') < 0;
+
     // SockJS
     this.ws_base = '/ws/';
     this.connectWS();
@@ -229,7 +232,18 @@ Monitor.prototype.renderClient = function(client)
 
     // Create updaters to refresh the plots
     for(var name in client['params']['plots']){
-        new Updater(client['widget'].find('.monitor-plot-'+client['name']+'-'+name), 10000);
+        var images = client['widget'].find('.monitor-plot-'+client['name']+'-'+name);
+
+        if(this.clientPlots){
+            var params = client['params']['plots'][name];
+            images.each($.proxy(function(i, image){
+                var canvas = $('<canvas/>', {class: $(image).attr('class'), style: 'max-width: 100%'});
+                canvas.attr({width: params['width'], height: params['height']});
+                $(image).replaceWith(canvas);
+                new Plotter(canvas, this.base + '/data/' + client['name'] + '/' + name, params, 2000);
+            }, this));
+        } else
+            new Updater(images, 10000);
     }
 
     // Buttons
@@ -288,3 +302,224 @@ Monitor.prototype.activateButtons = function(parent)
         }
     });
 }
+
+// Plot drawn in the browser, getting only the new points from /monitor/data/{client}/{plot} every time
+Plotter = function(canvas, url, params, timeout){
+    this.canvas = $(canvas);
+    this.url = url;
+    this.params = params;
+    this.timeout = timeout;
+
+    this.seq = null; // Sequence number of the next point to request
+    this.depth = 1000;
+    this.time = [];
+    this.values = {};
+
+    this.timer = 0;
+    this.update();
+}
+
+Plotter.prototype.colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf'];
+
+Plotter.prototype.update = function(){
+    if(!this.canvas.is(":visible") && this.seq !== null){
+        this.run();
+        return;
+    }
+
+    $.ajax({
+        url: this.url + (this.seq === null ? '' : '?since=' + this.seq),
+        dataType: "json",
+        timeout: 5000,
+        context: this,
+
+        success: function(json){
+            this.append(json);
+            this.draw();
+        },
+
+        complete: function(){
+            this.run();
+        }
+    });
+}
+
+Plotter.prototype.run = function(){
+    clearTimeout(this.timer);
+    this.timer = setTimeout($.proxy(this.update, this), this.timeout);
+}
+
+Plotter.prototype.append = function(json){
+    if(json.reset){
+        this.time = [];
+        this.values = {};
+    }
+
+    this.depth = json.depth;
+    this.seq = json.seq;
+
+    this.time = this.time.concat(json.time);
+    for(var name in json.values)
+        this.values[name] = (this.values[name] || []).concat(json.values[name]);
+
+    // Keep the same number of points as the server does
+    var extra = this.time.length - this.depth;
+    if(extra > 0){
+        this.time.splice(0, extra);
+        for(var name in this.values)
+            this.values[name].splice(0, extra);
+    }
+}
+
+Plotter.prototype.range = function(arrays, log){
+    var min = Infinity, max = -Infinity;
+
+    for(var i = 0; i < arrays.length; i++)
+        for(var j = 0; j < arrays[i].length; j++){
+            var v = arrays[i][j];
+            if(v === null || (log && v <= 0))
+                continue;
+            if(v < min) min = v;
+            if(v > max) max = v;
+        }
+
+    if(min > max)
+        return null;
+
+    if(log){
+        min = Math.log10(min);
+        max = Math.log10(max);
+    }
+
+    if(min == max){
+        min -= 0.5;
+        max += 0.5;
+    }
+
+    // Same margins as the server-side plots
+    var pad = 0.1*(max - min);
+    return [min - pad, max + pad];
+}
+
+Plotter.prototype.ticks = function(min, max, n){
+    var step = Math.pow(10, Math.floor(Math.log10((max - min)/n)));
+    var err = (max - min)/n/step;
+
+    if(err >= 5) step *= 5;
+    else if(err >= 2) step *= 2;
+
+    var result = [];
+    for(var v = Math.ceil(min/step)*step; v <= max; v += step)
+        result.push(v);
+
+    return result;
+}
+
+Plotter.prototype.draw = function(){
+    var ctx = this.canvas[0].getContext('2d');
+    var width = this.canvas[0].width, height = this.canvas[0].height;
+    var params = this.params;
+    var xname = params['values'][0];
+    var ynames = params['values'].slice(1);
+    var ylog = params['yscale'] == 'log';
+    var istime = xname == 'time';
+
+    var x = istime ? this.time : (this.values[xname] || []);
+    var ys = ynames.map($.proxy(function(name){return this.values[name] || [];}, this));
+
+    ctx.clearRect(0, 0, width, height);
+    ctx.fillStyle = 'white';
+    ctx.fillRect(0, 0, width, height);
+    ctx.font = '12px sans-serif';
+    ctx.fillStyle = 'black';
+
+    var left = 70, right = width - 10, top = params['name'] ? 25 : 10, bottom = height - 40;
+
+    if(params['name']){
+        ctx.textAlign = 'center';
+        ctx.fillText(params['name'], (left + right)/2, 15);
+    }
+
+    var xrange = this.range([x], false);
+    var yrange = this.range(ys, ylog);
+
+    ctx.strokeStyle = 'black';
+    ctx.strokeRect(left, top, right - left, bottom - top);
+
+    // Axis labels
+    ctx.textAlign = 'center';
+    ctx.fillText(params['xlabel'] || xname, (left + right)/2, height - 5);
+    if(params['ylabel']){
+        ctx.save();
+        ctx.translate(12, (top + bottom)/2);
+        ctx.rotate(-Math.PI/2);
+        ctx.fillText(params['ylabel'], 0, 0);
+        ctx.restore();
+    }
+
+    if(!xrange || !yrange)
+        return;
+
+    var sx = function(v){return left + (right - left)*(v - xrange[0])/(xrange[1] - xrange[0]);};
+    var sy = function(v){return bottom - (bottom - top)*((ylog ? Math.log10(v) : v) - yrange[0])/(yrange[1] - yrange[0]);};
+
+    // Ticks and grid
+    ctx.strokeStyle = '#b0b0b0';
+    ctx.lineWidth = 0.5;
+
+    ctx.textAlign = 'center';
+    var xticks = this.ticks(xrange[0], xrange[1], 6);
+    for(var i = 0; i < xticks.length; i++){
+        var px = sx(xticks[i]);
+        ctx.beginPath(); ctx.moveTo(px, top); ctx.lineTo(px, bottom); ctx.stroke();
+        ctx.fillText(istime ? new Date(xticks[i]).toISOString().substr(11, 8) : xticks[i].toPrecision(4)/1, px, bottom + 15);
+    }
+
+    ctx.textAlign = 'right';
+    var yticks = this.ticks(yrange[0], yrange[1], 5);
+    for(var i = 0; i < yticks.length; i++){
+        var v = ylog ? Math.pow(10, yticks[i]) : yticks[i];
+        var py = sy(v);
+        ctx.beginPath(); ctx.moveTo(left, py); ctx.lineTo(right, py); ctx.stroke();
+        ctx.fillText(ylog ? v.toExponential(1) : v.toPrecision(4)/1, left - 5, py + 4);
+    }
+
+    // Data, with gaps where the values are missing
+    ctx.save();
+    ctx.beginPath();
+    ctx.rect(left, top, right - left, bottom - top);
+    ctx.clip();
+    ctx.lineWidth = 1.5;
+
+    for(var j = 0; j < ys.length; j++){
+        var y = ys[j];
+        var pen = false;
+
+        ctx.strokeStyle = this.colors[j % this.colors.length];
+        ctx.beginPath();
+        for(var i = 0; i < y.length && i < x.length; i++){
+            if(y[i] === null || x[i] === null || (ylog && y[i] <= 0)){
+                pen = false;
+                continue;
+            }
+            if(pen)
+                ctx.lineTo(sx(x[i]), sy(y[i]));
+            else
+                ctx.moveTo(sx(x[i]), sy(y[i]));
+            pen = true;
+        }
+        ctx.stroke();
+    }
+    ctx.restore();
+
+    // Legend
+    if(ynames.length > 1){
+        ctx.textAlign = 'left';
+        for(var j = 0; j < ynames.length; j++){
+            ctx.fillStyle = this.colors[j % this.colors.length];
+            ctx.fillRect(left + 8, top + 8 + 15*j, 15, 3);
+            ctx.fillStyle = 'black';
+            ctx.fillText(ynames[j], left + 28, top + 13 + 15*j);
+        }
+    }
+}
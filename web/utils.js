@@ -76,7 +76,27 @@ Updater = function(image_id, timeout){
 }
 
 Updater.prototype.update = function(){
-    if(this.img.is(":visible")){
+    if(this.img.is(":visible") && window.fetch){
+        // Request the same URL every time, so that the browser re-validates its copy
+        // using ETag, and the image is only replaced when the server says it has changed
+        fetch(this.source, {cache: 'no-cache'}).then($.proxy(function(response){
+            var etag = response.headers.get('ETag');
+
+            if(!response.ok || (etag && etag == this.etag)){
+                this.run();
+                return;
+            }
+
+            this.etag = etag;
+
+            return response.blob().then($.proxy(function(blob){
+                if(this.url)
+                    URL.revokeObjectURL(this.url);
+                this.url = URL.createObjectURL(blob);
+                this.img.attr('src', this.url);
+            }, this));
+        }, this)).catch($.proxy(this.run, this));
+    } else if(this.img.is(":visible")){
         if(this.source.indexOf("?") > 0)
             this.img.attr('src', this.source + '&rnd=' + Math.random());
         else
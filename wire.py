@@ -0,0 +1,74 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# Optional compact binary wire format, negotiated between peers during get_id / id handshake.
+# Typed messages are sent as a text header line 'msgpack <length>' followed by <length> bytes
+# of msgpack-encoded [name, kwargs] pair, so the peers not knowing about it are never affected.
+
+try:
+    import msgpack
+    _HAVE_MSGPACK = True
+except ImportError:
+    _HAVE_MSGPACK = False
+
+
+def formats():
+    """List of wire formats supported by this process, in order of preference"""
+    return ['msgpack', 'text'] if _HAVE_MSGPACK else ['text']
+
+
+def negotiate(peer_formats):
+    """Choose the best format supported by both us and the peer, given comma-separated list of its formats"""
+    peer = peer_formats.split(',') if peer_formats else ['text']
+
+    for fmt in formats():
+        if fmt in peer:
+            return fmt
+
+    return 'text'
+
+
+def valueToString(value):
+    """Plain text representation of a single value, compatible with the formatting used by the daemons"""
+    if isinstance(value, float):
+        # Shortest representation which parses back to exactly the same value
+        return repr(float(value))
+    elif isinstance(value, bytes):
+        return value.decode('ascii')
+    else:
+        return str(value)
+
+
+def formatValue(value):
+    """Text representation of a single value, quoted if necessary"""
+    value = valueToString(value)
+
+    if any(_ in value for _ in ' \t"\'\\'):
+        # Should be quoted to survive the round-trip through Command
+        value = '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    return value
+
+
+def toString(name, kwargs):
+    """Text representation of the message with given name and keyword arguments"""
+    return " ".join([name] + [_ + '=' + formatValue(kwargs[_]) for _ in kwargs])
+
+
+def _packDefault(value):
+    """Fallback conversion for the values msgpack does not know about, like numpy scalars"""
+    if hasattr(value, 'item'):
+        return value.item()
+
+    return str(value)
+
+
+def pack(name, kwargs):
+    """Binary representation of the message"""
+    return msgpack.packb([name, kwargs], use_bin_type=True, default=_packDefault)
+
+
+def unpack(data):
+    """Decode binary message into (name, kwargs) tuple"""
+    name, kwargs = msgpack.unpackb(data, raw=False)
+
+    return name, kwargs